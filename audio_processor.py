@@ -1,75 +1,411 @@
+import os
 import soundfile as sf
 import numpy as np
 from scipy import signal
-from effects.filters import apply_filter
-from effects.reverb import apply_reverb
-import sounddevice as sd
+import profiling
+from effects.registry import create_stream_effect, get_effect
+from effects.resample import StreamResampler, resampled_length
+from effect_chain import EffectChain, RenderCancelled
+from session import DEFAULT_COMPRESSION, ChunkedAudio, SessionWriter, open_session
+
+# tamaño de bloque por defecto para el modo streaming (en frames)
+DEFAULT_BLOCK_SIZE = 65536
+
+def _source_unchanged(info):
+    """Si el archivo de la huella sigue estando y es el mismo (tamaño y fecha)"""
+    if info is None:
+        return False
+    try:
+        stat = os.stat(info['path'])
+    except OSError:
+        return False
+    return stat.st_size == info['size'] and stat.st_mtime_ns == info['mtime_ns']
 
 class AudioProcessor:
-    def __init__(self):
+    def __init__(self, spill_to_disk=False, target_rate=None):
         self.sample_rate = None
+        # frecuencia del proyecto: lo que se carga se convierte a esta
+        # (None = la del archivo)
+        self.target_rate = target_rate
         self.audio_data = None
         self.original_audio = None
+        # de donde salio el original tal como estaba al cargarlo: ruta, tamaño,
+        # fecha y frames (las sesiones lo guardan por referencia)
+        self.source_info = None
+        # la sesion abierta, si el audio se lee de ahi
+        self.session = None
         self.is_playing = False
+        # los efectos no se aplican encima del audio, van en una cadena
+        # y audio_data es siempre la salida de la cadena
+        self.set_spill_to_disk(spill_to_disk)
+
+    def set_spill_to_disk(self, spill_to_disk):
+        """
+        spill_to_disk: el original, la salida de cada efecto y las salidas
+        guardadas para undo van a archivos .npy mapeados (np.memmap) en vez de
+        RAM, para editar archivos largos con poca memoria. Vale desde el
+        proximo load_audio
+        """
+        self.spill_to_disk = spill_to_disk
+        self.chain = EffectChain(spill_to_disk=spill_to_disk)
     
-    def load_audio(self, filepath):
-        """Carga el audio (soporta más formatos)"""
-        self.audio_data, self.sample_rate = sf.read(filepath, always_2d=False)
-        self.original_audio = self.audio_data.copy()
-        
-        # convierte a mono para más placer
-        if len(self.audio_data.shape) > 1:
-            self.audio_data = np.mean(self.audio_data, axis=1)
-            self.original_audio = self.audio_data.copy()
-        
-        # normaliza a [-1, 1] de ser necesario
-        if np.issubdtype(self.audio_data.dtype, np.integer):
-            self.audio_data = self.audio_data.astype(np.float32) / np.iinfo(self.audio_data.dtype).max
-            self.original_audio = self.audio_data.copy()
-        
+    def load_audio(self, filepath, downmix=False):
+        """
+        Carga el audio (soporta más formatos) como float32 (frames, canales).
+        downmix: lo pasa a mono (un solo canal) como se hacia antes
+        """
+        audio, sample_rate, source_info = self._decode(filepath, downmix, self.target_rate)
+        self._set_source(audio, sample_rate, source_info)
+        self._close_session()
         return self.sample_rate, self.audio_data
+
+    def _decode(self, filepath, downmix, target_rate):
+        """
+        Lee el archivo sin tocar el estado: devuelve (audio, sample_rate,
+        huella del archivo). Si falla a la mitad el audio anterior queda como estaba
+        """
+        audio = None
+        # antes de leerlo, si cambia mientras se carga la sesion no lo da por bueno
+        stat = os.stat(filepath)
+        try:
+            with sf.SoundFile(filepath) as src:
+                channels = 1 if downmix else src.channels
+                sample_rate = target_rate or src.samplerate
+                # si el archivo viene a otra frecuencia se convierte por bloques
+                resampler = None
+                frames = src.frames
+                if sample_rate != src.samplerate:
+                    resampler = StreamResampler(src.samplerate, sample_rate)
+                    frames = resampled_length(src.frames, src.samplerate, sample_rate)
+
+                # con spill_to_disk es un memmap y se llena por bloques
+                audio = self.chain.source_buffer((frames, channels))
+                position = 0
+                with profiling.stage('load.decode', frames=frames, sample_rate=sample_rate):
+                    for block in src.blocks(blocksize=DEFAULT_BLOCK_SIZE, dtype='float32',
+                                            always_2d=True):
+                        if downmix:
+                            block = np.mean(block, axis=1, keepdims=True)
+                        if resampler is not None:
+                            block = resampler.process(block)
+                        audio[position:position + len(block)] = block
+                        position += len(block)
+                    if resampler is not None:
+                        block = resampler.flush()
+                        audio[position:position + len(block)] = block
+                        position += len(block)
+                if position < len(audio):
+                    # algunos formatos avisan mas frames de los que tienen
+                    audio = audio[:position]
+        except Exception:
+            # el memmap a medio llenar no sirve, se suelta y se borra su archivo
+            del audio
+            self.chain.discard_source_buffer()
+            raise
+
+        source_info = {'path': os.path.abspath(filepath), 'size': stat.st_size,
+                       'mtime_ns': stat.st_mtime_ns, 'downmix': downmix, 'frames': len(audio)}
+        return audio, sample_rate, source_info
+
+    def _set_source(self, audio, sample_rate, source_info):
+        # sin efectos la salida de la cadena es la fuente misma, no hace falta copiarla
+        self.sample_rate = sample_rate
+        self.original_audio = audio
+        self.chain.set_source(self.original_audio, self.sample_rate)
+        self.audio_data = self.original_audio
+        self.source_info = source_info
     
-    def save_audio(self, filepath, data=None):
-        """Guarda el audio usando soundfile"""
+    def save_audio(self, filepath, data=None, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Guarda el audio usando soundfile (PCM 16 bits). Se recorta y se escribe
+        por bloques, nunca se arma una copia recortada del audio entero
+        """
         if data is None:
             data = self.audio_data
-        
-        # se asegura de que esté dentro de [-1, 1]
-        data = np.clip(data, -1.0, 1.0)
-        
-        sf.write(filepath, data, self.sample_rate, subtype='PCM_16')
+        channels = data.shape[1] if data.ndim > 1 else 1
+
+        with sf.SoundFile(filepath, 'w', samplerate=self.sample_rate, channels=channels,
+                          subtype='PCM_16') as dst:
+            for start in range(0, len(data), block_size):
+                block = data[start:start + block_size]
+                # se asegura de que esté dentro de [-1, 1]
+                with profiling.stage('save.clip', frames=len(block), sample_rate=self.sample_rate):
+                    block = np.clip(block, -1.0, 1.0)
+                with profiling.stage('save.encode', frames=len(block), sample_rate=self.sample_rate):
+                    dst.write(block)
+
+    def save_session(self, filepath, embed_source=False, compression=DEFAULT_COMPRESSION,
+                     callback=None):
+        """
+        Guarda la sesion (.dawsito): de donde salio el original, la cadena de
+        efectos y la salida ya renderizada en float32 sin recortar, comprimida
+        por pedazos. embed_source: guarda tambien el original (si no se guarda
+        solo la ruta y al abrir se vuelve a cargar de ahi).
+        Si la cadena tiene cambios sin renderizar no se guarda la salida y al
+        abrir se renderiza. callback(fraccion): progreso
+        """
+        if self.original_audio is None:
+            raise ValueError("No hay audio!")
+        nodes = self.chain.nodes
+        rendered = bool(nodes) and not any(node.dirty for node in nodes)
+        source = None
+        if self.source_info is not None:
+            # la huella de cuando se cargo, no la del archivo como esta ahora
+            source = dict(self.source_info)
+            source.pop('relative', None)
+            try:
+                source['relative'] = os.path.relpath(source['path'],
+                                                     os.path.dirname(os.path.abspath(filepath)))
+            except ValueError:
+                # otra unidad en windows, queda solo la absoluta
+                pass
+        # si no hay de donde volver a cargarlo (sin ruta, o el archivo ya no es
+        # el que se cargo, ej. una sesion que traia el original adentro) va adentro
+        embed_source = embed_source or not _source_unchanged(source)
+
+        # guardar encima de la sesion abierta: lo que se lee de ella tiene que
+        # quedar en la nueva con el mismo nombre (ver SessionFile.overwrite)
+        overwrite = self.session is not None and self.session.is_same_file(filepath)
+        if overwrite:
+            embed_source = embed_source or self._from_session(self.original_audio)
+            for node in nodes:
+                if self._from_session(node.output) and not (rendered and node is nodes[-1]):
+                    # una salida del medio, en la sesion nueva no esta
+                    node.drop()
+        metadata = {'sample_rate': self.sample_rate, 'target_rate': self.target_rate,
+                    'source': source,
+                    'chain': [[effect_type, params] for effect_type, params in self.chain.specs()]}
+
+        streams = []
+        if embed_source:
+            streams.append(('source', self.original_audio))
+        if rendered:
+            streams.append(('processed', self.audio_data))
+
+        def stream_callback(index):
+            if callback is None:
+                return None
+            return lambda fraction: callback((index + fraction) / len(streams))
+
+        with profiling.stage('session.save', frames=len(self.original_audio),
+                             sample_rate=self.sample_rate):
+            writer = SessionWriter(filepath, metadata, compression)
+            try:
+                for index, (name, audio) in enumerate(streams):
+                    writer.add_stream(name, audio, self.sample_rate, stream_callback(index))
+            except Exception:
+                writer.abort()
+                raise
+            if overwrite:
+                self.session.overwrite(writer)
+            else:
+                writer.close()
+        if callback is not None:
+            callback(1.0)
+
+    def load_session(self, filepath, render=True, callback=None):
+        """
+        Abre una sesion: el audio guardado se lee de a pedazos cuando hace
+        falta (no se descomprime todo al abrir) y si la salida estaba
+        renderizada no se vuelve a renderizar. Si el original no esta adentro
+        se carga de su ruta; si ese archivo cambio desde que se guardo, la
+        salida guardada ya no vale y se renderiza de nuevo.
+        render=False: no renderiza aca (la cadena queda sucia y audio_data es el
+        original hasta el proximo render, ej. para hacerlo en otro hilo).
+        callback: ver EffectChain.render (solo si hay que renderizar)
+        """
+        session = open_session(filepath)
+        try:
+            with profiling.stage('session.open'):
+                return self._load_session(session, filepath, render, callback)
+        except Exception:
+            # si no llego a quedar como la sesion abierta no la usa nadie
+            if self.session is not session:
+                session.close()
+            raise
+
+    def _load_session(self, session, filepath, render, callback):
+        # primero todo lo que puede fallar, en variables locales: si algo no
+        # anda el audio y la cadena de antes quedan como estaban
+        metadata = session.metadata
+        specs = [(effect_type, params) for effect_type, params in metadata['chain']]
+        for effect_type, params in specs:
+            get_effect(effect_type).resolve(params)
+        info = metadata['source']
+        processed = session.audio('processed')
+        source = session.audio('source')
+        if source is None:
+            if info is None:
+                raise ValueError(f"La sesion {filepath} no tiene el audio original")
+            # se carga a la frecuencia de la sesion, la cadena se armo con esa
+            audio, sample_rate, source_info = self._decode(self._find_source(info, filepath),
+                                                           info['downmix'],
+                                                           metadata['sample_rate'])
+            if (source_info['size'] != info['size'] or source_info['mtime_ns'] != info['mtime_ns']
+                    or source_info['frames'] != info['frames']):
+                processed = None
+        else:
+            # la huella guardada: el original adentro salio de ese archivo como estaba entonces
+            audio, sample_rate, source_info = source, source.sample_rate, info
+
+        self._set_source(audio, sample_rate, source_info)
+        self.target_rate = metadata['target_rate']
+        self.chain.restore(specs, processed)
+        self._close_session()
+        self.session = session
+        if render or processed is not None:
+            # si la cadena guardada falla al renderizar queda el original solo (ver render)
+            self.render(callback=callback)
+        return self.sample_rate, self.audio_data
+
+    def _from_session(self, audio):
+        """Si audio se lee de la sesion abierta"""
+        return isinstance(audio, ChunkedAudio) and audio.session is self.session
+
+    @staticmethod
+    def _find_source(info, session_path):
+        """La ruta del original: la absoluta o, si se movio todo junto, la relativa a la sesion"""
+        candidates = [info['path']]
+        if 'relative' in info:
+            candidates.append(os.path.join(os.path.dirname(os.path.abspath(session_path)),
+                                           info['relative']))
+        for path in candidates:
+            if os.path.exists(path):
+                return path
+        raise ValueError(f"No encuentro el audio original de la sesion: {info['path']}")
+
+    def _close_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def process_file(self, input_path, output_path, effects, block_size=DEFAULT_BLOCK_SIZE,
+                     downmix=False, target_rate=None):
+        """
+        Modo streaming: lee el archivo por bloques, le pasa la cadena de efectos
+        y va escribiendo la salida, asi la memoria no crece con la duracion.
+        effects: lista de (effect_type, params) como los de apply_effect
+        target_rate: convierte a esa frecuencia antes de los efectos
+        """
+        with sf.SoundFile(input_path) as src:
+            sample_rate = target_rate or src.samplerate
+            channels = 1 if downmix else src.channels
+            resampler = None
+            if sample_rate != src.samplerate:
+                resampler = StreamResampler(src.samplerate, sample_rate)
+            for effect_type, params in effects:
+                if not get_effect(effect_type).streaming:
+                    raise ValueError(f"{effect_type} necesita el archivo entero, no va en modo streaming")
+            chain = [create_stream_effect(effect_type, sample_rate, channels, **params)
+                     for effect_type, params in effects]
+            # lo que atrasan los efectos con lookahead: se saltea al principio y
+            # se saca al final pasando ceros, asi la salida queda alineada
+            latency = sum(get_effect(effect_type).latency(sample_rate, params)
+                          for effect_type, params in effects)
+            skip = latency
+
+            def run_chain(block):
+                if not len(block):
+                    # el resampler puede no tener nada listo todavia
+                    return block
+                for (effect_type, params), effect in zip(effects, chain):
+                    with profiling.stage(f'stream.{effect_type}', frames=len(block),
+                                         sample_rate=sample_rate):
+                        block = effect.process(block)
+                return np.clip(block, -1.0, 1.0)
+
+            with sf.SoundFile(output_path, 'w', samplerate=sample_rate,
+                              channels=channels, subtype='PCM_16') as dst:
+                for block in src.blocks(blocksize=block_size, dtype='float32',
+                                        always_2d=True):
+                    if downmix:
+                        block = np.mean(block, axis=1, keepdims=True)
+                    if resampler is not None:
+                        block = resampler.process(block)
+
+                    output = run_chain(block)
+                    dst.write(output[skip:])
+                    skip = max(skip - len(output), 0)
+
+                if resampler is not None:
+                    output = run_chain(resampler.flush())
+                    dst.write(output[skip:])
+                    skip = max(skip - len(output), 0)
+                if latency:
+                    tail = run_chain(np.zeros((latency, channels), dtype=np.float32))
+                    dst.write(tail[skip:])
+
+        return sample_rate
     
     def apply_effect(self, effect_type, **params):
-        """Aplica el audio especificado"""
+        """Aplica el audio especificado (lo agrega al final de la cadena)"""
         if self.audio_data is None:
             raise ValueError("No hay audio!")
         
-        if effect_type == 'lowpass':
-            self.audio_data = apply_filter(self.audio_data, self.sample_rate, 'lowpass', 
-                                         cutoff_freq=params.get('cutoff_freq'))
-        elif effect_type == 'highpass':
-            self.audio_data = apply_filter(self.audio_data, self.sample_rate, 'highpass', 
-                                         cutoff_freq=params.get('cutoff_freq'))
-        elif effect_type == 'bandpass':
-            self.audio_data = apply_filter(self.audio_data, self.sample_rate, 'bandpass', 
-                                         low_cut=params.get('low_cut'), 
-                                         high_cut=params.get('high_cut'))
-        elif effect_type == 'bandstop':
-            self.audio_data = apply_filter(self.audio_data, self.sample_rate, 'bandstop', 
-                                         low_cut=params.get('low_cut'), 
-                                         high_cut=params.get('high_cut'))
-        elif effect_type == 'reverb':
-            self.audio_data = apply_reverb(self.audio_data, self.sample_rate,
-                                         decay_time=params.get('decay_time', 1.0),
-                                         mix=params.get('mix', 0.3))
-        else:
-            raise ValueError(f"Unknown effect type: {effect_type}")
-        
+        self.chain.add(effect_type, **params)
+        return self.render()
+
+    def apply_chain(self, effects):
+        """
+        Aplica varios efectos seguidos. effects: lista de (effect_type, params).
+        Los filtros consecutivos se juntan en una sola matriz sos y pasan de
+        una sola vez sobre el buffer
+        """
+        if self.audio_data is None:
+            raise ValueError("No hay audio!")
+
+        self.chain.extend(effects)
+        return self.render(merge_filters=True)
+
+    def update_effect(self, index, **params):
+        """Cambia un efecto de la cadena, solo se re-renderiza de ahi en adelante"""
+        self.chain.update(index, **params)
+        return self.render()
+
+    def remove_effect(self, index):
+        self.chain.remove(index)
+        return self.render()
+
+    def undo(self):
+        """Deshace el ultimo cambio de la cadena"""
+        if not self.chain.undo():
+            return False
+        self.render()
+        return True
+
+    def redo(self):
+        if not self.chain.redo():
+            return False
+        self.render()
+        return True
+
+    def render(self, merge_filters=False, callback=None):
+        """
+        Renderiza lo que haya cambiado en la cadena y lo deja en audio_data.
+        callback: ver EffectChain.render (progreso y cancelacion)
+        """
+        try:
+            with profiling.stage('chain.render'):
+                self.audio_data = self.chain.render(merge_filters=merge_filters,
+                                                    callback=callback)
+        except RenderCancelled:
+            # lo que falto queda sucio, el proximo render sigue de ahi
+            raise
+        except Exception:
+            # si el cambio falla volvemos a lo ultimo que anduvo para no dejar la cadena rota
+            self.chain.rollback()
+            try:
+                self.audio_data = self.chain.render()
+            except Exception:
+                # ni eso se pudo renderizar: queda sucia y se informa el error del cambio
+                pass
+            raise
         return self.audio_data
     
     def reset_audio(self):
-        """Deshace los cambios y deja el original"""
+        """Deshace los cambios y deja el original (se puede deshacer con undo)"""
         if self.original_audio is not None:
-            self.audio_data = self.original_audio.copy()
+            self.chain.clear()
+            self.audio_data = self.chain.render()
             return True
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,229 @@
+"""
+Procesa muchos archivos sin abrir la ventana.
+
+    python batch.py cadena.json "entrada/*.wav" -o salida/ --workers 4 --resume
+
+cadena.json (o .yaml) es una lista de efectos con los mismos tipos y
+parametros de apply_effect (python batch.py --help lista los efectos):
+
+    {"effects": [{"type": "highpass", "cutoff_freq": 80},
+                 {"type": "reverb", "decay_time": 1.5, "mix": 0.2}],
+     "downmix": false}
+
+Las salidas copian las carpetas de las entradas desde la carpeta comun
+(a/x.wav y b/x.wav quedan en salida/a/x.wav y salida/b/x.wav).
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import profiling
+from audio_processor import AudioProcessor
+from effects import parallel
+from effects.registry import available_effects, get_effect
+
+def load_spec(path):
+    """Lee la cadena de efectos (json o yaml) y la deja como lista de (tipo, params)"""
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Para leer yaml hay que instalar pyyaml")
+            try:
+                spec = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                # YAMLError no es ValueError: se pasa a uno (en una linea) para main
+                raise ValueError(f"yaml invalido: {' '.join(str(e).split())}")
+        else:
+            spec = json.load(f)
+
+    if isinstance(spec, list):
+        spec = {'effects': spec}
+    if not isinstance(spec, dict) or not isinstance(spec.get('effects', []), list):
+        raise ValueError("Tiene que ser una lista de efectos o un objeto con 'effects'")
+
+    effects = []
+    for effect in spec.get('effects', []):
+        if not isinstance(effect, dict):
+            raise ValueError(f"Cada efecto tiene que ser un objeto con 'type': {effect!r}")
+        params = dict(effect)
+        effect_type = params.pop('type', None)
+        if effect_type is None:
+            raise ValueError(f"Efecto sin 'type' en {path}: {effect}")
+        # un tipo o parametro mal escrito salta aca y no en cada archivo
+        get_effect(effect_type).resolve(params)
+        effects.append((effect_type, params))
+
+    return effects, spec.get('downmix', False)
+
+def common_dir(inputs):
+    """La carpeta mas de arriba que tiene a todas las entradas"""
+    try:
+        return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in inputs])
+    except ValueError:
+        # en Windows, entradas en discos distintos
+        return None
+
+def output_path_for(input_path, output_dir, suffix, extension, input_dir=None):
+    """
+    La salida para input_path. Con input_dir (ver common_dir) se copia la
+    carpeta relativa de la entrada, asi a/x.wav y b/x.wav no van al mismo archivo
+    """
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    if input_dir is not None:
+        folder = os.path.relpath(os.path.dirname(os.path.abspath(input_path)), input_dir)
+        if folder != os.curdir:
+            output_dir = os.path.join(output_dir, folder)
+    return os.path.join(output_dir, f"{name}{suffix}{extension}")
+
+def is_up_to_date(input_path, output_path, spec_path):
+    """La salida existe y es mas nueva que la entrada y que la cadena"""
+    if not os.path.exists(output_path):
+        return False
+    output_time = os.path.getmtime(output_path)
+    return output_time >= max(os.path.getmtime(input_path), os.path.getmtime(spec_path))
+
+def process_one(input_path, output_path, effects, downmix, stream, target_rate=None,
+                profile=False, threads=1):
+    """
+    Lo que corre cada proceso: carga, aplica la cadena y guarda.
+    profile: mide las etapas y devuelve los eventos en result['trace']
+    threads: hilos para los efectos de este archivo (ver effects/parallel.py)
+    """
+    parallel.set_workers(threads)
+    if profile:
+        profiling.reset()
+        profiling.enable()
+    result = _process_one(input_path, output_path, effects, downmix, stream, target_rate)
+    if profile:
+        result['trace'] = profiling.events()
+        profiling.disable()
+    return result
+
+def _process_one(input_path, output_path, effects, downmix, stream, target_rate):
+    start = time.perf_counter()
+    # se escribe a un archivo temporal y se renombra al final, asi una salida
+    # a medias no cuenta como "al dia" para --resume
+    base, extension = os.path.splitext(output_path)
+    partial_path = f"{base}.part{extension}"
+    try:
+        processor = AudioProcessor(target_rate=target_rate)
+        if stream:
+            processor.process_file(input_path, partial_path, effects, downmix=downmix,
+                                   target_rate=target_rate)
+        else:
+            processor.load_audio(input_path, downmix=downmix)
+            processor.apply_chain(effects)
+            processor.save_audio(partial_path)
+        os.replace(partial_path, output_path)
+        return {'input': input_path, 'output': output_path, 'status': 'ok',
+                'seconds': time.perf_counter() - start}
+    except Exception as e:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return {'input': input_path, 'output': output_path, 'status': 'error',
+                'error': f"{type(e).__name__}: {e}", 'seconds': time.perf_counter() - start}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DAWsito sin ventana: aplica una cadena de efectos a muchos archivos")
+    parser.add_argument('spec', help="cadena de efectos en json o yaml "
+                        f"(efectos: {', '.join(available_effects())})")
+    parser.add_argument('inputs', nargs='+', help="archivos o patrones glob (ej: 'audios/*.wav')")
+    parser.add_argument('-o', '--output-dir', required=True)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--suffix', default='', help="se agrega al nombre de cada salida")
+    parser.add_argument('--ext', default='.wav', help="formato de salida (.wav, .flac)")
+    parser.add_argument('--resume', action='store_true',
+                        help="se salta los archivos cuya salida ya esta al dia")
+    parser.add_argument('--stream', action='store_true',
+                        help="procesa por bloques sin cargar el archivo entero")
+    parser.add_argument('--rate', type=int,
+                        help="convierte todo a esta frecuencia de muestreo (ej. 48000)")
+    parser.add_argument('--report', help="guarda el reporte en json")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="hilos por archivo para reverb y filtros (sirve para pocos "
+                             "archivos largos: --workers 1 --threads 8)")
+    parser.add_argument('--profile',
+                        help="mide cada etapa y guarda un trace (chrome://tracing o Perfetto)")
+    args = parser.parse_args(argv)
+
+    try:
+        effects, downmix = load_spec(args.spec)
+    except (OSError, ValueError) as e:
+        # spec que no existe o con un efecto/parametro invalido: como los errores de argumentos
+        print(f"Error en la cadena {args.spec}: {e}", file=sys.stderr)
+        return 2
+    inputs = sorted({path for pattern in args.inputs for path in glob.glob(pattern)})
+    if not inputs:
+        print("No encontre archivos para procesar", file=sys.stderr)
+        return 1
+
+    input_dir = common_dir(inputs)
+    pairs = [(input_path, output_path_for(input_path, args.output_dir, args.suffix, args.ext,
+                                          input_dir))
+             for input_path in inputs]
+    outputs = {}
+    for input_path, output_path in pairs:
+        # queda una sola forma de chocar: x.wav y x.flac en la misma carpeta
+        key = os.path.normcase(os.path.abspath(output_path))
+        if key in outputs:
+            print(f"{outputs[key]} y {input_path} van a la misma salida {output_path}",
+                  file=sys.stderr)
+            return 2
+        outputs[key] = input_path
+
+    results = []
+    jobs = []
+    for input_path, output_path in pairs:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if args.resume and is_up_to_date(input_path, output_path, args.spec):
+            results.append({'input': input_path, 'output': output_path, 'status': 'skipped',
+                            'seconds': 0.0})
+            print(f"[saltado] {input_path}")
+            continue
+        jobs.append((input_path, output_path))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [executor.submit(process_one, input_path, output_path, effects, downmix,
+                                   args.stream, args.rate, bool(args.profile), args.threads)
+                   for input_path, output_path in jobs]
+        trace = []
+        for future in as_completed(futures):
+            result = future.result()
+            trace.extend(result.pop('trace', []))
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"[ok {result['seconds']:6.2f}s] {result['input']}")
+            else:
+                print(f"[error] {result['input']}: {result['error']}", file=sys.stderr)
+
+    failed = [result for result in results if result['status'] == 'error']
+    done = sum(1 for result in results if result['status'] == 'ok')
+    skipped = sum(1 for result in results if result['status'] == 'skipped')
+    print(f"\n{done} procesados, {skipped} saltados, {len(failed)} fallaron "
+          f"en {time.perf_counter() - start:.2f}s con {args.workers} procesos")
+    for result in failed:
+        print(f"  FALLO {result['input']}: {result['error']}")
+
+    if args.profile:
+        profiling.dump_chrome_trace(args.profile, trace)
+        stages = sorted(profiling.summarize(trace).items(), key=lambda item: -item[1]['wall_ms'])
+        print(f"\nEtapas (trace en {args.profile}):")
+        for name, entry in stages[:10]:
+            realtime = f"{entry['realtime']:8.1f}x RT" if entry['realtime'] else ""
+            print(f"  {name:<28} {entry['calls']:6d} llamadas {entry['wall_ms']:10.1f} ms "
+                  f"(CPU {entry['cpu_ms']:10.1f} ms) {realtime}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'spec': args.spec, 'effects': effects, 'results': results}, f, indent=2)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Cuanto cuesta procesar un archivo de 8 canales de una vs 8 pasadas en mono.
+Correr desde la raiz del repo:  python -m benchmarks.bench_multichannel --minutes 1
+"""
+import argparse
+import time
+import numpy as np
+from effects.filters import apply_filter
+from effects.reverb import apply_reverb, StreamReverb
+
+def filter_once(audio, sample_rate):
+    apply_filter(audio, sample_rate, 'bandpass', low_cut=300, high_cut=3000)
+
+def filter_per_channel(audio, sample_rate):
+    for channel in range(audio.shape[1]):
+        apply_filter(audio[:, channel], sample_rate, 'bandpass', low_cut=300, high_cut=3000)
+
+def reverb_once(audio, sample_rate):
+    apply_reverb(audio, sample_rate, decay_time=2.0)
+
+def reverb_per_channel(audio, sample_rate):
+    for channel in range(audio.shape[1]):
+        apply_reverb(audio[:, channel], sample_rate, decay_time=2.0)
+
+def stream_reverb_once(audio, sample_rate, block_size=4096):
+    reverb = StreamReverb(sample_rate, decay_time=2.0)
+    for start in range(0, len(audio), block_size):
+        reverb.process(audio[start:start + block_size])
+
+def stream_reverb_per_channel(audio, sample_rate, block_size=4096):
+    for channel in range(audio.shape[1]):
+        stream_reverb_once(audio[:, channel], sample_rate, block_size)
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multicanal")
+    parser.add_argument('--minutes', type=float, default=1.0)
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--sample-rate', type=int, default=48000)
+    args = parser.parse_args()
+
+    frames = int(args.minutes * 60 * args.sample_rate)
+    audio = (np.random.default_rng(0).standard_normal((frames, args.channels)) * 0.1
+             ).astype(np.float32)
+
+    print(f"{args.minutes:g} min, {args.channels} canales @ {args.sample_rate} Hz")
+    for label, batched, separate in [('filtro pasa bandas', filter_once, filter_per_channel),
+                                     ('reverb fftconvolve', reverb_once, reverb_per_channel),
+                                     ('reverb particionado', stream_reverb_once,
+                                      stream_reverb_per_channel)]:
+        once = timed(batched, audio, args.sample_rate)
+        per_channel = timed(separate, audio, args.sample_rate)
+        print(f"  {label:<22} todos juntos {once:7.2f}s   canal por canal {per_channel:7.2f}s"
+              f"   ({per_channel / once:.1f}x)")
+
+if __name__ == '__main__':
+    main()
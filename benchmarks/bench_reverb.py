@@ -0,0 +1,49 @@
+"""
+Compara el reverb de siempre (fftconvolve sobre todo el archivo) contra la
+convolucion particionada por bloques.
+Correr desde la raiz del repo:  python -m benchmarks.bench_reverb --minutes 10
+"""
+import argparse
+import time
+import numpy as np
+from effects.reverb import apply_reverb, generate_impulse_response, StreamReverb
+
+def run_stream(audio, sample_rate, impulse, block_size, partition_size, max_partition_size):
+    reverb = StreamReverb(sample_rate, impulse_response=impulse,
+                          partition_size=partition_size,
+                          max_partition_size=max_partition_size)
+    for start in range(0, len(audio), block_size):
+        reverb.process(audio[start:start + block_size])
+
+def timed(label, duration, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<44} {elapsed:8.2f}s  {duration / elapsed:8.1f}x tiempo real")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de reverb")
+    parser.add_argument('--minutes', type=float, default=10.0)
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--decay', type=float, nargs='+', default=[1.0, 5.0])
+    args = parser.parse_args()
+
+    sample_rate = args.sample_rate
+    duration = args.minutes * 60
+    audio = np.random.default_rng(0).standard_normal(int(duration * sample_rate)) * 0.1
+
+    for decay_time in args.decay:
+        impulse = generate_impulse_response(sample_rate, decay_time)
+        print(f"{args.minutes:g} min @ {sample_rate} Hz, cola de {decay_time:g}s")
+        timed("fftconvolve (apply_reverb)", duration,
+              apply_reverb, audio, sample_rate, impulse)
+        for block_size, partition_size, max_partition_size in [(1024, 1024, 1024),
+                                                               (1024, 1024, 16384),
+                                                               (256, 256, 16384),
+                                                               (65536, 1024, 16384)]:
+            label = f"particionada bloque={block_size} part={partition_size}-{max_partition_size}"
+            timed(label, duration, run_stream, audio, sample_rate, impulse,
+                  block_size, partition_size, max_partition_size)
+
+if __name__ == '__main__':
+    main()
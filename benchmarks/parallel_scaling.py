@@ -0,0 +1,95 @@
+"""
+Cuanto escala el reverb y los filtros con la cantidad de hilos (effects/parallel.py)
+sobre un solo archivo largo, y cuanto se aleja la salida de la version en serie.
+Correr desde la raiz del repo:
+
+    python -m benchmarks.parallel_scaling --duration 600 --threads 1 2 4 8 16
+    python -m benchmarks.parallel_scaling --channels 8 --save escala.json
+
+threads=1 es el camino de siempre (sin pool); la aceleracion y el error son
+contra ese. En una maquina con menos nucleos que hilos no hay mas ganancia,
+solo se ve lo que cuesta repartir.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from benchmarks.suite import synthetic_signal
+from effects import parallel
+
+# cuanto puede diferir la salida en paralelo de la serie (el audio es float32)
+DEFAULT_TOLERANCE = 1e-5
+
+def _reverb(audio, sample_rate):
+    from effects.reverb import apply_reverb
+    return apply_reverb(audio, sample_rate, decay_time=2.0, mix=0.3)
+
+def _filters(audio, sample_rate):
+    # lo mismo que una tanda de filtros juntados por la cadena
+    from effects.filters import cascade_sos, design_filter, sosfilt_inplace
+    sos = cascade_sos([design_filter(sample_rate, 'highpass', cutoff_freq=40),
+                       design_filter(sample_rate, 'bandstop', low_cut=900, high_cut=1100),
+                       design_filter(sample_rate, 'lowpass', cutoff_freq=8000)])
+    return sosfilt_inplace(sos, np.array(audio, dtype=np.float32))
+
+CASES = {'reverb': _reverb, 'filters': _filters}
+
+def measure(func, audio, sample_rate, threads, repeat):
+    parallel.set_workers(threads)
+    times = []
+    output = None
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        output = func(audio, sample_rate)
+        times.append(time.perf_counter() - start)
+    parallel.set_workers(1)
+    return min(times), output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Escalado de reverb y filtros con hilos")
+    parser.add_argument('--duration', type=float, default=600, help="segundos de audio")
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="error maximo contra la serie (relativo al pico)")
+    parser.add_argument('--save', help="guarda los resultados en json")
+    args = parser.parse_args(argv)
+
+    audio = synthetic_signal(args.duration, args.channels, args.sample_rate)
+    results = []
+    failed = False
+    for case in args.cases:
+        func = CASES[case]
+        serial_time, serial = measure(func, audio, args.sample_rate, 1, args.repeat)
+        peak = float(np.max(np.abs(serial))) or 1.0
+        for threads in args.threads:
+            if threads == 1:
+                seconds, error = serial_time, 0.0
+            else:
+                seconds, output = measure(func, audio, args.sample_rate, threads, args.repeat)
+                error = float(np.max(np.abs(output - serial))) / peak
+            ok = error <= args.tolerance
+            failed |= not ok
+            results.append({'case': case, 'threads': threads, 'seconds': seconds,
+                            'speedup': serial_time / seconds,
+                            'realtime': args.duration / seconds, 'max_error': error})
+            print(f"{case:<8} {threads:3d} hilos {seconds:8.3f}s "
+                  f"x{serial_time / seconds:5.2f} {args.duration / seconds:8.1f}x RT "
+                  f"error {error:.2e}{'' if ok else '  FUERA DE TOLERANCIA'}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__,
+                       'machine': platform.machine(), 'cpus': os.cpu_count(),
+                       'duration': args.duration, 'channels': args.channels,
+                       'sample_rate': args.sample_rate, 'results': results}, f, indent=2)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
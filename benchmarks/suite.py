@@ -0,0 +1,332 @@
+"""
+Suite de benchmarks: filtros, reverb, carga/guardado y dibujo de la forma de onda
+sobre señales sinteticas de distintas duraciones, canales y frecuencias.
+Los efectos del registro tienen ademas <efecto>_render (todo el buffer) y
+<efecto>_stream (de a bloques de 1024 frames, como el reproductor).
+session_save y session_open: guardar y reabrir una sesion (.dawsito) con la
+salida renderizada, reabrir la compara contra session_rerender (cargar la
+fuente y volver a renderizar la misma cadena).
+Correr desde la raiz del repo:
+
+    python -m benchmarks.suite --durations 1s 1m --save resultados.json
+    python -m benchmarks.suite --durations 1s 1m --compare resultados.json --threshold 0.15
+    python -m benchmarks.suite --full --save todo.json      (1s, 1m, 10m y 1h, tarda)
+
+Cada caso corre en un proceso nuevo, asi el pico de memoria (RSS) es solo de
+ese caso. Por caso se guarda:
+  seconds          el mejor de --repeat corridas
+  realtime         segundos de audio / segundos que tardo
+  samples_per_sec  muestras (frames * canales) por segundo
+  peak_rss_mb      pico de memoria del proceso
+  peak_alloc_mb    pico de lo reservado durante el caso (tracemalloc, incluye numpy)
+  peak_buffers     peak_alloc_mb en "buffers enteros": cuantas copias del audio
+                   llego a tener el caso a la vez
+Con --compare sale con 1 si algun caso quedo mas lento (o usa mas memoria)
+que la base por encima de --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DURATIONS = {'1s': 1, '1m': 60, '10m': 600, '1h': 3600}
+CHANNELS = (1, 2, 8)
+SAMPLE_RATES = (44100, 48000, 96000)
+CASES = ('lowpass', 'bandpass', 'reverb', 'load', 'save', 'waveform')
+# señales mas grandes que esto se saltean (1 h a 96 kHz y 8 canales son 11 GB)
+DEFAULT_MAX_GB = 2.0
+
+def synthetic_signal(seconds, channels, sample_rate, seed=0):
+    """Unos senos + ruido, distinto por canal, float32 (frames, canales)"""
+    frames = int(seconds * sample_rate)
+    rng = np.random.default_rng(seed)
+    audio = np.empty((frames, channels), dtype=np.float32)
+    chunk = 1 << 20
+    for channel in range(channels):
+        frequencies = rng.uniform(50, 5000, size=3)
+        for start in range(0, frames, chunk):
+            t = np.arange(start, min(start + chunk, frames)) / sample_rate
+            block = sum(np.sin(2 * np.pi * f * t) for f in frequencies) * 0.2
+            block += rng.standard_normal(len(t)) * 0.05
+            audio[start:start + len(t), channel] = block
+    return audio
+
+def _rss_mb():
+    # ru_maxrss esta en KB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+# cada caso: setup(audio, sample_rate, workdir) -> funcion a medir
+
+def _setup_filter(filter_type, **params):
+    def setup(audio, sample_rate, workdir):
+        from effects.filters import apply_filter
+        return lambda: apply_filter(audio, sample_rate, filter_type, **params)
+    return setup
+
+def _setup_reverb(audio, sample_rate, workdir):
+    from effects.reverb import apply_reverb
+    return lambda: apply_reverb(audio, sample_rate, decay_time=2.0, mix=0.3)
+
+def _setup_load(audio, sample_rate, workdir):
+    import soundfile as sf
+    from audio_processor import AudioProcessor
+    path = os.path.join(workdir, 'load.wav')
+    sf.write(path, audio, sample_rate, subtype='PCM_16')
+    return lambda: AudioProcessor().load_audio(path)
+
+def _setup_save(audio, sample_rate, workdir):
+    from audio_processor import AudioProcessor
+    processor = AudioProcessor()
+    processor.audio_data = audio
+    processor.sample_rate = sample_rate
+    path = os.path.join(workdir, 'save.wav')
+    return lambda: processor.save_audio(path)
+
+def _setup_waveform(audio, sample_rate, workdir):
+    """
+    Lo mismo que hace update_waveforms pero en una figura Agg sin ventana:
+    armar las dos piramides de picos y dibujar
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from waveform import WaveformView
+
+    def draw():
+        canvas = FigureCanvasAgg(Figure(figsize=(12, 6)))
+        ax_original = canvas.figure.add_subplot(211)
+        ax_processed = canvas.figure.add_subplot(212, sharex=ax_original)
+        original = WaveformView(ax_original, 'blue', "Original")
+        processed = WaveformView(ax_processed, 'green', "Procesada")
+        ax_original.set_xlim(0, len(audio))
+        original.set_audio(audio)
+        processed.set_audio(audio, original.pyramid)
+        canvas.draw()
+    return draw
+
+def _setup_qt_waveform(audio, sample_rate, workdir):
+    """El update_waveforms de la ventana de verdad, con Qt offscreen"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    import main as dawsito
+
+    app = QApplication.instance() or QApplication([])
+    window = dawsito.Dawsito()
+    processor = window.audio_processor
+    processor.original_audio = processor.audio_data = audio
+    processor.sample_rate = sample_rate
+
+    def draw():
+        # un buffer nuevo cada vez, si no se reusan las piramides
+        processor.original_audio = processor.audio_data = audio.view()
+        window.update_waveforms()
+        window.plot_canvas.draw()
+        app.processEvents()
+    return draw
+
+# la cadena de los casos de sesion
+SESSION_CHAIN = [('lowpass', {'cutoff_freq': 3000}), ('reverb', {'decay_time': 2.0, 'mix': 0.3})]
+
+def _session_processor(audio, sample_rate, workdir):
+    import soundfile as sf
+    from audio_processor import AudioProcessor
+    source = os.path.join(workdir, 'source.wav')
+    sf.write(source, audio, sample_rate, subtype='FLOAT')
+    processor = AudioProcessor()
+    processor.load_audio(source)
+    processor.apply_chain(SESSION_CHAIN)
+    return processor
+
+def _setup_session_save(audio, sample_rate, workdir):
+    processor = _session_processor(audio, sample_rate, workdir)
+    path = os.path.join(workdir, 'save.dawsito')
+    return lambda: processor.save_session(path)
+
+def _setup_session_open(audio, sample_rate, workdir):
+    from audio_processor import AudioProcessor
+    path = os.path.join(workdir, 'open.dawsito')
+    _session_processor(audio, sample_rate, workdir).save_session(path)
+
+    def run():
+        # abrir y leer el procesado entero (lo que hacen la forma de onda y el espectrograma)
+        processor = AudioProcessor()
+        processor.load_session(path)
+        np.asarray(processor.audio_data)
+    return run
+
+def _setup_session_rerender(audio, sample_rate, workdir):
+    import soundfile as sf
+    from audio_processor import AudioProcessor
+    source = os.path.join(workdir, 'source.wav')
+    sf.write(source, audio, sample_rate, subtype='FLOAT')
+
+    def run():
+        processor = AudioProcessor()
+        processor.load_audio(source)
+        processor.apply_chain(SESSION_CHAIN)
+    return run
+
+SETUPS = {
+    'lowpass': _setup_filter('lowpass', cutoff_freq=1000),
+    'bandpass': _setup_filter('bandpass', low_cut=300, high_cut=3000),
+    'reverb': _setup_reverb,
+    'load': _setup_load,
+    'save': _setup_save,
+    'waveform': _setup_waveform,
+    'waveform_qt': _setup_qt_waveform,
+    'session_save': _setup_session_save,
+    'session_open': _setup_session_open,
+    'session_rerender': _setup_session_rerender,
+}
+
+# los efectos del registro que no tienen su caso a mano
+PLUGIN_EFFECTS = ('eq', 'compressor', 'limiter', 'gain', 'normalize', 'delay')
+STREAM_BLOCK = 1024
+
+def _setup_plugin_render(effect_type):
+    def setup(audio, sample_rate, workdir):
+        from effects.registry import render_effect
+        return lambda: render_effect(audio, sample_rate, effect_type, {})
+    return setup
+
+def _setup_plugin_stream(effect_type):
+    def setup(audio, sample_rate, workdir):
+        from effects.registry import create_stream_effect
+
+        def run():
+            effect = create_stream_effect(effect_type, sample_rate, audio.shape[1])
+            for start in range(0, len(audio), STREAM_BLOCK):
+                effect.process(audio[start:start + STREAM_BLOCK])
+        return run
+    return setup
+
+for _effect in PLUGIN_EFFECTS:
+    SETUPS[f'{_effect}_render'] = _setup_plugin_render(_effect)
+    if _effect != 'normalize':
+        SETUPS[f'{_effect}_stream'] = _setup_plugin_stream(_effect)
+
+def case_key(case, duration, channels, sample_rate):
+    return f"{case}/{duration}/{channels}ch/{sample_rate}"
+
+def run_case(case, duration, channels, sample_rate, repeat):
+    """Corre un caso (en el proceso hijo) y devuelve sus numeros"""
+    seconds = DURATIONS[duration]
+    audio = synthetic_signal(seconds, channels, sample_rate)
+    with tempfile.TemporaryDirectory(prefix='dawsito_bench_') as workdir:
+        func = SETUPS[case](audio, sample_rate, workdir)
+        # la primera corrida hace de calentamiento (se descarta si hay mas)
+        times = []
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        # la memoria en una corrida aparte: tracemalloc hace mucho mas lento el
+        # codigo con mucho python (matplotlib) y arruinaria los tiempos
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        peak_alloc = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+
+    best = min(times[1:] if len(times) > 1 else times)
+    samples = len(audio) * channels
+    return {'case': case, 'duration': duration, 'channels': channels,
+            'sample_rate': sample_rate, 'seconds': best, 'runs': times,
+            'realtime': seconds / best, 'samples_per_sec': samples / best,
+            'peak_rss_mb': _rss_mb(), 'peak_alloc_mb': peak_alloc / (1024 * 1024),
+            'peak_buffers': peak_alloc / audio.nbytes}
+
+def compare(results, baseline, threshold):
+    """Lista de (clave, que empeoro, antes, ahora) para los casos que estan en las dos"""
+    before = {case_key(r['case'], r['duration'], r['channels'], r['sample_rate']): r
+              for r in baseline['results'] if 'seconds' in r}
+    regressions = []
+    for result in results:
+        if 'seconds' not in result:
+            continue
+        key = case_key(result['case'], result['duration'], result['channels'],
+                       result['sample_rate'])
+        if key not in before:
+            continue
+        for metric in ('seconds', 'peak_alloc_mb'):
+            old, new = before[key][metric], result[metric]
+            # los casos chiquitos tiemblan mucho, se ignora menos de 1 ms / 1 MB
+            floor = 1e-3 if metric == 'seconds' else 1.0
+            if new > old * (1 + threshold) and new - old > floor:
+                regressions.append((key, metric, old, new))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Suite de benchmarks de DAWsito")
+    parser.add_argument('--cases', nargs='+', default=list(CASES),
+                        choices=sorted(SETUPS), help="que medir (waveform_qt usa la ventana)")
+    parser.add_argument('--durations', nargs='+', default=['1s', '1m'], choices=list(DURATIONS))
+    parser.add_argument('--channels', nargs='+', type=int, default=list(CHANNELS))
+    parser.add_argument('--sample-rates', nargs='+', type=int, default=list(SAMPLE_RATES))
+    parser.add_argument('--full', action='store_true', help="todas las duraciones (hasta 1 h)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="corridas por caso (las de 10m o mas corren una sola)")
+    parser.add_argument('--max-gb', type=float, default=DEFAULT_MAX_GB,
+                        help="se saltean las señales mas grandes que esto")
+    parser.add_argument('--inline', action='store_true',
+                        help="todo en este proceso (el RSS deja de ser por caso)")
+    parser.add_argument('--save', help="guarda los resultados en json")
+    parser.add_argument('--compare', help="json de base para buscar regresiones")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="cuanto peor que la base cuenta como regresion (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    durations = list(DURATIONS) if args.full else args.durations
+    results = []
+    for duration in durations:
+        for sample_rate in args.sample_rates:
+            for channels in args.channels:
+                nbytes = DURATIONS[duration] * sample_rate * channels * 4
+                for case in args.cases:
+                    if nbytes > args.max_gb * 1024 ** 3:
+                        results.append({'case': case, 'duration': duration, 'channels': channels,
+                                        'sample_rate': sample_rate, 'skipped': 'max-gb'})
+                        continue
+                    repeat = args.repeat if DURATIONS[duration] < 600 else 1
+                    call = (case, duration, channels, sample_rate, repeat)
+                    if args.inline:
+                        result = run_case(*call)
+                    else:
+                        with ProcessPoolExecutor(max_workers=1) as executor:
+                            result = executor.submit(run_case, *call).result()
+                    results.append(result)
+                    print(f"{case_key(case, duration, channels, sample_rate):<32} "
+                          f"{result['seconds']:8.3f}s {result['realtime']:9.1f}x RT "
+                          f"{result['samples_per_sec'] / 1e6:8.1f} M muestras/s "
+                          f"RSS {result['peak_rss_mb']:7.0f} MB "
+                          f"pico {result['peak_alloc_mb']:7.1f} MB ({result['peak_buffers']:.1f} buffers)")
+
+    report = {'python': platform.python_version(), 'numpy': np.__version__,
+              'machine': platform.machine(), 'processor': platform.processor(),
+              'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for key, metric, old, new in regressions:
+            print(f"REGRESION {key} {metric}: {old:.4g} -> {new:.4g} (+{(new / old - 1) * 100:.0f}%)")
+        if regressions:
+            return 1
+        print(f"Sin regresiones contra {args.compare} (umbral {args.threshold * 100:.0f}%)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,430 @@
+import os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import profiling
+from effects.filters import cascade_sos, sosfilt_inplace
+from effects.registry import get_effect, render_effect
+
+# cadena de efectos no destructiva: cada nodo se guarda su salida, si cambias
+# un efecto solo se vuelve a renderizar ese y los que vienen despues
+
+# tope de disco para las salidas viejas que se guardan para undo
+DEFAULT_SNAPSHOT_BYTES = 2 * 1024 * 1024 * 1024
+
+class RenderCancelled(Exception):
+    """El render se corto a pedido (la cadena queda sucia desde ahi)"""
+
+class EffectNode:
+    """Un efecto de la cadena con su salida guardada (en RAM o en disco)"""
+    def __init__(self, effect_type, params, spill_dir=None):
+        self.effect_type = effect_type
+        self.params = dict(params)
+        self.dirty = True
+        self._spill_dir = spill_dir
+        self._output = None
+        self._spill_path = None
+
+    @property
+    def spec(self):
+        return (self.effect_type, dict(self.params))
+
+    @property
+    def has_output(self):
+        return self._output is not None
+
+    @property
+    def output(self):
+        return self._output
+
+    def buffer(self, shape):
+        """
+        Buffer float32 donde el efecto escribe su salida: con spill_dir es un
+        .npy mapeado (la salida nunca esta entera en RAM), si no uno comun
+        """
+        self.drop()
+        if self._spill_dir is None:
+            return np.empty(shape, dtype=np.float32)
+        fd, self._spill_path = tempfile.mkstemp(suffix='.npy', dir=self._spill_dir)
+        os.close(fd)
+        return np.lib.format.open_memmap(self._spill_path, mode='w+', dtype=np.float32,
+                                         shape=shape)
+
+    def store(self, output):
+        """Guarda la salida (la de buffer() se queda tal cual, sin copiar)"""
+        if isinstance(output, np.memmap) and self._spill_path is not None:
+            output.flush()
+            output = np.load(self._spill_path, mmap_mode='r')
+        elif self._spill_dir is not None:
+            self.drop()
+            fd, self._spill_path = tempfile.mkstemp(suffix='.npy', dir=self._spill_dir)
+            os.close(fd)
+            np.save(self._spill_path, output)
+            output = np.load(self._spill_path, mmap_mode='r')
+        self._output = output
+        self.dirty = False
+
+    def release(self):
+        """Suelta la salida sin borrar su archivo y devuelve la ruta (o None)"""
+        path = self._spill_path if self._output is not None else None
+        if path is not None:
+            self._spill_path = None
+        self.drop()
+        return path
+
+    def keep(self, output):
+        """Usa como salida un buffer de afuera tal cual, sin copiarlo (ej. el audio de una sesion)"""
+        self.drop()
+        self._output = output
+        self.dirty = False
+
+    def adopt(self, path):
+        """Usa como salida un .npy que ya estaba en disco (de SnapshotStore)"""
+        self.drop()
+        self._spill_path = path
+        self._output = np.load(path, mmap_mode='r')
+        self.dirty = False
+
+    def drop(self):
+        """Suelta la salida guardada (y borra el archivo si lo habia)"""
+        self._output = None
+        if self._spill_path is not None:
+            _remove(self._spill_path)
+            self._spill_path = None
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class SnapshotStore:
+    """
+    Salidas de nodos que salieron de la cadena (por un cambio, undo, remove)
+    guardadas como .npy en disco, asi deshacer no vuelve a renderizar.
+    La clave es la cadena hasta ese nodo inclusive (misma fuente + mismos
+    efectos = misma salida). LRU con tope de bytes, se borran los archivos
+    menos usados
+    """
+    def __init__(self, max_bytes=DEFAULT_SNAPSHOT_BYTES):
+        self.max_bytes = max_bytes
+        # clave -> (ruta, bytes)
+        self._files = OrderedDict()
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size in self._files.values())
+
+    def __len__(self):
+        return len(self._files)
+
+    def put(self, key, path):
+        if key in self._files:
+            # ya habia una igual, esta sobra
+            _remove(path)
+            self._files.move_to_end(key)
+            return
+        self._files[key] = (path, os.path.getsize(path))
+        self._trim()
+
+    def take(self, key):
+        """Saca la ruta guardada para esa cadena (pasa a ser del nodo) o None"""
+        if key not in self._files:
+            return None
+        return self._files.pop(key)[0]
+
+    def _trim(self):
+        while self._files and self.nbytes > self.max_bytes:
+            _, (path, _) = self._files.popitem(last=False)
+            _remove(path)
+
+    def clear(self):
+        for path, _ in self._files.values():
+            _remove(path)
+        self._files.clear()
+
+def _chain_key(specs):
+    """Clave para una cadena de (effect_type, params), sin importar el orden de params"""
+    return repr([(effect_type, sorted(params.items())) for effect_type, params in specs])
+
+class EffectChain:
+    """
+    Lista ordenada de efectos sobre una señal fuente con undo/redo.
+    spill_to_disk: los efectos escriben su salida en .npy mapeados en
+    archivos temporales en vez de RAM, y las salidas que se sacan de la
+    cadena quedan en disco (hasta snapshot_bytes) para que undo/redo no
+    tengan que volver a renderizar
+    """
+    def __init__(self, spill_to_disk=False, spill_dir=None, max_undo=100,
+                 snapshot_bytes=DEFAULT_SNAPSHOT_BYTES):
+        self.nodes = []
+        self.source = None
+        self.sample_rate = None
+        self.max_undo = max_undo
+        self._undo_stack = []
+        self._redo_stack = []
+        # la ultima cadena que se renderizo bien, con su historial (ver rollback)
+        self._rendered_state = ([], [], [])
+        self._spill_dir = None
+        self._source_path = None
+        self._pending_source_path = None
+        self.snapshots = None
+        if spill_to_disk:
+            self._tempdir = tempfile.TemporaryDirectory(prefix='dawsito_', dir=spill_dir)
+            self._spill_dir = self._tempdir.name
+            self.snapshots = SnapshotStore(snapshot_bytes)
+
+    def source_buffer(self, shape):
+        """
+        Buffer float32 para cargar la fuente antes de set_source: con
+        spill_to_disk es un .npy mapeado que se borra con la proxima fuente
+        """
+        if self._spill_dir is None:
+            return np.empty(shape, dtype=np.float32)
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=self._spill_dir)
+        os.close(fd)
+        self._pending_source_path = path
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+
+    def discard_source_buffer(self):
+        """Borra el buffer de source_buffer que no llego a set_source (fallo la carga)"""
+        if self._pending_source_path is not None:
+            _remove(self._pending_source_path)
+            self._pending_source_path = None
+
+    def set_source(self, audio, sample_rate):
+        """Nueva señal fuente: se vacia la cadena y el historial"""
+        self._drop_nodes(0)
+        self.nodes = []
+        if self.snapshots is not None:
+            self.snapshots.clear()
+        # el archivo de la fuente anterior ya no hace falta
+        if self._source_path is not None:
+            _remove(self._source_path)
+            self._source_path = None
+        if isinstance(audio, np.memmap):
+            audio.flush()
+            if audio.filename == self._pending_source_path:
+                self._source_path = self._pending_source_path
+        self._pending_source_path = None
+        self.source = audio
+        self.sample_rate = sample_rate
+        self._undo_stack = []
+        self._redo_stack = []
+        self._rendered_state = ([], [], [])
+
+    def restore(self, specs, output=None):
+        """
+        Arma la cadena guardada en una sesion, sin historial. output: la salida
+        final que ya estaba renderizada, queda como la del ultimo nodo y no se
+        vuelve a renderizar nada (sin output queda todo sucio)
+        """
+        nodes = [self._new_node(effect_type, params) for effect_type, params in specs]
+        self._drop_nodes(0)
+        if self.snapshots is not None:
+            self.snapshots.clear()
+        self.nodes = nodes
+        self._undo_stack = []
+        self._redo_stack = []
+        if output is not None and nodes:
+            # los del medio quedan sin salida, como los filtros juntados
+            for node in nodes[:-1]:
+                node.dirty = False
+            nodes[-1].keep(output)
+            self._mark_rendered()
+        else:
+            # si la cadena guardada no se puede renderizar se vuelve a la fuente sola
+            self._rendered_state = ([], [], [])
+
+    def _mark_rendered(self):
+        self._rendered_state = (self.specs(), list(self._undo_stack), list(self._redo_stack))
+
+    def specs(self):
+        """La cadena como lista de (effect_type, params)"""
+        return [node.spec for node in self.nodes]
+
+    def _drop_nodes(self, start):
+        for node in self.nodes[start:]:
+            node.drop()
+
+    def _invalidate(self, start):
+        """
+        Marca sucios los nodos desde start. Con disco, sus salidas pasan a
+        snapshots (llamar antes de cambiar los parametros, la clave es la
+        cadena como esta ahora)
+        """
+        specs = self.specs()
+        for index in range(start, len(self.nodes)):
+            node = self.nodes[index]
+            node.dirty = True
+            if self.snapshots is not None:
+                path = node.release()
+                if path is not None:
+                    self.snapshots.put(_chain_key(specs[:index + 1]), path)
+            else:
+                node.drop()
+
+    def _save_history(self):
+        self._undo_stack.append(self.specs())
+        if len(self._undo_stack) > self.max_undo:
+            self._undo_stack.pop(0)
+        self._redo_stack = []
+
+    def _new_node(self, effect_type, params):
+        # efecto desconocido o parametros fuera de rango: error aca y no al renderizar
+        get_effect(effect_type).resolve(params)
+        return EffectNode(effect_type, params, spill_dir=self._spill_dir)
+
+    def _sos(self, node):
+        """Las sos del nodo si es un filtro lineal que se puede juntar con otros"""
+        return get_effect(node.effect_type).sos(self.sample_rate, node.params)
+
+    def add(self, effect_type, **params):
+        node = self._new_node(effect_type, params)
+        self._save_history()
+        self.nodes.append(node)
+        return len(self.nodes) - 1
+
+    def extend(self, effects):
+        """Agrega varios efectos como un solo paso de undo"""
+        nodes = [self._new_node(effect_type, params) for effect_type, params in effects]
+        self._save_history()
+        self.nodes.extend(nodes)
+
+    def update(self, index, **params):
+        """Cambia parametros de un nodo, se invalida de ahi para abajo"""
+        node = self.nodes[index]
+        get_effect(node.effect_type).resolve({**node.params, **params})
+        self._save_history()
+        self._invalidate(index)
+        self.nodes[index].params.update(params)
+
+    def remove(self, index):
+        self._save_history()
+        self._invalidate(index)
+        del self.nodes[index]
+
+    def clear(self):
+        self._save_history()
+        self._invalidate(0)
+        self.nodes = []
+
+    def _restore(self, specs):
+        """Vuelve a una cadena guardada reusando los nodos del principio que no cambiaron"""
+        keep = 0
+        while (keep < len(specs) and keep < len(self.nodes)
+               and self.nodes[keep].spec == specs[keep]):
+            keep += 1
+        self._invalidate(keep)
+        self.nodes = self.nodes[:keep] + [self._new_node(effect_type, params)
+                                          for effect_type, params in specs[keep:]]
+
+    def rollback(self):
+        """
+        Vuelve a la ultima cadena que se renderizo bien, con el historial de
+        ese momento (cuando fallo el render). Un render puede juntar varios
+        cambios (o seguir uno que quedo a medias), se descartan todos
+        """
+        specs, undo_stack, redo_stack = self._rendered_state
+        self._restore(specs)
+        self._undo_stack = list(undo_stack)
+        self._redo_stack = list(redo_stack)
+
+    def can_undo(self):
+        return bool(self._undo_stack)
+
+    def can_redo(self):
+        return bool(self._redo_stack)
+
+    def undo(self):
+        if not self._undo_stack:
+            return False
+        self._redo_stack.append(self.specs())
+        self._restore(self._undo_stack.pop())
+        return True
+
+    def redo(self):
+        if not self._redo_stack:
+            return False
+        self._undo_stack.append(self.specs())
+        self._restore(self._redo_stack.pop())
+        return True
+
+    def render(self, merge_filters=False, callback=None):
+        """
+        Renderiza desde el primer nodo sucio y devuelve la salida final.
+        merge_filters: los filtros seguidos que haya que renderizar pasan de una
+        sola vez, pero solo el ultimo de la tanda se guarda la salida.
+        callback(fraccion): progreso de 0 a 1, si lanza RenderCancelled el render
+        se corta y lo que ya estaba hecho queda guardado
+        """
+        if self.source is None:
+            raise ValueError("No hay audio!")
+
+        start = next((i for i, node in enumerate(self.nodes) if node.dirty), len(self.nodes))
+
+        # arrancamos del ultimo nodo con salida guardada antes del cambio
+        index = start - 1
+        while index >= 0 and not self.nodes[index].has_output:
+            index -= 1
+        audio = self.source if index < 0 else self.nodes[index].output
+        index += 1
+
+        first = index
+        total = max(len(self.nodes) - first, 1)
+
+        def node_callback(fraction):
+            if callback is not None:
+                callback((index - first + fraction) / total)
+
+        specs = self.specs()
+        while index < len(self.nodes):
+            node_callback(0.0)
+            node = self.nodes[index]
+            snapshot = (self.snapshots.take(_chain_key(specs[:index + 1]))
+                        if self.snapshots is not None else None)
+            if snapshot is not None:
+                # esta salida ya estaba en disco (undo/redo), no hace falta renderizar
+                node.adopt(snapshot)
+                audio = node.output
+                index += 1
+                continue
+
+            end = index + 1
+            sos_list = []
+            if merge_filters:
+                # filtros lineales seguidos (Butterworth, EQ...) van en una sola pasada
+                for candidate in self.nodes[index:]:
+                    sos = self._sos(candidate)
+                    if sos is None:
+                        break
+                    sos_list.append(sos)
+                end = index + max(len(sos_list), 1)
+
+            if end - index > 1:
+                with profiling.stage('effect.merged_filters', frames=len(audio),
+                                     sample_rate=self.sample_rate,
+                                     effects=[n.effect_type for n in self.nodes[index:end]]):
+                    sos = cascade_sos(sos_list)
+                    out = self.nodes[end - 1].buffer(audio.shape)
+                    out[...] = audio
+                    audio = sosfilt_inplace(sos, out, callback=node_callback)
+                for skipped in self.nodes[index:end - 1]:
+                    skipped.drop()
+                    skipped.dirty = False
+            else:
+                with profiling.stage(f'effect.{node.effect_type}', frames=len(audio),
+                                     sample_rate=self.sample_rate, params=node.params):
+                    audio = render_effect(audio, self.sample_rate, node.effect_type, node.params,
+                                          callback=node_callback, out=node.buffer(audio.shape))
+
+            self.nodes[end - 1].store(audio)
+            audio = self.nodes[end - 1].output
+            index = end
+
+        self._mark_rendered()
+        if callback is not None:
+            callback(1.0)
+        if not self.nodes:
+            return self.source
+        return self.nodes[-1].output
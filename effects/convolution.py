@@ -0,0 +1,170 @@
+import numpy as np
+
+# convolucion particionada (overlap-save + linea de retardo en frecuencia)
+# la idea: partimos el impulso en pedazos, les sacamos la fft una sola vez y
+# despues cada bloque de audio solo hace una fft chiquita en vez de una gigante
+
+def _partition_segment(segment, partition_size, offset):
+    """
+    Espectros de las particiones de un tramo del impulso que empieza en offset.
+    Devuelve (partition_size, primera particion con datos, espectros)
+    """
+    B = partition_size
+    # el tramo con ceros adelante para que quede alineado en el tiempo
+    segment = segment.reshape(len(segment), -1)
+    padded = np.concatenate([np.zeros((offset, segment.shape[1])), segment])
+    num_partitions = int(np.ceil(len(padded) / B))
+    padded = np.pad(padded, ((0, num_partitions * B - len(padded)), (0, 0)))
+
+    # espectros (particion, canal, bin): un canal si el impulso es mono.
+    # el canal va antes que el bin para que las ffts corran sobre memoria contigua
+    partitions = padded.reshape(num_partitions, B, segment.shape[1]).transpose(0, 2, 1)
+    spectra = np.fft.rfft(partitions, n=2 * B, axis=2)
+    return B, offset // B, spectra
+
+def partition_impulse(impulse_response, partition_size=1024, max_partition_size=None):
+    """
+    Parte el impulso y le saca la fft a cada particion (lo caro, se hace una vez).
+    El primer tramo va con 2 particiones y cada tramo siguiente duplica el
+    tamaño y arranca donde termino el anterior (asi offset >= tamaño siempre),
+    hasta llegar a max_partition_size que se queda con el resto.
+    impulse_response puede ser (muestras,) o (muestras, canales) para tener
+    un impulso distinto por canal
+    """
+    impulse_response = np.asarray(impulse_response)
+    if max_partition_size is None:
+        max_partition_size = partition_size
+
+    stages = []
+    B = partition_size
+    offset = 0
+    while offset < len(impulse_response):
+        if B >= max_partition_size:
+            end = len(impulse_response)
+        else:
+            end = offset + 2 * B
+        stages.append(_partition_segment(impulse_response[offset:end], B, offset))
+        offset = end
+        B = min(2 * B, max_partition_size)
+    return stages
+
+class _ConvolutionStage:
+    """
+    Un tramo del impulso convolucionado con particiones uniformes.
+    Si el tramo arranca despues de la primera particion solo depende de
+    frames ya completos, entonces su salida se calcula una vez por frame y
+    no en cada llamada
+    """
+    def __init__(self, partition_size, first_partition, spectra):
+        self.partition_size = partition_size
+        self.fft_size = 2 * partition_size
+        # particiones que son solo ceros no hace falta multiplicarlas
+        self.first_partition = first_partition
+        self.spectra = spectra
+        self.num_partitions = len(spectra)
+        self.reset()
+
+    def reset(self):
+        # los buffers se crean en el primer bloque, cuando sabemos los canales
+        self.channels = None
+        self.position = 0
+
+    def _allocate(self, channels):
+        B = self.partition_size
+        self.channels = channels
+        # buffer de entrada por canal: [frame anterior | frame actual]
+        self.input_buffer = np.zeros((channels, self.fft_size))
+        # linea de retardo en frecuencia: espectros de los frames completos,
+        # el mas nuevo en la fila 0
+        self.delay_line = np.zeros((max(self.num_partitions - 1, 1), channels, B + 1),
+                                   dtype=complex)
+        self.accumulated = np.zeros((channels, B + 1), dtype=complex)
+        self.frame_output = np.zeros((channels, B))
+
+    def _next_frame(self, spectrum):
+        """Mete el frame que se acaba de completar y precalcula el siguiente"""
+        B = self.partition_size
+        self.delay_line[1:] = self.delay_line[:-1]
+        self.delay_line[0] = spectrum
+
+        self.input_buffer[:, :B] = self.input_buffer[:, B:]
+        self.input_buffer[:, B:] = 0.0
+        self.position = 0
+
+        # aporte de los frames pasados: X[k-j] * H[j] para j >= 1
+        start = max(self.first_partition, 1)
+        if start < self.num_partitions:
+            delayed = self.delay_line[start - 1:self.num_partitions - 1]
+            if self.spectra.shape[1] == 1:
+                # impulso mono: el mismo espectro para todos los canales
+                self.accumulated = np.einsum('ikj,ij->kj', delayed, self.spectra[start:, 0])
+            else:
+                self.accumulated = np.einsum('ikj,ikj->kj', delayed, self.spectra[start:])
+        if self.first_partition > 0:
+            self.frame_output = np.fft.irfft(self.accumulated, n=self.fft_size)[:, B:]
+
+    def process(self, block):
+        """block: (canales, frames), devuelve el aporte de este tramo"""
+        B = self.partition_size
+        if self.channels != block.shape[0]:
+            self._allocate(block.shape[0])
+        output = np.empty(block.shape)
+        done = 0
+        length = block.shape[1]
+
+        while done < length:
+            count = min(B - self.position, length - done)
+            start, end = self.position, self.position + count
+            self.input_buffer[:, B + start:B + end] = block[:, done:done + count]
+
+            if self.first_partition == 0:
+                # el frame actual (aunque este a medias) tambien suena ya
+                spectrum = np.fft.rfft(self.input_buffer)
+                out = np.fft.irfft(spectrum * self.spectra[0] + self.accumulated,
+                                   n=self.fft_size)[:, B:]
+                output[:, done:done + count] = out[:, start:end]
+            else:
+                output[:, done:done + count] = self.frame_output[:, start:end]
+
+            self.position = end
+            done += count
+
+            if self.position == B:
+                if self.first_partition != 0:
+                    spectrum = np.fft.rfft(self.input_buffer)
+                self._next_frame(spectrum)
+
+        return output
+
+class PartitionedConvolver:
+    """
+    Convolucion por bloques con latencia acotada.
+    partition_size: tamaño de las particiones del principio del impulso, cada
+    llamada cuesta como mucho una fft de 2 * partition_size por cada
+    partition_size muestras. La salida sale alineada con la entrada (el frame
+    a medias se convoluciona igual), asi que no agrega latencia.
+    max_partition_size: si es mayor que partition_size, la cola del impulso se
+    parte en pedazos cada vez mas grandes (no uniforme), que sale mas barato
+    para colas largas. None = particiones uniformes.
+    Los bloques pueden ser (frames,) o (frames, canales), todos los canales
+    van en la misma fft
+    """
+    def __init__(self, impulse_response, partition_size=1024, max_partition_size=None,
+                 partitions=None):
+        # partitions: lo que devuelve partition_impulse, si ya lo tenemos guardado
+        if partitions is None:
+            partitions = partition_impulse(impulse_response, partition_size,
+                                           max_partition_size)
+        self.stages = [_ConvolutionStage(*stage) for stage in partitions]
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def process(self, block):
+        # por dentro se trabaja (canales, frames)
+        channels = np.ascontiguousarray(block.reshape(len(block), -1).T)
+        output = self.stages[0].process(channels)
+        for stage in self.stages[1:]:
+            output += stage.process(channels)
+        return output.T.reshape(block.shape)
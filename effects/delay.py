@@ -0,0 +1,52 @@
+import numpy as np
+from effects.registry import EffectPlugin, Param, register
+
+# eco con realimentacion: w[n] = x[n] + feedback * w[n - D], wet = w[n - D].
+# la recursion mira D muestras para atras, entonces un pedazo de hasta D
+# muestras sale entero con operaciones de arrays (no hace falta ir muestra por
+# muestra). El buffer circular guarda las ultimas D muestras de w
+
+class Delay:
+    """Delay por bloques. mix se puede cambiar en vivo (tambien con una rampa (frames, 1))"""
+    def __init__(self, sample_rate, time_ms=250.0, feedback=0.4, mix=0.3):
+        self.length = max(int(round(time_ms * 1e-3 * sample_rate)), 1)
+        self.feedback = feedback
+        self.mix = mix
+        self.reset()
+
+    def reset(self):
+        self.ring = None
+        self.position = 0
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if self.ring is None or self.ring.shape[1:] != block.shape[1:]:
+            self.ring = np.zeros((self.length,) + block.shape[1:], dtype=np.float32)
+            self.position = 0
+
+        wet = np.empty_like(block)
+        for start in range(0, len(block), self.length):
+            chunk = block[start:start + self.length]
+            count = len(chunk)
+            # las posiciones del anillo que tocan, en uno o dos tramos
+            first = min(count, self.length - self.position)
+            for offset, position, size in ((0, self.position, first), (first, 0, count - first)):
+                delayed = self.ring[position:position + size]
+                wet[start + offset:start + offset + size] = delayed
+                delayed *= self.feedback
+                delayed += chunk[offset:offset + size]
+            self.position = (self.position + count) % self.length
+        return block + self.mix * (wet - block)
+
+class DelayPlugin(EffectPlugin):
+    name = 'delay'
+    label = "Delay"
+    params = (Param('time_ms', 250.0, minimum=1.0, maximum=2000.0, unit='ms', label="Tiempo"),
+              Param('feedback', 0.4, minimum=0.0, maximum=0.95, label="Realimentacion"),
+              Param('mix', 0.3, minimum=0.0, maximum=1.0, label="Mix"))
+    live_params = ('mix',)
+
+    def create_stream(self, sample_rate, channels, params):
+        return Delay(sample_rate, **params)
+
+register(DelayPlugin())
@@ -0,0 +1,129 @@
+import numpy as np
+from scipy import signal
+from scipy.ndimage import maximum_filter1d
+from effects.registry import EffectPlugin, Param, register
+
+# compresor y limitador sin loops de python por muestra:
+#   - detector: el pico de todos los canales juntos (quedan enganchados, la
+#     imagen estereo no se corre) pasado a dB
+#   - curva: cuantos dB hay que bajar segun el umbral, la razon y el knee
+#   - release: la reduccion baja a lo sumo release_step dB por muestra. Es una
+#     recursion env[n] = max(red[n], env[n-1] - c), pero sumandole c*n queda
+#     un maximo acumulado (np.maximum.accumulate) y se hace de una por bloque
+#   - attack: un pasa bajos de un polo sobre la reduccion (lfilter con estado)
+#   - lookahead: la señal sale atrasada y la reduccion se mantiene esas
+#     muestras antes, asi el limitador ya bajo cuando llega el pico
+
+# "ningun nivel" en dB para los silencios
+_SILENCE_DB = -180.0
+# 20 / ln(10): en release_ms la reduccion baja 1 neper (~8.7 dB)
+_NEPER_DB = 20 / np.log(10)
+
+def gain_reduction(level_db, threshold_db, ratio, knee_db):
+    """Cuantos dB (>= 0) hay que bajar cada muestra, con knee suave de ancho knee_db"""
+    slope = 1.0 - 1.0 / ratio
+    over = level_db - threshold_db
+    reduction = np.maximum(over, 0.0) * slope
+    if knee_db > 0:
+        in_knee = np.abs(over) < knee_db / 2
+        reduction[in_knee] = slope * (over[in_knee] + knee_db / 2) ** 2 / (2 * knee_db)
+    return reduction
+
+class Compressor:
+    """
+    Compresor por bloques. process(block) con block (frames,) o (frames, canales).
+    Con lookahead_ms la salida sale atrasada lookahead frames (ver latency)
+    """
+    def __init__(self, sample_rate, threshold_db=-20.0, ratio=4.0, attack_ms=10.0,
+                 release_ms=100.0, makeup_db=0.0, knee_db=6.0, lookahead_ms=0.0):
+        self.threshold_db = threshold_db
+        self.ratio = ratio
+        self.knee_db = knee_db
+        self.makeup_db = makeup_db
+        self.latency = int(round(lookahead_ms * 1e-3 * sample_rate))
+        attack_frames = max(attack_ms * 1e-3 * sample_rate, 1.0)
+        self.attack_coef = np.exp(-1.0 / attack_frames)
+        self.release_step = _NEPER_DB / max(release_ms * 1e-3 * sample_rate, 1.0)
+        self.reset()
+
+    def reset(self):
+        self.envelope = 0.0
+        self.zi = np.zeros(1)
+        self.delay_line = None
+        self.held = np.zeros(self.latency)
+
+    def _reduction(self, block):
+        level = np.abs(block) if block.ndim == 1 else np.abs(block).max(axis=1)
+        level_db = 20 * np.log10(np.maximum(level, 10 ** (_SILENCE_DB / 20)))
+        reduction = gain_reduction(level_db.astype(np.float64), self.threshold_db,
+                                   self.ratio, self.knee_db)
+
+        if self.latency:
+            # cada reduccion vale tambien para las latency muestras anteriores:
+            # maximo de las ultimas latency + 1 (la ventana centrada, corrida)
+            extended = np.concatenate([self.held, reduction])
+            self.held = extended[-self.latency:]
+            size = self.latency + 1
+            first = size // 2
+            reduction = maximum_filter1d(extended, size)[first:first + len(reduction)]
+
+        # release: env[n] = max(red[n], env[n-1] - c) como maximo acumulado
+        ramp = self.release_step * np.arange(len(reduction))
+        envelope = np.maximum.accumulate(
+            np.concatenate([[self.envelope - self.release_step], reduction + ramp]))[1:] - ramp
+        self.envelope = envelope[-1]
+
+        smoothed, self.zi = signal.lfilter([1.0 - self.attack_coef], [1.0, -self.attack_coef],
+                                           envelope, zi=self.zi)
+        return smoothed
+
+    def process(self, block):
+        block = np.asarray(block)
+        if not len(block):
+            return block.astype(np.float32)
+        gain = 10 ** ((self.makeup_db - self._reduction(block)) / 20)
+
+        if self.latency:
+            if self.delay_line is None or self.delay_line.shape[1:] != block.shape[1:]:
+                self.delay_line = np.zeros((self.latency,) + block.shape[1:], dtype=np.float32)
+            extended = np.concatenate([self.delay_line, block])
+            self.delay_line = extended[len(block):]
+            block = extended[:len(block)]
+
+        if block.ndim > 1:
+            gain = gain[:, None]
+        return (block * gain).astype(np.float32)
+
+class CompressorPlugin(EffectPlugin):
+    name = 'compressor'
+    label = "Compresor"
+    params = (Param('threshold_db', -20.0, minimum=-60.0, maximum=0.0, unit='dB', label="Umbral"),
+              Param('ratio', 4.0, minimum=1.0, maximum=20.0, label="Razon"),
+              Param('attack_ms', 10.0, minimum=0.1, maximum=200.0, unit='ms', label="Ataque"),
+              Param('release_ms', 100.0, minimum=5.0, maximum=2000.0, unit='ms', label="Release"),
+              Param('makeup_db', 0.0, minimum=0.0, maximum=24.0, unit='dB', label="Ganancia"),
+              Param('knee_db', 6.0, minimum=0.0, maximum=24.0, unit='dB', label="Knee"))
+
+    def create_stream(self, sample_rate, channels, params):
+        return Compressor(sample_rate, **params)
+
+class LimiterPlugin(EffectPlugin):
+    """Compresor de razon infinita con lookahead: la salida no pasa el umbral"""
+    name = 'limiter'
+    label = "Limitador"
+    params = (Param('threshold_db', -1.0, minimum=-30.0, maximum=0.0, unit='dB', label="Techo"),
+              Param('release_ms', 50.0, minimum=5.0, maximum=2000.0, unit='ms', label="Release"),
+              Param('lookahead_ms', 5.0, minimum=0.0, maximum=20.0, unit='ms', label="Lookahead"))
+
+    def latency(self, sample_rate, params):
+        return int(round(self.resolve(params)['lookahead_ms'] * 1e-3 * sample_rate))
+
+    def create_stream(self, sample_rate, channels, params):
+        # el ataque tiene que terminar dentro del lookahead (5 constantes de tiempo)
+        attack_ms = max(params['lookahead_ms'] / 5, 0.01)
+        return Compressor(sample_rate, threshold_db=params['threshold_db'], ratio=np.inf,
+                          attack_ms=attack_ms, release_ms=params['release_ms'], knee_db=0.0,
+                          lookahead_ms=params['lookahead_ms'])
+
+register(CompressorPlugin())
+register(LimiterPlugin())
@@ -0,0 +1,69 @@
+from functools import lru_cache
+import numpy as np
+from effects.filters import SOSPlugin
+from effects.registry import Param, register
+
+# ecualizador de una banda con los biquads del "Audio EQ Cookbook" (RBJ):
+# campana (peaking), estante de graves (lowshelf) y de agudos (highshelf).
+# es un filtro lineal igual que los Butterworth, asi que la cadena lo junta
+# con los filtros de al lado en una sola pasada de sosfilt
+
+EQ_SHAPES = ('peaking', 'lowshelf', 'highshelf')
+
+def design_eq(sample_rate, shape, frequency, gain_db, q=0.707):
+    """
+    Una seccion sos (1, 6) para la banda. El diseño queda en cache, se devuelve
+    una copia porque sosfilt no acepta arrays de solo lectura
+    """
+    return _cached_eq(sample_rate, shape, frequency, gain_db, q).copy()
+
+@lru_cache(maxsize=256)
+def _cached_eq(sample_rate, shape, frequency, gain_db, q):
+    if shape not in EQ_SHAPES:
+        raise ValueError(f"Tipo de banda desconocido: {shape}")
+    if not 0 < frequency < 0.5 * sample_rate:
+        raise ValueError(f"La frecuencia del EQ tiene que estar entre 0 y {0.5 * sample_rate} Hz")
+    amplitude = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * frequency / sample_rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+
+    if shape == 'peaking':
+        b = [1 + alpha * amplitude, -2 * cos_w0, 1 - alpha * amplitude]
+        a = [1 + alpha / amplitude, -2 * cos_w0, 1 - alpha / amplitude]
+    else:
+        root = 2 * np.sqrt(amplitude) * alpha
+        plus, minus = amplitude + 1, amplitude - 1
+        if shape == 'lowshelf':
+            b = [amplitude * (plus - minus * cos_w0 + root),
+                 2 * amplitude * (minus - plus * cos_w0),
+                 amplitude * (plus - minus * cos_w0 - root)]
+            a = [plus + minus * cos_w0 + root,
+                 -2 * (minus + plus * cos_w0),
+                 plus + minus * cos_w0 - root]
+        else:
+            b = [amplitude * (plus + minus * cos_w0 + root),
+                 -2 * amplitude * (minus + plus * cos_w0),
+                 amplitude * (plus + minus * cos_w0 - root)]
+            a = [plus - minus * cos_w0 + root,
+                 2 * (minus - plus * cos_w0),
+                 plus - minus * cos_w0 - root]
+
+    sos = np.array([b + a], dtype=np.float64) / a[0]
+    sos.flags.writeable = False
+    return sos
+
+class EQPlugin(SOSPlugin):
+    name = 'eq'
+    label = "EQ"
+    params = (Param('shape', 'peaking', choices=EQ_SHAPES, label="Tipo"),
+              Param('frequency', 1000, minimum=10, maximum=40000, unit='Hz', label="Frecuencia"),
+              Param('gain_db', 0.0, minimum=-24.0, maximum=24.0, unit='dB', label="Ganancia"),
+              Param('q', 0.707, minimum=0.1, maximum=18.0, label="Q"))
+
+    def sos(self, sample_rate, params):
+        params = self.resolve(params)
+        return design_eq(sample_rate, params['shape'], params['frequency'], params['gain_db'],
+                         params['q'])
+
+register(EQPlugin())
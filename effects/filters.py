@@ -1,36 +1,164 @@
+from functools import lru_cache
 import numpy as np
 from scipy import signal
+from effects.parallel import MIN_SEGMENT, get_workers, parallel_sosfilt_inplace
+from effects.registry import EffectPlugin, Param, register
 
-def apply_filter(audio_data, sample_rate, filter_type, cutoff_freq=None, 
-                 low_cut=None, high_cut=None, order=4):
+FILTER_TYPES = ('lowpass', 'highpass', 'bandpass', 'bandstop')
+
+# de a cuantas muestras se filtra en el lugar (lo que ocupa la copia temporal)
+INPLACE_CHUNK_SIZE = 65536
+
+def design_filter(sample_rate, filter_type, cutoff_freq=None, low_cut=None,
+                  high_cut=None, order=4):
     """
-    Aplica filtro IIR a los datos del audio usando Butterworth!
+    Diseña el Butterworth en secciones de segundo orden (sos), que no se
+    vuelven inestables con ordenes altos o cortes muy bajos como (b, a).
+    El diseño queda en cache por (tipo, orden, cortes, sample_rate), se
+    devuelve una copia porque sosfilt no acepta arrays de solo lectura
     """
+    return _cached_sos(sample_rate, filter_type, cutoff_freq, low_cut, high_cut, order).copy()
+
+def design_from_params(sample_rate, filter_type, params):
+    """Igual que design_filter pero con los params de apply_effect"""
+    if filter_type in ('lowpass', 'highpass'):
+        return design_filter(sample_rate, filter_type, cutoff_freq=params.get('cutoff_freq'))
+    return design_filter(sample_rate, filter_type, low_cut=params.get('low_cut'),
+                         high_cut=params.get('high_cut'))
+
+@lru_cache(maxsize=256)
+def _cached_sos(sample_rate, filter_type, cutoff_freq, low_cut, high_cut, order):
     nyquist = 0.5 * sample_rate
-    
+
     if filter_type == 'lowpass':
         normal_cutoff = cutoff_freq / nyquist
-        b, a = signal.butter(order, normal_cutoff, btype='low', analog=False)
-        filtered = signal.lfilter(b, a, audio_data)
-    
+        return signal.butter(order, normal_cutoff, btype='low', analog=False, output='sos')
+
     elif filter_type == 'highpass':
         normal_cutoff = cutoff_freq / nyquist
-        b, a = signal.butter(order, normal_cutoff, btype='high', analog=False)
-        filtered = signal.lfilter(b, a, audio_data)
-    
+        return signal.butter(order, normal_cutoff, btype='high', analog=False, output='sos')
+
     elif filter_type == 'bandpass':
         low = low_cut / nyquist
         high = high_cut / nyquist
-        b, a = signal.butter(order, [low, high], btype='band')
-        filtered = signal.lfilter(b, a, audio_data)
-    
+        return signal.butter(order, [low, high], btype='band', output='sos')
+
     elif filter_type == 'bandstop':
         low = low_cut / nyquist
         high = high_cut / nyquist
-        b, a = signal.butter(order, [low, high], btype='bandstop')
-        filtered = signal.lfilter(b, a, audio_data)
-    
+        return signal.butter(order, [low, high], btype='bandstop', output='sos')
+
     else:
         raise ValueError("Tipo de filtro falopa")
+
+def apply_filter(audio_data, sample_rate, filter_type, cutoff_freq=None, 
+                 low_cut=None, high_cut=None, order=4, zero_phase=False):
+    """
+    Aplica filtro IIR a los datos del audio usando Butterworth!
+    audio_data: (frames,) o (frames, canales), filtra todos los canales juntos
+    zero_phase: filtra ida y vuelta (sosfiltfilt), sin desfase, solo offline
+    """
+    sos = design_filter(sample_rate, filter_type, cutoff_freq=cutoff_freq,
+                        low_cut=low_cut, high_cut=high_cut, order=order)
+    if zero_phase:
+        filtered = signal.sosfiltfilt(sos, audio_data, axis=0)
+    else:
+        filtered = signal.sosfilt(sos, audio_data, axis=0)
     
-    return filtered
\ No newline at end of file
+    return filtered
+
+def cascade_sos(sos_list):
+    """Pega varios filtros en una sola matriz sos (se aplican uno atras del otro)"""
+    return np.vstack(sos_list)
+
+def _zero_state(sos, block):
+    """Estado inicial en cero para sosfilt a lo largo del eje 0 (uno por canal)"""
+    return np.zeros((sos.shape[0], 2) + np.shape(block)[1:])
+
+def sosfilt_inplace(sos, buffer, chunk_size=INPLACE_CHUNK_SIZE, callback=None, workers=None):
+    """
+    Filtra buffer en su lugar por pedazos, arrastrando el estado, asi no se
+    crea otra copia entera del audio (solo una temporal de chunk_size).
+    callback(fraccion): se llama despues de cada pedazo (progreso / cancelar)
+    workers: hilos (None = effects.parallel.get_workers()), con mas de uno y
+    un buffer largo o de varios canales se reparte (parallel_sosfilt_inplace)
+    """
+    workers = workers or get_workers()
+    if workers > 1 and (len(buffer) >= 2 * MIN_SEGMENT or np.ndim(buffer) > 1):
+        return parallel_sosfilt_inplace(sos, buffer, workers, chunk_size, callback)
+
+    zi = _zero_state(sos, buffer)
+    for start in range(0, len(buffer), chunk_size):
+        chunk = buffer[start:start + chunk_size]
+        filtered, zi = signal.sosfilt(sos, chunk, axis=0, zi=zi)
+        chunk[:] = filtered
+        if callback is not None:
+            callback(min(start + chunk_size, len(buffer)) / len(buffer))
+    return buffer
+
+class StreamFilter:
+    """
+    Lo mismo que apply_filter pero por bloques: diseña el filtro una sola vez
+    y guarda el estado de sosfilt entre un bloque y el siguiente para que no
+    se note el corte.
+    zero_phase: usa sosfiltfilt, no tiene estado asi que cada process() se
+    toma como la señal completa (sirve para renders offline, no para streaming)
+    """
+    def __init__(self, sample_rate, filter_type, cutoff_freq=None,
+                 low_cut=None, high_cut=None, order=4, zero_phase=False, sos=None):
+        # sos: un diseño ya hecho (ej. una banda del EQ), se ignoran los cortes
+        if sos is None:
+            sos = design_filter(sample_rate, filter_type, cutoff_freq=cutoff_freq,
+                                low_cut=low_cut, high_cut=high_cut, order=order)
+        self.sos = sos
+        self.zero_phase = zero_phase
+        self.reset()
+
+    def reset(self):
+        """Vuelve a cero el estado (como si arrancara el archivo)"""
+        self.zi = None
+
+    def process(self, block):
+        if self.zero_phase:
+            return signal.sosfiltfilt(self.sos, block, axis=0)
+
+        if self.zi is None or self.zi.shape[2:] != block.shape[1:]:
+            self.zi = _zero_state(self.sos, block)
+        filtered, self.zi = signal.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        return filtered
+
+class SOSPlugin(EffectPlugin):
+    """
+    Base de los efectos que son un filtro lineal en sos: por bloques es un
+    StreamFilter, todo el buffer se filtra en el lugar, y la cadena puede
+    juntar varios seguidos en una sola pasada (ver EffectChain.render)
+    """
+    def create_stream(self, sample_rate, channels, params):
+        return StreamFilter(sample_rate, self.name, sos=self.sos(sample_rate, params))
+
+    def render(self, audio, sample_rate, params, callback=None, out=None):
+        sos = self.sos(sample_rate, self.resolve(params))
+        if out is None:
+            out = np.array(audio, dtype=np.float32)
+        else:
+            out[...] = audio
+        return sosfilt_inplace(sos, out, callback=callback)
+
+class FilterPlugin(SOSPlugin):
+    """Los Butterworth de siempre (pasa bajos, pasa altos, pasa y suprime bandas)"""
+    def __init__(self, name, label, params):
+        self.name = name
+        self.label = label
+        self.params = params
+
+    def sos(self, sample_rate, params):
+        return design_from_params(sample_rate, self.name, self.resolve(params))
+
+_CUTOFF = Param('cutoff_freq', 1000, minimum=1, maximum=96000, unit='Hz', label="Corte")
+_BAND = (Param('low_cut', 300, minimum=1, maximum=96000, unit='Hz', label="Desde"),
+         Param('high_cut', 3000, minimum=1, maximum=96000, unit='Hz', label="Hasta"))
+
+register(FilterPlugin('lowpass', "Pasa Bajas", (_CUTOFF,)))
+register(FilterPlugin('highpass', "Pasa Altas", (_CUTOFF,)))
+register(FilterPlugin('bandpass', "Pasa Bandas", _BAND))
+register(FilterPlugin('bandstop', "Suprime Bandas", _BAND))
@@ -0,0 +1,55 @@
+import numpy as np
+from effects.registry import RENDER_BLOCK_SIZE, EffectPlugin, Param, register
+
+# ganancia fija y normalizacion al pico
+
+class Gain:
+    """Multiplica por gain_db (se puede cambiar en vivo, tambien con una rampa (frames, 1))"""
+    def __init__(self, sample_rate, gain_db=0.0):
+        self.gain_db = gain_db
+
+    def reset(self):
+        pass
+
+    def process(self, block):
+        return (block * 10 ** (np.asarray(self.gain_db) / 20)).astype(np.float32)
+
+class GainPlugin(EffectPlugin):
+    name = 'gain'
+    label = "Ganancia"
+    params = (Param('gain_db', 0.0, minimum=-60.0, maximum=24.0, unit='dB', label="Ganancia"),)
+    live_params = ('gain_db',)
+
+    def create_stream(self, sample_rate, channels, params):
+        return Gain(sample_rate, **params)
+
+class NormalizePlugin(EffectPlugin):
+    """
+    Lleva el pico de todo el buffer a peak_db. Necesita ver la señal entera
+    antes de sacar la primera muestra, asi que no existe por bloques
+    """
+    name = 'normalize'
+    label = "Normalizar"
+    params = (Param('peak_db', -1.0, minimum=-60.0, maximum=0.0, unit='dB', label="Pico"),)
+    streaming = False
+
+    def render(self, audio, sample_rate, params, callback=None, out=None):
+        params = self.resolve(params)
+        if out is None:
+            out = np.empty(audio.shape, dtype=np.float32)
+        total = len(audio)
+        # dos pasadas por pedazos: el pico y despues la escala (sin copias enteras)
+        peak = 0.0
+        for start in range(0, total, RENDER_BLOCK_SIZE):
+            peak = max(peak, float(np.max(np.abs(audio[start:start + RENDER_BLOCK_SIZE]),
+                                          initial=0.0)))
+        scale = 10 ** (params['peak_db'] / 20) / peak if peak > 0 else 1.0
+        for start in range(0, total, RENDER_BLOCK_SIZE):
+            np.multiply(audio[start:start + RENDER_BLOCK_SIZE], scale,
+                        out=out[start:start + RENDER_BLOCK_SIZE], casting='unsafe')
+            if callback is not None:
+                callback(min(start + RENDER_BLOCK_SIZE, total) / total)
+        return out
+
+register(GainPlugin())
+register(NormalizePlugin())
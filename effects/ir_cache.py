@@ -0,0 +1,158 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from effects.convolution import partition_impulse
+from effects.resample import resample
+
+# cache de impulsos: generar el ruido y sacarle las ffts cada vez que se aplica
+# el reverb es plata tirada, y con semilla fija el mismo ajuste suena igual
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+class ImpulseEntry:
+    """Un impulso ya listo + los espectros que se le fueron pidiendo"""
+    def __init__(self, impulse_response, sample_rate, cache=None):
+        self.impulse_response = impulse_response
+        self.sample_rate = sample_rate
+        self._spectra = OrderedDict()
+        self._cache = cache
+        # el render de fondo y el reproductor piden espectros de la misma
+        # entrada mientras el cache la mide en _trim: todos con el mismo lock
+        self._lock = cache._lock if cache is not None else threading.RLock()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return self.impulse_response.nbytes + sum(
+                _spectra_nbytes(spectra) for spectra in self._spectra.values())
+
+    def _drop_oldest(self):
+        """Suelta el espectro menos usado, False si ya no queda ninguno"""
+        with self._lock:
+            if not self._spectra:
+                return False
+            self._spectra.popitem(last=False)
+            return True
+
+    def _lookup(self, key, build):
+        with self._lock:
+            spectra = self._spectra.get(key)
+            if spectra is not None:
+                self._spectra.move_to_end(key)
+        if spectra is not None:
+            return spectra
+        # se calcula sin el lock (no frena al otro hilo), si otro llego antes se usa ese
+        spectra = build()
+        with self._lock:
+            spectra = self._spectra.setdefault(key, spectra)
+        if self._cache is not None:
+            self._cache._trim()
+        return spectra
+
+    def spectrum(self, fft_size, keep=True):
+        """
+        rfft del impulso con tamaño fft_size. Con keep=False se calcula sin
+        guardarla (la de la convolucion de una mide lo mismo que el archivo)
+        """
+        build = lambda: np.fft.rfft(self.impulse_response, n=fft_size, axis=0)
+        if keep:
+            return self._lookup(('fft', fft_size), build)
+        with self._lock:
+            spectra = self._spectra.get(('fft', fft_size))
+        return spectra if spectra is not None else build()
+
+    def partitions(self, partition_size=1024, max_partition_size=None):
+        """Particiones para PartitionedConvolver (ver partition_impulse)"""
+        return self._lookup(('partitioned', partition_size, max_partition_size),
+                            lambda: partition_impulse(self.impulse_response, partition_size,
+                                                      max_partition_size))
+
+def _spectra_nbytes(spectra):
+    if isinstance(spectra, list):
+        return sum(stage[2].nbytes for stage in spectra)
+    return spectra.nbytes
+
+class ImpulseCache:
+    """
+    LRU de impulsos generados y cargados de archivo, con tope de memoria.
+    Los generados se identifican por (sample_rate, decay_time, decay_factor, seed),
+    los de archivo por (ruta, fecha de modificacion, sample_rate)
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.nbytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _get(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            self.misses += 1
+            impulse_response, sample_rate = build()
+            entry = ImpulseEntry(impulse_response, sample_rate, cache=self)
+            self._entries[key] = entry
+            self._trim()
+            return entry
+
+    def _trim(self):
+        """
+        Saca los menos usados hasta entrar en el tope. El ultimo impulso siempre
+        queda, pero sus espectros no: si solo con eso se pasa, se sueltan de a uno
+        """
+        with self._lock:
+            while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+                self._entries.popitem(last=False)
+            for entry in self._entries.values():
+                while self.nbytes > self.max_bytes and entry._drop_oldest():
+                    pass
+
+    def generated(self, sample_rate, decay_time=1.0, decay_factor=0.5, seed=0, channels=1):
+        """Impulso de generate_impulse_response, siempre el mismo para la misma semilla"""
+        from effects.reverb import generate_impulse_response
+
+        key = ('generated', sample_rate, decay_time, decay_factor, seed, channels)
+        return self._get(key, lambda: (generate_impulse_response(sample_rate, decay_time,
+                                                                 decay_factor, seed=seed,
+                                                                 channels=channels),
+                                       sample_rate))
+
+    def from_file(self, filepath, sample_rate):
+        """Impulso cargado de archivo y remuestreado una sola vez a sample_rate"""
+        from effects.reverb import load_impulse_response
+
+        filepath = os.path.abspath(filepath)
+        key = ('file', filepath, os.path.getmtime(filepath), sample_rate)
+
+        def build():
+            impulse_response, file_rate = load_impulse_response(filepath)
+            if file_rate != sample_rate:
+                impulse_response = resample(impulse_response, file_rate, sample_rate)
+                impulse_response /= np.max(np.abs(impulse_response))
+            return impulse_response, sample_rate
+
+        return self._get(key, build)
+
+# el cache que usa todo el programa
+impulse_cache = ImpulseCache()
@@ -0,0 +1,167 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.fft
+from scipy import signal
+
+# un archivo largo solo usaba un nucleo. Aca el buffer se parte en pedazos y
+# cada pedazo va a un hilo: scipy.fft y sosfilt sueltan el GIL mientras
+# calculan, asi que los hilos corren de verdad en paralelo (y comparten el
+# buffer, no hay que copiar nada a otros procesos).
+#   - convolucion (reverb): overlap-add. Cada pedazo se convoluciona solo, su
+#     cola (largo del impulso - 1) se suma despues sobre el pedazo siguiente
+#   - filtros IIR: en paralelo por canal y por pedazo. Un pedazo filtrado con
+#     estado cero esta mal solo al principio: le falta la respuesta al estado
+#     con el que termino el anterior. Eso se arregla despues en orden pasando
+#     ceros con ese estado, hasta que la respuesta se apaga (ver _hand_off)
+
+# hilos por defecto (1 = todo como antes, sin pool)
+_workers = 1
+_pools = {}
+_pools_lock = threading.Lock()
+
+# pedazos mas chicos que esto no valen lo que cuesta repartirlos
+MIN_SEGMENT = 1 << 16
+# cuando el estado que se arrastra cae por debajo de esto (relativo a como
+# empezo) se deja de corregir: el error queda muy por debajo de un float32
+HAND_OFF_TOLERANCE = 1e-10
+HAND_OFF_CHUNK = 4096
+
+def set_workers(workers):
+    """Cuantos hilos usan los efectos para un buffer entero (None = todos los nucleos)"""
+    global _workers
+    _workers = max(int(workers or os.cpu_count() or 1), 1)
+
+def get_workers():
+    return _workers
+
+def _pool(workers):
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ThreadPoolExecutor(max_workers=workers,
+                                                        thread_name_prefix='dawsito-dsp')
+        return pool
+
+def _segments(length, count, minimum):
+    """Bordes de hasta count pedazos parejos de al menos minimum (salvo si no alcanza)"""
+    count = max(min(count, length // max(minimum, 1)), 1)
+    bounds = np.linspace(0, length, count + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _run(workers, tasks):
+    """Corre las funciones en el pool y devuelve sus resultados en orden"""
+    if workers <= 1 or len(tasks) <= 1:
+        return [task() for task in tasks]
+    return [future.result() for future in [_pool(workers).submit(task) for task in tasks]]
+
+def parallel_convolve(frames, impulse_entry, workers=None):
+    """
+    Lo mismo que convolucionar frames (frames, canales) con el impulso del
+    ImpulseEntry y recortar como mode='same', pero por pedazos en varios
+    hilos (overlap-add). Devuelve float64 (frames, canales)
+    """
+    workers = workers or _workers
+    impulse = impulse_entry.impulse_response
+    impulse_length = len(impulse)
+    length, channels = frames.shape
+    # pedazos de al menos 4 impulsos (si no la fft gasta casi todo en la cola)
+    # y un par por hilo para repartir parejo
+    bounds = _segments(length, 2 * workers, max(4 * impulse_length, MIN_SEGMENT))
+    longest = max(end - start for start, end in bounds)
+    fft_size = scipy.fft.next_fast_len(longest + impulse_length - 1, real=True)
+    spectrum = impulse_entry.spectrum(fft_size).reshape(fft_size // 2 + 1, -1)
+
+    # la salida 'same' es la convolucion completa desde crop
+    crop = (impulse_length - 1) // 2
+    wet = np.zeros((length, channels))
+
+    def convolve(start, end):
+        def task():
+            block = scipy.fft.rfft(frames[start:end], n=fft_size, axis=0)
+            full = scipy.fft.irfft(block * spectrum, n=fft_size, axis=0)
+            full = full[:end - start + impulse_length - 1]
+            # la parte propia del pedazo se escribe directo (no se pisa con
+            # ningun otro hilo), la cola se devuelve para sumarla despues
+            own_start, own_end = max(start, crop), min(end, crop + length)
+            if own_end > own_start:
+                wet[own_start - crop:own_end - crop] = full[own_start - start:own_end - start]
+            return full[end - start:]
+        return task
+
+    tails = _run(workers, [convolve(start, end) for start, end in bounds])
+    # las colas caen sobre el pedazo siguiente (o despues del final, donde no
+    # escribio nadie y por eso wet arranca en cero)
+    for (start, end), tail in zip(bounds, tails):
+        first, last = max(end, crop), min(end + len(tail), crop + length)
+        if last > first:
+            wet[first - crop:last - crop] += tail[first - end:last - end]
+    return wet
+
+def _filter_segment(sos, buffer, start, end, columns, chunk_size):
+    """Filtra buffer[start:end, columns] en el lugar con estado cero, devuelve el estado final"""
+    segment = buffer[start:end, columns]
+    zi = np.zeros((sos.shape[0], 2) + segment.shape[1:])
+    for chunk_start in range(0, len(segment), chunk_size):
+        chunk = segment[chunk_start:chunk_start + chunk_size]
+        filtered, zi = signal.sosfilt(sos, chunk, axis=0, zi=zi)
+        chunk[:] = filtered
+    return zi
+
+def _hand_off(sos, buffer, start, end, state):
+    """
+    Suma a buffer[start:end] la respuesta del filtro al estado con el que
+    arranca el pedazo (entrada cero) y devuelve como queda ese estado al final
+    del pedazo. Se corta cuando el estado ya se apago
+    """
+    scale = np.max(np.abs(state))
+    if scale == 0:
+        return state
+    zeros = np.zeros((HAND_OFF_CHUNK,) + buffer.shape[1:])
+    position = start
+    while position < end:
+        count = min(HAND_OFF_CHUNK, end - position)
+        response, state = signal.sosfilt(sos, zeros[:count], axis=0, zi=state)
+        buffer[position:position + count] += response
+        position += count
+        if np.max(np.abs(state)) < scale * HAND_OFF_TOLERANCE:
+            return np.zeros_like(state)
+    return state
+
+def parallel_sosfilt_inplace(sos, buffer, workers=None, chunk_size=65536, callback=None):
+    """
+    sosfilt_inplace repartido en hilos: los canales en grupos y, si sobran
+    hilos, el tiempo en pedazos con traspaso de estado. Da lo mismo que el
+    filtrado en serie salvo redondeo.
+    callback(fraccion): despues de la parte paralela y de cada traspaso
+    """
+    workers = workers or _workers
+    length = len(buffer)
+    buffer_2d = buffer.reshape(length, -1)
+    channels = buffer_2d.shape[1]
+    groups = min(channels, workers)
+    group_bounds = _segments(channels, groups, 1)
+    bounds = _segments(length, max(workers // groups, 1), MIN_SEGMENT)
+
+    tasks = [(lambda start=start, end=end, first=first, last=last:
+              _filter_segment(sos, buffer_2d, start, end, slice(first, last), chunk_size))
+             for start, end in bounds for first, last in group_bounds]
+    states = _run(workers, tasks)
+    if callback is not None:
+        callback(0.9 if len(bounds) > 1 else 1.0)
+    if len(bounds) == 1:
+        return buffer
+
+    # estado final de cada pedazo (todos los canales juntos)
+    finals = [np.concatenate(states[index * len(group_bounds):(index + 1) * len(group_bounds)],
+                             axis=2)
+              for index in range(len(bounds))]
+    # en orden: el estado de verdad al empezar cada pedazo es el final (con
+    # estado cero) del anterior + lo que quedaba del estado que le llego a ese
+    carried = finals[0]
+    for index, (start, end) in enumerate(bounds[1:], start=1):
+        carried = finals[index] + _hand_off(sos, buffer_2d, start, end, carried)
+        if callback is not None:
+            callback(0.9 + 0.1 * index / (len(bounds) - 1))
+    return buffer
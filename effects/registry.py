@@ -0,0 +1,154 @@
+import numpy as np
+
+# registro de efectos: cada efecto es un plugin que declara sus parametros,
+# si se puede usar por bloques (streaming), su latencia y como se crea.
+# la cadena, el modo streaming, el reproductor y la ventana preguntan aca en
+# vez de tener un if/elif por nombre.
+#
+# para agregar un efecto: subclase de EffectPlugin + register(MiEfecto())
+
+# de a cuantos frames se procesa cuando se renderiza un buffer entero por bloques
+RENDER_BLOCK_SIZE = 65536
+
+class Param:
+    """
+    Un parametro de un efecto.
+    choices: si esta, el valor tiene que ser uno de esos (ej. tipo de banda)
+    minimum/maximum: rango valido (y el de los sliders de la ventana)
+    """
+    def __init__(self, name, default, minimum=None, maximum=None, choices=None, unit='',
+                 label=None):
+        self.name = name
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = choices
+        self.unit = unit
+        self.label = label or name
+
+    def check(self, effect_name, value):
+        if self.choices is not None:
+            if value not in self.choices:
+                raise ValueError(f"{effect_name}: {self.name} tiene que ser uno de "
+                                 f"{', '.join(map(str, self.choices))} (llego {value!r})")
+            return value
+        if value is None:
+            return value
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(f"{effect_name}: {self.name}={value} es menor que {self.minimum}")
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError(f"{effect_name}: {self.name}={value} es mayor que {self.maximum}")
+        return value
+
+class EffectPlugin:
+    """
+    Base de los efectos. Una subclase define:
+      name        nombre con el que se usa en la cadena y en los json de batch
+      params      tupla de Param
+      streaming   si create_stream() existe (si no, solo render de todo el buffer)
+      live_params parametros que el reproductor puede cambiar en vivo poniendo
+                  el atributo del mismo nombre en el objeto de create_stream
+                  (tiene que aceptar un array, se le pasa una rampa)
+    y create_stream() y/o render(). Los filtros lineales ademas devuelven sos()
+    para que la cadena junte varios en una sola pasada
+    """
+    name = None
+    label = None
+    params = ()
+    streaming = True
+    live_params = ()
+
+    def resolve(self, params):
+        """Los params con defaults completados, chequea nombres y rangos"""
+        known = {param.name: param for param in self.params}
+        unknown = set(params) - set(known)
+        if unknown:
+            raise ValueError(f"{self.name}: parametros desconocidos {', '.join(sorted(unknown))}")
+        return {name: param.check(self.name, params.get(name, param.default))
+                for name, param in known.items()}
+
+    def latency(self, sample_rate, params):
+        """Frames que se atrasa la salida al procesar por bloques"""
+        return 0
+
+    def sos(self, sample_rate, params):
+        """Las secciones de segundo orden si el efecto es un filtro lineal (si no None)"""
+        return None
+
+    def create_stream(self, sample_rate, channels, params):
+        """Objeto con process(block) y reset() para procesar por bloques"""
+        raise ValueError(f"{self.name} no se puede usar por bloques")
+
+    def render(self, audio, sample_rate, params, callback=None, out=None):
+        """
+        Aplica el efecto a todo el buffer y devuelve float32 (out si se paso).
+        Por defecto pasa el buffer por create_stream de a RENDER_BLOCK_SIZE y
+        compensa la latencia, asi la salida queda alineada con la entrada
+        """
+        params = self.resolve(params)
+        if out is None:
+            out = np.empty(audio.shape, dtype=np.float32)
+        channels = audio.shape[1] if audio.ndim > 1 else 1
+        effect = self.create_stream(sample_rate, channels, params)
+        latency = self.latency(sample_rate, params)
+        total = len(audio)
+
+        written = 0
+        for start in range(0, total + latency, RENDER_BLOCK_SIZE):
+            block = audio[start:start + RENDER_BLOCK_SIZE]
+            if start + RENDER_BLOCK_SIZE > total:
+                # la cola de ceros para sacar lo que quedo atrasado
+                padding = min(start + RENDER_BLOCK_SIZE, total + latency) - max(start, total)
+                block = np.concatenate([block, np.zeros((padding,) + audio.shape[1:],
+                                                        dtype=np.float32)])
+            processed = effect.process(block)
+            # los primeros latency frames de salida son de antes del principio
+            skip = max(latency - start, 0)
+            processed = processed[skip:]
+            out[written:written + len(processed)] = processed
+            written += len(processed)
+            if callback is not None:
+                callback(min(start + RENDER_BLOCK_SIZE, total + latency) / (total + latency))
+        return out
+
+_EFFECTS = {}
+_builtins_loaded = False
+
+def register(plugin):
+    """Agrega un efecto al registro (reemplaza si ya habia uno con ese nombre)"""
+    if not plugin.name:
+        raise ValueError("El efecto no tiene name")
+    _EFFECTS[plugin.name] = plugin
+    return plugin
+
+def _load_builtins():
+    # los modulos de efectos se registran solos al importarse
+    global _builtins_loaded
+    if not _builtins_loaded:
+        _builtins_loaded = True
+        import effects.filters
+        import effects.reverb
+        import effects.eq
+        import effects.dynamics
+        import effects.gain
+        import effects.delay
+
+def get_effect(name):
+    _load_builtins()
+    if name not in _EFFECTS:
+        raise ValueError(f"Unknown effect type: {name}")
+    return _EFFECTS[name]
+
+def available_effects():
+    """Los nombres registrados, en el orden en que se registraron"""
+    _load_builtins()
+    return list(_EFFECTS)
+
+def create_stream_effect(effect_type, sample_rate, channels=1, **params):
+    """El objeto por bloques de un efecto (ver EffectPlugin.create_stream)"""
+    plugin = get_effect(effect_type)
+    return plugin.create_stream(sample_rate, channels, plugin.resolve(params))
+
+def render_effect(audio, sample_rate, effect_type, params, callback=None, out=None):
+    """Aplica un efecto a todo el buffer (ver EffectPlugin.render)"""
+    return get_effect(effect_type).render(audio, sample_rate, params, callback=callback, out=out)
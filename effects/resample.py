@@ -0,0 +1,134 @@
+from functools import lru_cache
+from math import gcd
+import numpy as np
+from scipy import signal
+
+# cambio de frecuencia de muestreo con filtros polifase (resample_poly).
+# el FIR anti-alias depende solo de la razon up/down, asi que se diseña una
+# vez por razon (44.1k <-> 48k <-> 96k se repiten todo el tiempo)
+
+# las frecuencias que ofrece la ventana como frecuencia del proyecto
+COMMON_RATES = (22050, 44100, 48000, 88200, 96000)
+
+def resample_ratio(from_rate, to_rate):
+    """(up, down) ya simplificados para pasar de from_rate a to_rate"""
+    from_rate, to_rate = int(from_rate), int(to_rate)
+    if from_rate <= 0 or to_rate <= 0:
+        raise ValueError(f"Frecuencias invalidas: {from_rate} -> {to_rate}")
+    divisor = gcd(from_rate, to_rate)
+    return to_rate // divisor, from_rate // divisor
+
+def design_resampler(up, down):
+    """
+    FIR pasabajos para resample_poly con esa razon (el mismo que arma scipy
+    por defecto: kaiser 5.0, 10 ceros por lado). Queda en cache, se devuelve
+    una copia porque resample_poly lo modifica
+    """
+    return _cached_taps(up, down).copy()
+
+@lru_cache(maxsize=32)
+def _cached_taps(up, down):
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    taps = signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+    taps.flags.writeable = False
+    return taps
+
+@lru_cache(maxsize=32)
+def _cached_scaled_taps(up, down):
+    """Los taps ya multiplicados por up (lo que usa upfirdn por dentro de resample_poly)"""
+    taps = _cached_taps(up, down) * up
+    taps.flags.writeable = False
+    return taps
+
+def resample(audio, from_rate, to_rate):
+    """
+    Todo el buffer de una (frames, ...) a to_rate, float32.
+    Si las frecuencias son iguales devuelve el mismo array
+    """
+    if int(from_rate) == int(to_rate):
+        return audio
+    up, down = resample_ratio(from_rate, to_rate)
+    output = signal.resample_poly(audio, up, down, axis=0, window=design_resampler(up, down))
+    return output.astype(np.float32, copy=False)
+
+def resampled_length(frames, from_rate, to_rate):
+    """Cuantos frames quedan despues de resample (igual que resample_poly)"""
+    up, down = resample_ratio(from_rate, to_rate)
+    return -(-frames * up // down)
+
+class StreamResampler:
+    """
+    resample por bloques con estado: da lo mismo que resample() sobre la señal
+    entera (salvo redondeo) sin tenerla toda en memoria. Cada process()
+    devuelve las muestras de salida que ya se pueden calcular, flush() las que
+    faltan al final (el filtro necesita ver un poco del futuro).
+    Por dentro cada bloque pasa por upfirdn con un poco de historia adelante
+    """
+    def __init__(self, from_rate, to_rate):
+        self.up, self.down = resample_ratio(from_rate, to_rate)
+        self.taps = _cached_scaled_taps(self.up, self.down)
+        # retardo del filtro en muestras de la señal subida
+        self.delay = (len(self.taps) - 1) // 2
+        # entradas que mira cada salida
+        self.span = -(-len(self.taps) // self.up)
+        # upfirdn arranca en la salida 0 del pedazo: el pedazo tiene que empezar
+        # en una entrada s con s * up = delay (mod down)
+        self.alignment = (self.delay * pow(self.up, -1, self.down)) % self.down
+        self.reset()
+
+    def reset(self):
+        self.history = None
+        # indice (de la señal de entrada) de la primera muestra de history
+        self.history_start = 0
+        self.consumed = 0
+        self.produced = 0
+
+    def _first_input(self, output_index):
+        """Primera entrada que necesita esa salida, corrida para alinear con upfirdn"""
+        oldest = (output_index * self.down + self.delay) // self.up - self.span + 1
+        return oldest - (oldest - self.alignment) % self.down
+
+    def _compute(self, count):
+        if count <= 0:
+            return np.zeros((0,) + self.history.shape[1:], dtype=np.float32)
+        first = self._first_input(self.produced)
+        segment = self.history[first - self.history_start:]
+        output = signal.upfirdn(self.taps, segment, self.up, self.down, axis=0)
+        skip = (self.produced * self.down + self.delay - first * self.up) // self.down
+        self.produced += count
+        return output[skip:skip + count].astype(np.float32)
+
+    def _append(self, block):
+        if self.history is None:
+            # antes del principio hay ceros, como en resample_poly
+            padding = self.span + self.down
+            self.history = np.zeros((padding,) + block.shape[1:], dtype=np.float32)
+            self.history_start = -padding
+        self.history = np.concatenate([self.history, block.astype(np.float32, copy=False)])
+        self.consumed += len(block)
+
+    def _ready(self):
+        """Cuantas salidas ya tienen todas sus entradas"""
+        # la salida k necesita hasta la entrada (k * down + delay) // up
+        last = (self.consumed * self.up - 1 - self.delay) // self.down
+        return max(last + 1 - self.produced, 0)
+
+    def process(self, block):
+        self._append(block)
+        output = self._compute(self._ready())
+        # se guarda solo lo que puede hacer falta para la proxima salida
+        first = self._first_input(self.produced)
+        self.history = self.history[first - self.history_start:]
+        self.history_start = first
+        return output
+
+    def flush(self):
+        """Las salidas que quedaban pendientes (como si siguieran ceros)"""
+        if self.history is None:
+            return np.zeros(0, dtype=np.float32)
+        total = -(-self.consumed * self.up // self.down)
+        missing = total - self.produced
+        padding = -(-(total * self.down + self.delay) // self.up) - self.consumed + 1
+        self._append(np.zeros((max(padding, 0),) + self.history.shape[1:], dtype=np.float32))
+        return self._compute(missing)
@@ -1,32 +1,170 @@
 import numpy as np
 from scipy import signal
+from scipy.fft import next_fast_len
 import soundfile as sf
+import profiling
+from effects.convolution import PartitionedConvolver
+from effects.ir_cache import ImpulseEntry, impulse_cache
+from effects.parallel import MIN_SEGMENT, get_workers, parallel_convolve
+from effects.registry import EffectPlugin, Param, register
 
 # decidimos generar el impulso con mates para q suene mejor, el globo sonaba muy feo jeje
 
-def generate_impulse_response(sample_rate, decay_time=1.0, decay_factor=0.5):
-    """Genera el impulso más pulido"""
+def generate_impulse_response(sample_rate, decay_time=1.0, decay_factor=0.5, seed=None,
+                              channels=1):
+    """
+    Genera el impulso más pulido
+    seed: con semilla sale siempre el mismo ruido, None = al azar
+    channels: con mas de 1 sale (muestras, canales), un ruido distinto por
+    canal (seed, seed + 1, ...) para que el reverb quede decorrelacionado
+    """
+    if channels > 1:
+        return np.stack([generate_impulse_response(sample_rate, decay_time, decay_factor,
+                                                   None if seed is None else seed + channel)
+                         for channel in range(channels)], axis=1)
+
     length = int(sample_rate * decay_time)
     t = np.linspace(0, decay_time, length)
-    impulse = np.random.randn(length) * np.exp(-t / decay_factor)
+    if seed is None:
+        noise = np.random.randn(length)
+    else:
+        noise = np.random.default_rng(seed).standard_normal(length)
+    impulse = noise * np.exp(-t / decay_factor)
     return impulse / np.max(np.abs(impulse))
 
-def apply_reverb(audio_data, sample_rate, impulse_response=None, mix=0.3, decay_time=1.0):
+def load_impulse_response(filepath):
+    """Carga un impulso desde archivo (tipo el globo), en mono y normalizado"""
+    impulse, sample_rate = sf.read(filepath, always_2d=True)
+    impulse = np.mean(impulse, axis=1)
+    return impulse / np.max(np.abs(impulse)), sample_rate
+
+def get_impulse_entry(sample_rate, decay_time=1.0, seed=0, impulse_file=None, channels=1):
+    """Busca el impulso en el cache: el del archivo si hay, si no el generado"""
+    if impulse_file is not None:
+        return impulse_cache.from_file(impulse_file, sample_rate)
+    return impulse_cache.generated(sample_rate, decay_time, seed=seed, channels=channels)
+
+def apply_reverb(audio_data, sample_rate, impulse_response=None, mix=0.3, decay_time=1.0,
+                 seed=0, impulse_file=None, decorrelate=False, out=None):
     """
     Aplica el reverb usando convolucion
     mix: 0 (dry) to 1 (wet)
+    out: array con la forma de audio_data donde dejar el resultado (ej. un memmap)
+    sin impulse_response el impulso sale del cache (mismo seed = mismo reverb)
+    audio_data puede ser (frames,) o (frames, canales), todos los canales van
+    en la misma fft. decorrelate: un impulso distinto por canal
     """
+    audio_data = np.asarray(audio_data)
+    frames = audio_data.reshape(len(audio_data), -1)
+
+    with profiling.stage('reverb.convolve', frames=len(frames), sample_rate=sample_rate):
+        wet_signal = _wet_signal(frames, sample_rate, impulse_response, decay_time, seed,
+                                 impulse_file, decorrelate)
+
+    with profiling.stage('reverb.normalize', frames=len(frames), sample_rate=sample_rate):
+        return _mix(audio_data, frames, wet_signal, mix, out)
+
+def _wet_signal(frames, sample_rate, impulse_response, decay_time, seed, impulse_file,
+                decorrelate):
+    """La señal convolucionada (frames, canales), todavia sin normalizar"""
+    if get_workers() > 1 and len(frames) >= 2 * MIN_SEGMENT:
+        # archivo largo y varios hilos: overlap-add por pedazos (effects/parallel.py)
+        if impulse_response is None:
+            channels = frames.shape[1] if decorrelate else 1
+            entry = get_impulse_entry(sample_rate, decay_time, seed, impulse_file, channels)
+        else:
+            impulse_response = np.asarray(impulse_response)
+            entry = ImpulseEntry(impulse_response.reshape(len(impulse_response), -1), sample_rate)
+        return parallel_convolve(frames, entry)
+
     if impulse_response is None:
-        impulse_response = generate_impulse_response(sample_rate, decay_time)
-    
-    audio_data = np.squeeze(audio_data)
-    impulse_response = np.squeeze(impulse_response)
-    
-    # nuestra querida fft la usamos en la convolucion
-    wet_signal = signal.fftconvolve(audio_data, impulse_response, mode='same')
-    
+        # la fft del impulso es tan larga como el archivo: se calcula y se tira,
+        # guardarla dejaria cientos de MB tomados para un solo largo
+        channels = frames.shape[1] if decorrelate else 1
+        entry = get_impulse_entry(sample_rate, decay_time, seed, impulse_file, channels)
+        full_length = len(frames) + len(entry.impulse_response) - 1
+        fft_size = next_fast_len(full_length, real=True)
+        spectrum = entry.spectrum(fft_size, keep=False).reshape(fft_size // 2 + 1, -1).T
+        # las ffts van por canal sobre memoria contigua (canales, frames)
+        channels = np.ascontiguousarray(frames.T)
+        wet_signal = np.fft.irfft(np.fft.rfft(channels, n=fft_size) * spectrum, n=fft_size)
+        # recorta igual que mode='same'
+        start = (len(entry.impulse_response) - 1) // 2
+        wet_signal = wet_signal[:, start:start + len(frames)].T
+    else:
+        impulse_response = np.asarray(impulse_response)
+        impulse_response = impulse_response.reshape(len(impulse_response), -1)
+
+        # nuestra querida fft la usamos en la convolucion
+        wet_signal = signal.fftconvolve(frames, impulse_response, mode='same', axes=0)
+    return wet_signal
+
+def _mix(audio_data, frames, wet_signal, mix, out):
+    """Lleva el wet al pico del dry y mezcla (en out si se paso)"""
     # normaliza y  mezcla con dry la señal
-    wet_signal = wet_signal / np.max(np.abs(wet_signal)) * np.max(np.abs(audio_data))
-    output = (1 - mix) * audio_data + mix * wet_signal
-    
-    return output
\ No newline at end of file
+    wet_signal *= mix * np.max(np.abs(frames)) / np.max(np.abs(wet_signal))
+    if out is None:
+        output = (1 - mix) * frames + wet_signal
+        return output.reshape(audio_data.shape)
+
+    # mezcla directo en out sin armar otro array entero
+    output = out.reshape(frames.shape)
+    np.multiply(frames, 1 - mix, out=output, casting='unsafe')
+    output += wet_signal
+    return out
+
+class StreamReverb:
+    """
+    Reverb por bloques con convolucion particionada: las ffts del impulso se
+    calculan una vez y cada bloque cuesta poco, sin importar lo larga que sea
+    la cola (ver effects/convolution.py).
+    channels + decorrelate: genera un impulso distinto para cada canal
+    """
+    def __init__(self, sample_rate, impulse_response=None, mix=0.3, decay_time=1.0,
+                 partition_size=1024, max_partition_size=16384, seed=0, impulse_file=None,
+                 channels=1, decorrelate=False):
+        partitions = None
+        if impulse_response is None:
+            entry = get_impulse_entry(sample_rate, decay_time, seed, impulse_file,
+                                      channels if decorrelate else 1)
+            impulse_response = entry.impulse_response
+            partitions = entry.partitions(partition_size, max_partition_size)
+
+        self.impulse_response = np.asarray(impulse_response)
+        self.mix = mix
+        # sin tener la señal entera no se puede normalizar por el pico del wet,
+        # entonces normalizamos por la energia del impulso (de cada canal)
+        self.wet_gain = 1.0 / np.sqrt(np.sum(self.impulse_response ** 2, axis=0))
+        self.convolver = PartitionedConvolver(self.impulse_response, partition_size,
+                                              max_partition_size, partitions=partitions)
+
+    def reset(self):
+        """Borra la cola pendiente"""
+        self.convolver.reset()
+
+    def process(self, block):
+        wet_signal = self.convolver.process(block) * self.wet_gain
+        return (1 - self.mix) * block + self.mix * wet_signal
+
+class ReverbPlugin(EffectPlugin):
+    """
+    Todo el buffer: apply_reverb (fft de una, normaliza por el pico del wet).
+    Por bloques: StreamReverb (normaliza por la energia del impulso)
+    """
+    name = 'reverb'
+    label = "Reverb"
+    params = (Param('decay_time', 1.0, minimum=0.01, maximum=30.0, unit='s', label="Decay"),
+              Param('mix', 0.3, minimum=0.0, maximum=1.0, label="Mix"),
+              Param('seed', 0),
+              Param('impulse_file', None),
+              Param('decorrelate', False, choices=(False, True)))
+    live_params = ('mix',)
+
+    def create_stream(self, sample_rate, channels, params):
+        return StreamReverb(sample_rate, channels=channels, **params)
+
+    def render(self, audio, sample_rate, params, callback=None, out=None):
+        output = apply_reverb(audio, sample_rate, out=out, **self.resolve(params))
+        return output if out is not None else output.astype(np.float32)
+
+register(ReverbPlugin())
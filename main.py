@@ -1,18 +1,78 @@
+import os
 import sys
 import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
                              QWidget, QPushButton, QSlider, QLabel, QFileDialog,
-                             QMessageBox, QGroupBox)
-from PyQt5.QtCore import Qt
+                             QMessageBox, QGroupBox, QListWidget, QCheckBox,
+                             QProgressBar, QTabWidget, QComboBox, QStackedWidget,
+                             QTableWidget, QTableWidgetItem, QHeaderView)
+from PyQt5.QtCore import Qt, QTimer
 import soundfile as sf
-import sounddevice as sd
-from scipy.signal import spectrogram
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
+import profiling
 from audio_processor import AudioProcessor
+from render_worker import BackgroundRenderer, SpectrogramWorker
+from session import SESSION_EXTENSION
+from spectrum import FLOOR_DB
+from player import Player, PREVIEW_RATE
+from effects import parallel
+from effects.registry import available_effects, get_effect
+from effects.resample import COMMON_RATES
+from waveform import WaveformView
 from effects.filters import apply_filter
 from effects.reverb import apply_reverb
 
+# los efectos que ya tienen su grupo armado a mano, el resto va en "Más Efectos"
+HAND_MADE_EFFECTS = ('lowpass', 'highpass', 'bandpass', 'bandstop', 'reverb')
+# pasos de los sliders de frecuencia que se arman con los Param de los plugins
+LOG_SLIDER_STEPS = 1000
+
+def _is_log_param(param):
+    # las frecuencias van en escala logaritmica, si no los graves quedan en dos pasos
+    return param.unit == 'Hz' and param.minimum > 0
+
+def _param_step(param):
+    """Paso redondo (0.01, 0.1, 1, 10...) que da unos 100 a 1000 valores en el rango"""
+    return 10.0 ** np.floor(np.log10((param.maximum - param.minimum) / 100))
+
+def param_slider_range(param):
+    if _is_log_param(param):
+        return 0, LOG_SLIDER_STEPS
+    step = _param_step(param)
+    return int(np.ceil(param.minimum / step - 1e-9)), int(np.floor(param.maximum / step + 1e-9))
+
+def param_from_slider(param, position):
+    """Posicion del slider -> valor del parametro"""
+    # en la posicion del default va el default tal cual (el redondeo del
+    # slider lo correria, ej. 1000 Hz -> 998 Hz o q 0.707 -> 0.7)
+    if param.default is not None and position == param_to_slider(param, param.default):
+        return param.default
+    if _is_log_param(param):
+        value = param.minimum * (param.maximum / param.minimum) ** (position / LOG_SLIDER_STEPS)
+        # tres cifras significativas
+        return int(round(value, 2 - int(np.floor(np.log10(value)))))
+    return round(float(position * _param_step(param)), 6)
+
+def param_to_slider(param, value):
+    if _is_log_param(param):
+        fraction = np.log(value / param.minimum) / np.log(param.maximum / param.minimum)
+        return int(round(fraction * LOG_SLIDER_STEPS))
+    return int(round(value / _param_step(param)))
+
+# columnas de la tabla de perfil: (titulo, funcion que saca el texto de los totales)
+PROFILE_COLUMNS = (
+    ("Etapa", None),
+    ("Llamadas", lambda entry: f"{entry['calls']}"),
+    ("Total ms", lambda entry: f"{entry['wall_ms']:.1f}"),
+    ("CPU ms", lambda entry: f"{entry['cpu_ms']:.1f}"),
+    ("Máx ms", lambda entry: f"{entry['max_ms']:.1f}"),
+    ("Media ms", lambda entry: f"{entry['wall_ms'] / entry['calls']:.2f}"),
+    ("Pico MB", lambda entry: f"{entry['peak_alloc_bytes'] / 1e6:.1f}"
+     if entry['peak_alloc_bytes'] else "-"),
+    ("x RT", lambda entry: f"{entry['realtime']:.1f}" if entry['realtime'] else "-"),
+)
+
 class Dawsito(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -30,12 +90,93 @@ class Dawsito(QMainWindow):
         self.plot_canvas = FigureCanvas(Figure(figsize=(12, 6)))
         fig = self.plot_canvas.figure
         self.ax_waveform_original = fig.add_subplot(211)
-        self.ax_waveform_processed = fig.add_subplot(212)
-
+        self.ax_waveform_processed = fig.add_subplot(212, sharex=self.ax_waveform_original)
+
+        # el original se dibuja normal, el procesado con blit para poder
+        # cambiarlo sin redibujar el original
+        self.original_view = WaveformView(self.ax_waveform_original, 'blue', "Original")
+        self.processed_view = WaveformView(self.ax_waveform_processed, 'green', "Procesada",
+                                           animated=True)
+        self.processed_background = None
+        self.plot_canvas.mpl_connect('draw_event', self.on_plot_draw)
+        self.plot_canvas.mpl_connect('scroll_event', self.on_plot_scroll)
+        self.ax_waveform_original.callbacks.connect('xlim_changed', self.on_plot_xlim_changed)
+
+
+        # espectrogramas: se calculan en otro hilo y se muestran como imagen
+        self.spectrogram_canvas = FigureCanvas(Figure(figsize=(12, 6)))
+        fig = self.spectrogram_canvas.figure
+        self.ax_spectrogram_original = fig.add_subplot(211)
+        self.ax_spectrogram_processed = fig.add_subplot(212, sharex=self.ax_spectrogram_original,
+                                                        sharey=self.ax_spectrogram_original)
+        self.spectrogram_images = {}
+        for key, ax, title in (('original', self.ax_spectrogram_original, "Original"),
+                               ('processed', self.ax_spectrogram_processed, "Procesada")):
+            self.spectrogram_images[key] = ax.imshow(
+                np.full((2, 2), FLOOR_DB), origin='lower', aspect='auto',
+                cmap='magma', vmin=-100, vmax=0, extent=(0, 1, 0, 1))
+            ax.set_title(title)
+            ax.set_ylabel("Hz")
+        self.ax_spectrogram_processed.set_xlabel("Segundos")
+        self.spectrograms = {}
+
+        # analizador de lo que esta sonando, se pinta con blit a ~30 fps
+        self.analyzer_canvas = FigureCanvas(Figure(figsize=(12, 2)))
+        self.ax_analyzer = self.analyzer_canvas.figure.add_subplot(111)
+        self.ax_analyzer.set_xscale('log')
+        self.ax_analyzer.set_xlim(20, 22050)
+        self.ax_analyzer.set_ylim(-100, 0)
+        self.ax_analyzer.set_ylabel("dB")
+        self.analyzer_line, = self.ax_analyzer.plot([], [], color='orange', linewidth=0.8,
+                                                    animated=True)
+        self.analyzer_background = None
+        self.analyzer_canvas.mpl_connect('draw_event', self.on_analyzer_draw)
+
+        waveform_tab = QWidget()
+        waveform_layout = QVBoxLayout(waveform_tab)
+        waveform_layout.addWidget(self.plot_canvas)
+        waveform_layout.addWidget(QLabel("Rueda: zoom, Shift + rueda: moverse"))
+        self.plot_tabs = QTabWidget()
+        self.plot_tabs.addTab(waveform_tab, "Forma De Onda")
+        self.plot_tabs.addTab(self.spectrogram_canvas, "Espectrograma")
+
+        # tiempos por etapa (ver profiling.py), se actualiza cada segundo
+        profile_tab = QWidget()
+        profile_layout = QVBoxLayout(profile_tab)
+        profile_buttons = QHBoxLayout()
+        self.profile_checkbox = QCheckBox("Medir tiempos")
+        self.profile_checkbox.setChecked(profiling.is_enabled())
+        self.profile_alloc_checkbox = QCheckBox("Medir memoria (más lento)")
+        self.profile_reset_button = QPushButton("Limpiar")
+        self.profile_save_button = QPushButton("Guardar Trace")
+        profile_buttons.addWidget(self.profile_checkbox)
+        profile_buttons.addWidget(self.profile_alloc_checkbox)
+        profile_buttons.addWidget(self.profile_reset_button)
+        profile_buttons.addWidget(self.profile_save_button)
+        profile_layout.addLayout(profile_buttons)
+        self.profile_table = QTableWidget(0, len(PROFILE_COLUMNS))
+        self.profile_table.setHorizontalHeaderLabels([title for title, _ in PROFILE_COLUMNS])
+        self.profile_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.profile_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        profile_layout.addWidget(self.profile_table)
+        self.plot_tabs.addTab(profile_tab, "Perfil")
+        self.profile_timer = QTimer(self)
+        self.profile_timer.setInterval(1000)
+        self.profile_timer.timeout.connect(self.update_profile_table)
+        self.profile_checkbox.toggled.connect(self.toggle_profiling)
+        self.profile_alloc_checkbox.toggled.connect(self.toggle_profiling)
+        self.profile_reset_button.clicked.connect(self.reset_profile)
+        self.profile_save_button.clicked.connect(self.save_profile_trace)
+        if profiling.is_enabled():
+            self.profile_timer.start()
+        # DAWSITO_PROFILE: donde guardar el trace al cerrar (ver __main__)
+        self.profile_path = None
 
         plot_container = QVBoxLayout()
         plot_container.addWidget(QLabel("Visualización De La Señal"))
-        plot_container.addWidget(self.plot_canvas)
+        plot_container.addWidget(self.plot_tabs, stretch=3)
+        plot_container.addWidget(QLabel("Analizador De Espectro (lo que suena)"))
+        plot_container.addWidget(self.analyzer_canvas, stretch=1)
 
         plot_widget = QWidget()
         plot_widget.setLayout(plot_container)
@@ -56,6 +197,32 @@ class Dawsito(QMainWindow):
         btn_layout.addWidget(self.save_button)
         btn_layout.addWidget(self.reset_button)
         control_layout.addLayout(btn_layout)
+        # sesion: la cadena y lo ya renderizado, para seguir despues sin renderizar de nuevo
+        session_layout = QHBoxLayout()
+        self.open_session_button = QPushButton("Abrir Sesión")
+        self.save_session_button = QPushButton("Guardar Sesión")
+        self.embed_source_checkbox = QCheckBox("Guardar el original adentro")
+        session_layout.addWidget(self.open_session_button)
+        session_layout.addWidget(self.save_session_button)
+        session_layout.addWidget(self.embed_source_checkbox)
+        control_layout.addLayout(session_layout)
+        self.downmix_checkbox = QCheckBox("Convertir a mono al cargar")
+        control_layout.addWidget(self.downmix_checkbox)
+        self.spill_checkbox = QCheckBox("Trabajar en disco (archivos muy largos)")
+        control_layout.addWidget(self.spill_checkbox)
+        # reverb y filtros repartidos en hilos (el render ya va en otro hilo)
+        self.parallel_checkbox = QCheckBox(f"Usar todos los núcleos ({os.cpu_count()})")
+        self.parallel_checkbox.toggled.connect(
+            lambda checked: parallel.set_workers(None if checked else 1))
+        control_layout.addWidget(self.parallel_checkbox)
+        rate_layout = QHBoxLayout()
+        rate_layout.addWidget(QLabel("Frecuencia del proyecto:"))
+        self.rate_combo = QComboBox()
+        self.rate_combo.addItem("La del archivo", None)
+        for rate in COMMON_RATES:
+            self.rate_combo.addItem(f"{rate} Hz", rate)
+        rate_layout.addWidget(self.rate_combo)
+        control_layout.addLayout(rate_layout)
 
         playback_group = QGroupBox("Controles De Reproducción")
         playback_layout = QHBoxLayout()
@@ -65,6 +232,8 @@ class Dawsito(QMainWindow):
         playback_layout.addWidget(self.play_original_btn)
         playback_layout.addWidget(self.play_processed_btn)
         playback_layout.addWidget(self.stop_playback_btn)
+        self.preview_checkbox = QCheckBox(f"Vista previa rápida ({PREVIEW_RATE} Hz)")
+        playback_layout.addWidget(self.preview_checkbox)
         playback_group.setLayout(playback_layout)
         control_layout.addWidget(playback_group)
 
@@ -75,6 +244,9 @@ class Dawsito(QMainWindow):
         control_layout.addWidget(QLabel("Volumen de Reproducción:"))
         control_layout.addWidget(self.volume_slider)
         control_layout.addWidget(self.volume_label)
+        # contadores del callback de audio mientras se reproduce
+        self.playback_stats_label = QLabel("")
+        control_layout.addWidget(self.playback_stats_label)
 
         filters_group = QGroupBox("Filtros del Audio")
         filters_layout = QVBoxLayout()
@@ -155,12 +327,86 @@ class Dawsito(QMainWindow):
         reverb_group.setLayout(reverb_layout)
         control_layout.addWidget(reverb_group)
 
+        # el resto de los efectos del registro, con controles armados de sus Param
+        more_group = QGroupBox("Más Efectos")
+        more_layout = QVBoxLayout()
+        self.more_effect_combo = QComboBox()
+        self.more_effect_stack = QStackedWidget()
+        # {tipo: {nombre: (param, control, label)}}
+        self.more_effect_controls = {}
+        for effect_type in available_effects():
+            if effect_type not in HAND_MADE_EFFECTS:
+                plugin = get_effect(effect_type)
+                self.more_effect_combo.addItem(plugin.label, effect_type)
+                self.more_effect_stack.addWidget(self.build_param_controls(plugin))
+        self.apply_more_effect = QPushButton("Aplicar Efecto")
+        more_layout.addWidget(self.more_effect_combo)
+        more_layout.addWidget(self.more_effect_stack)
+        more_layout.addWidget(self.apply_more_effect)
+        more_group.setLayout(more_layout)
+        control_layout.addWidget(more_group)
+
+        chain_group = QGroupBox("Cadena De Efectos")
+        chain_layout = QVBoxLayout()
+        self.effect_list = QListWidget()
+        chain_layout.addWidget(QLabel("Selecciona un efecto y dale Aplicar para cambiarlo:"))
+        chain_layout.addWidget(self.effect_list)
+        chain_btn_layout = QHBoxLayout()
+        self.undo_button = QPushButton("Deshacer")
+        self.redo_button = QPushButton("Rehacer")
+        self.remove_effect_button = QPushButton("Quitar Efecto")
+        chain_btn_layout.addWidget(self.undo_button)
+        chain_btn_layout.addWidget(self.redo_button)
+        chain_btn_layout.addWidget(self.remove_effect_button)
+        chain_layout.addLayout(chain_btn_layout)
+        chain_group.setLayout(chain_layout)
+        control_layout.addWidget(chain_group)
+
+        render_layout = QHBoxLayout()
+        self.render_status_label = QLabel("")
+        self.render_progress = QProgressBar()
+        self.render_progress.setRange(0, 100)
+        self.render_progress.setVisible(False)
+        self.cancel_render_button = QPushButton("Cancelar")
+        self.cancel_render_button.setVisible(False)
+        render_layout.addWidget(self.render_status_label)
+        render_layout.addWidget(self.render_progress)
+        render_layout.addWidget(self.cancel_render_button)
+        control_layout.addLayout(render_layout)
+
         self.audio_processor = AudioProcessor()
         self.current_volume = 0.8
 
+        # la reproduccion pasa la cadena en tiempo real, los sliders se escuchan
+        # mientras suena (sin esperar al render)
+        self.player = Player()
+        self.player.set_volume(self.current_volume)
+        self.playing_processed = False
+        self.playback_timer = QTimer(self)
+        self.playback_timer.setInterval(500)
+        self.playback_timer.timeout.connect(self.update_playback_stats)
+        self.analyzer_timer = QTimer(self)
+        self.analyzer_timer.setInterval(33)
+        self.analyzer_timer.timeout.connect(self.update_analyzer)
+
+        self.spectrogram_worker = SpectrogramWorker(self)
+        self.spectrogram_worker.computed.connect(self.on_spectrogram_computed)
+
+        # los renders van en otro hilo, aca solo llegan los resultados
+        self.renderer = BackgroundRenderer(self.audio_processor, self)
+        self.renderer.progress.connect(self.render_progress.setValue)
+        self.renderer.rendered.connect(self.on_render_finished)
+        self.renderer.failed.connect(self.on_render_failed)
+        self.renderer.busy_changed.connect(self.on_render_busy)
+        self.cancel_render_button.clicked.connect(self.renderer.cancel)
+        # el ultimo efecto agregado mientras se renderiza, para no duplicarlo
+        self.pending_add = None
+
         self.load_button.clicked.connect(self.load_audio)
         self.save_button.clicked.connect(self.save_audio)
         self.reset_button.clicked.connect(self.reset_audio)
+        self.open_session_button.clicked.connect(self.open_session)
+        self.save_session_button.clicked.connect(self.save_session)
         self.play_original_btn.clicked.connect(self.play_original_audio)
         self.play_processed_btn.clicked.connect(self.play_processed_audio)
         self.stop_playback_btn.clicked.connect(self.stop_audio_playback)
@@ -179,45 +425,322 @@ class Dawsito(QMainWindow):
 
         self.reverb_decay_slider.valueChanged.connect(self.update_reverb_decay_label)
         self.reverb_mix_slider.valueChanged.connect(self.update_reverb_mix_label)
-        self.apply_reverb.clicked.connect(self.on_apply_reverb)
 
-    def update_waveforms(self):
-        self.ax_waveform_original.clear()
-        self.ax_waveform_processed.clear()
+        # mientras suena el procesado, mover un slider cambia lo que se escucha
+        self.lowpass_slider.valueChanged.connect(lambda: self.preview_effect('lowpass'))
+        self.highpass_slider.valueChanged.connect(lambda: self.preview_effect('highpass'))
+        self.bandpass_low_slider.valueChanged.connect(lambda: self.preview_effect('bandpass'))
+        self.bandpass_high_slider.valueChanged.connect(lambda: self.preview_effect('bandpass'))
+        self.bandstop_low_slider.valueChanged.connect(lambda: self.preview_effect('bandstop'))
+        self.bandstop_high_slider.valueChanged.connect(lambda: self.preview_effect('bandstop'))
+        self.reverb_decay_slider.valueChanged.connect(lambda: self.preview_effect('reverb'))
+        self.reverb_mix_slider.valueChanged.connect(lambda: self.preview_effect('reverb'))
+        self.apply_reverb.clicked.connect(self.on_apply_reverb)
+        self.more_effect_combo.currentIndexChanged.connect(self.more_effect_stack.setCurrentIndex)
+        self.apply_more_effect.clicked.connect(self.on_apply_more_effect)
 
-        if self.audio_processor.original_audio is not None:
-            audio = self.audio_processor.original_audio
-            self.ax_waveform_original.plot(audio, color='blue', linewidth=0.5)
-            self.ax_waveform_original.set_title("Original")
+        self.undo_button.clicked.connect(self.on_undo)
+        self.redo_button.clicked.connect(self.on_redo)
+        self.remove_effect_button.clicked.connect(self.on_remove_effect)
 
-        if self.audio_processor.audio_data is not None:
-            audio = self.audio_processor.audio_data
-            self.ax_waveform_processed.plot(audio, color='green', linewidth=0.5)
-            self.ax_waveform_processed.set_title("Procesada")
+    @profiling.profiled('ui.update_waveforms')
+    def update_waveforms(self):
+        """Redibuja todo (al cargar un audio): arma las piramides y resetea el zoom"""
+        original = self.audio_processor.original_audio
+        self.original_view.set_audio(original)
+
+        processed = self.audio_processor.audio_data
+        self.processed_view.set_audio(processed,
+                                      self.original_view.pyramid if processed is original else None)
+        self.renderer.pyramid = self.processed_view.pyramid
+
+        if original is not None:
+            self.ax_waveform_original.set_xlim(0, len(original))
+            self.ax_waveform_original.set_ylim(-1.05, 1.05)
+            limit = max(self.processed_view.peak(), 1.0) * 1.05
+            self.ax_waveform_processed.set_ylim(-limit, limit)
+
+        self.plot_canvas.draw_idle()
+
+    def update_spectrograms(self, original_changed=False):
+        """
+        Pide los espectrogramas que falten. El procesado reusa el del original
+        si es el mismo buffer, y si no arranca del procesado anterior para
+        recalcular solo lo que cambio
+        """
+        original = self.audio_processor.original_audio
+        processed = self.audio_processor.audio_data
+        sample_rate = self.audio_processor.sample_rate
+        if original is None:
+            return
+        if original_changed:
+            # recien cargado el procesado es una copia del original
+            self.spectrograms = {}
+            self.spectrogram_worker.submit('original', original, sample_rate)
+            return
+        if processed is original:
+            # sin efectos: cuando este el del original se usa ese
+            if 'original' in self.spectrograms:
+                self.spectrogram_worker.submit('processed', processed, sample_rate,
+                                               previous=self.spectrograms['original'])
+        else:
+            previous = self.spectrograms.get('processed') or self.spectrograms.get('original')
+            self.spectrogram_worker.submit('processed', processed, sample_rate, previous=previous)
+
+    def on_spectrogram_computed(self, key, spectrogram):
+        self.spectrograms[key] = spectrogram
+        image = self.spectrogram_images[key]
+        image.set_data(spectrogram.image)
+        image.set_extent(spectrogram.extent)
+        left, right, bottom, top = spectrogram.extent
+        self.ax_spectrogram_original.set_xlim(left, right)
+        self.ax_spectrogram_original.set_ylim(bottom, top)
+        self.spectrogram_canvas.draw_idle()
+        if key == 'original' and 'processed' not in self.spectrograms:
+            self.on_spectrogram_computed('processed', spectrogram)
+
+    def on_analyzer_draw(self, event):
+        self.analyzer_background = self.analyzer_canvas.copy_from_bbox(self.ax_analyzer.bbox)
+        self.ax_analyzer.draw_artist(self.analyzer_line)
+
+    def update_analyzer(self):
+        """Cada ~33 ms: fft de lo ultimo que salio por la placa y blit de la linea"""
+        if not self.player.is_playing:
+            self.analyzer_timer.stop()
+        if self.analyzer_background is None:
+            self.analyzer_canvas.draw_idle()
+            return
+        frequencies, levels = self.player.analyzer.spectrum(self.player.sample_rate)
+        self.analyzer_line.set_data(frequencies[1:], levels[1:])
+        self.analyzer_canvas.restore_region(self.analyzer_background)
+        self.ax_analyzer.draw_artist(self.analyzer_line)
+        self.analyzer_canvas.blit(self.ax_analyzer.bbox)
+
+    @profiling.profiled('ui.update_processed_waveform')
+    def update_processed_waveform(self, pyramid=None):
+        """
+        Solo cambio el procesado: se pinta con blit. pyramid: sus picos si ya
+        los calculo el hilo del render (si no se calculan aca)
+        """
+        processed = self.audio_processor.audio_data
+        original = self.audio_processor.original_audio
+        if processed is original:
+            pyramid = self.original_view.pyramid
+        self.processed_view.set_audio(processed, pyramid)
+        self.renderer.pyramid = self.processed_view.pyramid
+
+        # si el efecto se paso de la escala hay que agrandarla (dibujo completo)
+        peak = self.processed_view.peak()
+        if peak > self.ax_waveform_processed.get_ylim()[1]:
+            self.ax_waveform_processed.set_ylim(-peak * 1.05, peak * 1.05)
+            self.plot_canvas.draw_idle()
+            return
+        self.blit_processed()
 
-        self.plot_canvas.draw()
+    def blit_processed(self):
+        if self.processed_background is None:
+            self.plot_canvas.draw_idle()
+            return
+        self.plot_canvas.restore_region(self.processed_background)
+        self.ax_waveform_processed.draw_artist(self.processed_view.line)
+        self.plot_canvas.blit(self.ax_waveform_processed.bbox)
+
+    def on_plot_draw(self, event):
+        # despues de cada dibujo completo guardamos el fondo del eje procesado
+        self.processed_background = self.plot_canvas.copy_from_bbox(self.ax_waveform_processed.bbox)
+        self.ax_waveform_processed.draw_artist(self.processed_view.line)
+        self.plot_canvas.blit(self.ax_waveform_processed.bbox)
+
+    def on_plot_xlim_changed(self, ax):
+        self.original_view.refresh()
+        self.processed_view.refresh()
+
+    def on_plot_scroll(self, event):
+        """Rueda: zoom alrededor del mouse. Shift + rueda: moverse de costado"""
+        if self.audio_processor.original_audio is None or event.xdata is None:
+            return
+        total = len(self.audio_processor.original_audio)
+        start, end = self.ax_waveform_original.get_xlim()
+        width = end - start
+        if event.key == 'shift':
+            shift = -width * 0.1 * event.step
+            start, end = start + shift, end + shift
+        else:
+            scale = 0.8 ** event.step
+            width = min(max(width * scale, 64), total)
+            ratio = (event.xdata - start) / (end - start)
+            start = event.xdata - ratio * width
+            end = start + width
+        # que no se salga del audio
+        offset = max(0, -start) - max(0, end - total)
+        self.ax_waveform_original.set_xlim(start + offset, end + offset)
+        self.plot_canvas.draw_idle()
+
+    def update_effect_list(self):
+        self.effect_list.clear()
+        for effect_type, params in self.audio_processor.chain.specs():
+            values = ", ".join(f"{key}={value}" for key, value in params.items())
+            self.effect_list.addItem(f"{effect_type} ({values})")
+        self.undo_button.setEnabled(self.audio_processor.chain.can_undo())
+        self.redo_button.setEnabled(self.audio_processor.chain.can_redo())
+
+    def apply_or_update_effect(self, effect_type, **params):
+        """
+        Si hay un efecto del mismo tipo seleccionado lo cambia, si no agrega uno
+        nuevo. Si le dan Aplicar otra vez mientras se renderiza el que acaban de
+        agregar, se cambia ese en vez de agregar otro
+        """
+        if self.audio_processor.audio_data is None:
+            raise ValueError("No hay audio!")
+
+        index = self.effect_list.currentRow()
+        specs = self.audio_processor.chain.specs()
+        if 0 <= index < len(specs) and specs[index][0] == effect_type:
+            self.renderer.submit(lambda processor: processor.chain.update(index, **params))
+        elif self.pending_add is not None and self.pending_add['effect_type'] == effect_type:
+            pending = self.pending_add
+            self.renderer.submit(lambda processor: processor.chain.update(pending['index'],
+                                                                          **params))
+        else:
+            pending = {'effect_type': effect_type}
+
+            def add(processor):
+                pending['index'] = processor.chain.add(effect_type, **params)
+
+            self.pending_add = pending
+            self.renderer.submit(add)
+
+    def on_render_busy(self, busy):
+        self.render_progress.setVisible(busy)
+        self.cancel_render_button.setVisible(busy)
+        if busy:
+            self.render_progress.setValue(0)
+            self.render_status_label.setText("Renderizando...")
+        else:
+            self.pending_add = None
+            self.update_effect_list()
+            if self.render_status_label.text() == "Renderizando...":
+                self.render_status_label.setText("Cancelado")
+
+    def on_render_finished(self, audio_data, pyramid):
+        if audio_data is not self.audio_processor.audio_data:
+            # de un render viejo (ej. de antes de cargar otro audio), ya viene otro
+            return
+        self.render_status_label.setText("Listo!")
+        self.update_effect_list()
+        self.update_spectrograms()
+        if self.playing_processed:
+            self.player.set_chain(self.audio_processor.chain.specs())
+        self.update_processed_waveform(pyramid)
+
+    def on_render_failed(self, message):
+        self.render_status_label.setText("")
+        self.update_effect_list()
+        self.update_spectrograms()
+        if self.playing_processed:
+            self.player.set_chain(self.audio_processor.chain.specs())
+        self.update_processed_waveform()
+        QMessageBox.critical(self, "Error", f"Fallamos aplicando el efecto:\n{message}")
+
+    def on_undo(self):
+        self.renderer.submit(lambda processor: processor.chain.undo())
+
+    def on_redo(self):
+        self.renderer.submit(lambda processor: processor.chain.redo())
+
+    def on_remove_effect(self):
+        index = self.effect_list.currentRow()
+        if index < 0:
+            QMessageBox.warning(self, "Pilas", "Selecciona el efecto que quieres quitar")
+            return
+        self.renderer.submit(lambda processor: processor.chain.remove(index))
 
     def update_volume(self, value):
         self.current_volume = value / 100
         self.volume_label.setText(f"Volumen: {value}%")
-
-    def play_audio_with_volume(self, audio_data):
-        if audio_data is None:
-            raise ValueError("No hay nada para reproducir!")
-        audio_with_volume = audio_data * self.current_volume
-        sd.stop()
-        sd.play(audio_with_volume, self.audio_processor.sample_rate)
+        self.player.set_volume(self.current_volume)
+
+    def slider_params(self, effect_type):
+        """Los parametros que tienen puestos los sliders de un efecto"""
+        if effect_type == 'lowpass':
+            return {'cutoff_freq': self.lowpass_slider.value()}
+        if effect_type == 'highpass':
+            return {'cutoff_freq': self.highpass_slider.value()}
+        if effect_type == 'bandpass':
+            return {'low_cut': self.bandpass_low_slider.value(),
+                    'high_cut': self.bandpass_high_slider.value()}
+        if effect_type == 'bandstop':
+            return {'low_cut': self.bandstop_low_slider.value(),
+                    'high_cut': self.bandstop_high_slider.value()}
+        if effect_type == 'reverb':
+            return {'decay_time': self.reverb_decay_slider.value() / 10,
+                    'mix': self.reverb_mix_slider.value() / 100}
+        if effect_type in self.more_effect_controls:
+            return {name: self.control_value(param, control)
+                    for name, (param, control, label) in self.more_effect_controls[effect_type].items()}
+        raise ValueError(f"Unknown effect type: {effect_type}")
+
+    def preview_effect(self, effect_type):
+        """
+        Manda al reproductor la cadena con este efecto como esta en los sliders:
+        si el seleccionado es de este tipo se cambia ese, si no se escucha como
+        si se agregara al final. Aplicar sigue siendo lo que lo deja en la cadena
+        """
+        if not (self.playing_processed and self.player.is_playing):
+            return
+        specs = self.audio_processor.chain.specs()
+        index = self.effect_list.currentRow()
+        if 0 <= index < len(specs) and specs[index][0] == effect_type:
+            specs[index] = (effect_type, dict(specs[index][1], **self.slider_params(effect_type)))
+        else:
+            specs.append((effect_type, self.slider_params(effect_type)))
+        try:
+            self.player.set_chain(specs)
+        except ValueError as e:
+            self.playback_stats_label.setText(f"No se puede escuchar asi: {e}")
+
+    def start_playback(self, processed):
+        audio = self.audio_processor.original_audio
+        effects = self.audio_processor.chain.specs() if processed else []
+        self.player.preview_rate = PREVIEW_RATE if self.preview_checkbox.isChecked() else None
+        self.player.play(audio, self.audio_processor.sample_rate, effects)
+        self.playing_processed = processed
+        self.playback_timer.start()
+        self.ax_analyzer.set_xlim(20, self.player.sample_rate / 2)
+        self.analyzer_canvas.draw_idle()
+        self.analyzer_timer.start()
+
+    def update_playback_stats(self):
+        if not self.player.is_playing:
+            self.playback_timer.stop()
+            self.playing_processed = False
+        stats = self.player.stats()
+        self.playback_stats_label.setText(
+            f"xruns: {stats['xruns']}  tarde: {stats['late_callbacks']}  "
+            f"CPU: {stats['cpu_load'] * 100:.0f}% (max {stats['max_cpu_load'] * 100:.0f}%)")
 
     def load_audio(self):
         filepath, _ = QFileDialog.getOpenFileName(self, "Abrir archivo de audio", "", "Audio Files (*.wav *.flac *.ogg *.aiff);;All Files (*)")
         if not filepath:
             return
         try:
-            self.audio_processor.load_audio(filepath)
+            # que no quede un render del audio anterior andando
+            self.renderer.wait()
+            # ni el espectrograma del audio anterior (puede leer de una sesion que se cierra)
+            self.spectrogram_worker.wait()
+            self.stop_audio_playback()
+            if self.spill_checkbox.isChecked() != self.audio_processor.spill_to_disk:
+                self.audio_processor.set_spill_to_disk(self.spill_checkbox.isChecked())
+            # se convierte al cargar, asi todo el proyecto (y los filtros) usan la misma
+            self.audio_processor.target_rate = self.rate_combo.currentData()
+            self.audio_processor.load_audio(filepath, downmix=self.downmix_checkbox.isChecked())
             duration = len(self.audio_processor.audio_data) / self.audio_processor.sample_rate
-            self.file_info_label.setText(f"Cargado!: {filepath.split('/')[-1]}\nDuración: {duration:.2f}s\nFrecuencia de muestreo: {self.audio_processor.sample_rate}Hz")
+            channels = self.audio_processor.audio_data.shape[1]
+            self.file_info_label.setText(f"Cargado!: {filepath.split('/')[-1]}\nDuración: {duration:.2f}s\nFrecuencia de muestreo: {self.audio_processor.sample_rate}Hz\nCanales: {channels}")
             QMessageBox.information(self, "Excelenteeee", "Audio cargado correctamente!")
+            self.update_effect_list()
             self.update_waveforms()
+            self.update_spectrograms(original_changed=True)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Esto no existe omeeee:\n{str(e)}")
 
@@ -234,22 +757,61 @@ class Dawsito(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Esto no se puede guardar:\n{str(e)}")
 
-    def reset_audio(self):
+    def open_session(self):
+        filepath, _ = QFileDialog.getOpenFileName(self, "Abrir sesión", "", f"Sesiones DAWsito (*{SESSION_EXTENSION});;All Files (*)")
+        if not filepath:
+            return
         try:
-            if self.audio_processor.reset_audio():
-                QMessageBox.information(self, "Eselente", "Cambios deshechos!")
-                self.update_waveforms()
-            else:
-                QMessageBox.warning(self, "Pero que pasa?", "Si no has subido nada, que vas a deshacer?")
+            self.renderer.wait()
+            # ni el espectrograma del audio anterior (puede leer de una sesion que se cierra)
+            self.spectrogram_worker.wait()
+            self.stop_audio_playback()
+            if self.spill_checkbox.isChecked() != self.audio_processor.spill_to_disk:
+                self.audio_processor.set_spill_to_disk(self.spill_checkbox.isChecked())
+            # si lo renderizado sigue valiendo no se renderiza nada, si no va en el hilo de fondo
+            self.audio_processor.load_session(filepath, render=False)
+            duration = len(self.audio_processor.original_audio) / self.audio_processor.sample_rate
+            channels = self.audio_processor.original_audio.shape[1]
+            self.file_info_label.setText(f"Sesión: {os.path.basename(filepath)}\nDuración: {duration:.2f}s\nFrecuencia de muestreo: {self.audio_processor.sample_rate}Hz\nCanales: {channels}")
+            self.update_effect_list()
+            self.update_waveforms()
+            self.update_spectrograms(original_changed=True)
+            if any(node.dirty for node in self.audio_processor.chain.nodes):
+                self.renderer.submit()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No pude abrir la sesión:\n{str(e)}")
+
+    def save_session(self):
+        if self.audio_processor.original_audio is None:
+            QMessageBox.warning(self, "Pilas!", "No hay nada para guardar, sube un audio primero.")
+            return
+        if self.renderer.is_busy():
+            QMessageBox.warning(self, "Pilas!", "Espera a que termine el render para guardar la sesión.")
+            return
+        filepath, _ = QFileDialog.getSaveFileName(self, "Guardar sesión", "", f"Sesiones DAWsito (*{SESSION_EXTENSION})")
+        if not filepath:
+            return
+        if not filepath.endswith(SESSION_EXTENSION):
+            filepath += SESSION_EXTENSION
+        try:
+            self.audio_processor.save_session(filepath,
+                                              embed_source=self.embed_source_checkbox.isChecked())
+            QMessageBox.information(self, "Bien!", "La sesión se guardó correctamente")
         except Exception as e:
-            QMessageBox.critical(self, "Paila!", f"Fallamos, no pude:\n{str(e)}")
+            QMessageBox.critical(self, "Error", f"No se pudo guardar la sesión:\n{str(e)}")
+
+    def reset_audio(self):
+        if self.audio_processor.original_audio is None:
+            QMessageBox.warning(self, "Pero que pasa?", "Si no has subido nada, que vas a deshacer?")
+            return
+        self.renderer.submit(lambda processor: processor.chain.clear())
 
     def play_original_audio(self):
         try:
             if self.audio_processor.original_audio is None:
                 QMessageBox.warning(self, "Pilaaas", "No has cargado nada")
                 return
-            self.play_audio_with_volume(self.audio_processor.original_audio)
+            self.start_playback(processed=False)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Reproducción fallida:\n{str(e)}")
 
@@ -258,13 +820,16 @@ class Dawsito(QMainWindow):
             if self.audio_processor.audio_data is None:
                 QMessageBox.warning(self, "Pilas", "No has procesado nada aún o-o")
                 return
-            self.play_audio_with_volume(self.audio_processor.audio_data)
+            # suena el original pasando por la cadena en vivo, no hace falta
+            # esperar a que termine el render
+            self.start_playback(processed=True)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Reproducción FALLIDA:\n{str(e)}")
 
     def stop_audio_playback(self):
         try:
-            sd.stop()
+            self.player.stop()
+            self.playing_processed = False
         except Exception as e:
             QMessageBox.critical(self, "Error", f"No pude parar:\n{str(e)}")
 
@@ -274,9 +839,7 @@ class Dawsito(QMainWindow):
     def on_apply_lowpass(self):
         try:
             cutoff = self.lowpass_slider.value()
-            self.audio_processor.apply_effect('lowpass', cutoff_freq=cutoff)
-            QMessageBox.information(self, "Excelente", "El filtro fue aplicado!")
-            self.update_waveforms()
+            self.apply_or_update_effect('lowpass', cutoff_freq=cutoff)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Fallamos aplicando el filtro:\n{str(e)}")
 
@@ -286,9 +849,7 @@ class Dawsito(QMainWindow):
     def on_apply_highpass(self):
         try:
             cutoff = self.highpass_slider.value()
-            self.audio_processor.apply_effect('highpass', cutoff_freq=cutoff)
-            QMessageBox.information(self, "Excelente", "El filtro fue aplicado!")
-            self.update_waveforms()
+            self.apply_or_update_effect('highpass', cutoff_freq=cutoff)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Fallamos aplicando el filtro:\n{str(e)}")
 
@@ -301,9 +862,7 @@ class Dawsito(QMainWindow):
         try:
             low_cut = self.bandpass_low_slider.value()
             high_cut = self.bandpass_high_slider.value()
-            self.audio_processor.apply_effect('bandpass', low_cut=low_cut, high_cut=high_cut)
-            QMessageBox.information(self, "Excelente", "El filtro fue aplicado!")
-            self.update_waveforms()
+            self.apply_or_update_effect('bandpass', low_cut=low_cut, high_cut=high_cut)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Fallamos aplicando el filtro:\n{str(e)}")
 
@@ -316,9 +875,7 @@ class Dawsito(QMainWindow):
         try:
             low_cut = self.bandstop_low_slider.value()
             high_cut = self.bandstop_high_slider.value()
-            self.audio_processor.apply_effect('bandstop', low_cut=low_cut, high_cut=high_cut)
-            QMessageBox.information(self, "Excelente", "El filtro fue aplicado!")
-            self.update_waveforms()
+            self.apply_or_update_effect('bandstop', low_cut=low_cut, high_cut=high_cut)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Fallamos aplicando el filtro:\n{str(e)}")
 
@@ -333,18 +890,113 @@ class Dawsito(QMainWindow):
         try:
             decay_time = self.reverb_decay_slider.value() / 10
             mix = self.reverb_mix_slider.value() / 100
-            self.audio_processor.apply_effect('reverb', decay_time=decay_time, mix=mix)
-            QMessageBox.information(self, "Bieeen", "Reverb aplicaaao!")
-            self.update_waveforms()
+            self.apply_or_update_effect('reverb', decay_time=decay_time, mix=mix)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Fallamos Aplicando el reverb:\n{str(e)}")
 
+    def build_param_controls(self, plugin):
+        """
+        Un slider por cada Param con rango y un combo por cada uno con choices
+        (los que no tienen ni una cosa ni la otra quedan en su default)
+        """
+        widget = QWidget()
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        controls = {}
+        for param in plugin.params:
+            label = QLabel()
+            if param.choices is not None:
+                control = QComboBox()
+                for choice in param.choices:
+                    control.addItem(str(choice), choice)
+                control.setCurrentIndex(param.choices.index(param.default))
+                control.currentIndexChanged.connect(
+                    lambda _, effect_type=plugin.name: self.preview_effect(effect_type))
+            elif param.minimum is not None and param.maximum is not None:
+                control = QSlider(Qt.Horizontal)
+                control.setRange(*param_slider_range(param))
+                control.setValue(param_to_slider(param, param.default))
+                control.valueChanged.connect(
+                    lambda _, effect_type=plugin.name: self.update_param_labels(effect_type))
+                control.valueChanged.connect(
+                    lambda _, effect_type=plugin.name: self.preview_effect(effect_type))
+            else:
+                continue
+            layout.addWidget(label)
+            layout.addWidget(control)
+            controls[param.name] = (param, control, label)
+        widget.setLayout(layout)
+        self.more_effect_controls[plugin.name] = controls
+        self.update_param_labels(plugin.name)
+        return widget
+
+    @staticmethod
+    def control_value(param, control):
+        if isinstance(control, QComboBox):
+            return control.currentData()
+        return param_from_slider(param, control.value())
+
+    def update_param_labels(self, effect_type):
+        for param, control, label in self.more_effect_controls[effect_type].values():
+            text = f"{param.label}:"
+            if not isinstance(control, QComboBox):
+                text += f" {self.control_value(param, control):g} {param.unit}"
+            label.setText(text.rstrip())
+
+    def on_apply_more_effect(self):
+        effect_type = self.more_effect_combo.currentData()
+        try:
+            self.apply_or_update_effect(effect_type, **self.slider_params(effect_type))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Fallamos aplicando el efecto:\n{str(e)}")
+
+    def toggle_profiling(self):
+        if self.profile_checkbox.isChecked():
+            profiling.enable(allocations=self.profile_alloc_checkbox.isChecked())
+            self.profile_timer.start()
+        else:
+            profiling.disable()
+            self.profile_timer.stop()
+            self.update_profile_table()
+
+    def reset_profile(self):
+        profiling.reset()
+        self.update_profile_table()
+
+    def update_profile_table(self):
+        """Los totales por etapa, la mas cara arriba"""
+        stats = sorted(profiling.stats().items(), key=lambda item: -item[1]['wall_ms'])
+        self.profile_table.setRowCount(len(stats))
+        for row, (name, entry) in enumerate(stats):
+            for column, (title, text) in enumerate(PROFILE_COLUMNS):
+                item = QTableWidgetItem(name if text is None else text(entry))
+                if text is not None:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.profile_table.setItem(row, column, item)
+
+    def save_profile_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Guardar Trace", "trace.json",
+                                              "Chrome Trace (*.json)")
+        if not path:
+            return
+        try:
+            profiling.dump_chrome_trace(path)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudo guardar el trace:\n{str(e)}")
+
     def closeEvent(self, event):
+        self.renderer.wait()
+        self.spectrogram_worker.wait()
         self.stop_audio_playback()
+        if self.profile_path:
+            profiling.dump_chrome_trace(self.profile_path)
         event.accept()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    # DAWSITO_PROFILE=trace.json: mide desde el arranque y guarda al cerrar
+    profile_path = profiling.enable_from_env()
     daw = Dawsito()
+    daw.profile_path = profile_path
     daw.show()
     sys.exit(app.exec_())
\ No newline at end of file
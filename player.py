@@ -0,0 +1,290 @@
+import time
+from collections import deque
+import numpy as np
+import sounddevice as sd
+import profiling
+from effects.registry import create_stream_effect, get_effect
+from effects.resample import resample
+from spectrum import SpectrumAnalyzer
+
+# reproduccion en tiempo real: en vez de renderizar todo y pasarselo a sd.play,
+# el callback de un OutputStream va sacando bloques de la fuente y les pasa la
+# cadena de efectos por bloques (los create_stream del registro), asi los
+# cambios de volumen y de parametros se escuchan al toque
+
+# frames por callback, igual al tamaño de particion del StreamReverb
+PLAYER_BLOCK_SIZE = 1024
+# frecuencia de la vista previa rapida (los efectos cuestan la mitad o menos)
+PREVIEW_RATE = 22050
+
+def _ramp(frames):
+    """Rampa 0..1 para crossfades y cambios de volumen, (frames, 1)"""
+    return (np.arange(1, frames + 1, dtype=np.float32) / frames)[:, None]
+
+class _Bypass:
+    """Lo que suena en lugar de un efecto que no existe por bloques (ej. normalize)"""
+    def reset(self):
+        pass
+
+    def process(self, block):
+        return block
+
+class Player:
+    """
+    Reproduce un buffer (frames, canales) por un sd.OutputStream pasandolo por
+    una cadena de efectos con estado.
+
+    Desde la ventana solo se llama a play/stop/set_volume/set_chain, que dejan
+    mensajes en una deque (append/popleft son atomicos, el callback nunca se
+    queda esperando un lock). El callback los aplica al principio de cada
+    bloque suavizando los saltos:
+      - volumen: rampa a lo largo del bloque hacia el valor nuevo
+      - parametros en vivo (live_params del plugin, ej. mix del reverb): igual
+        que el volumen, sin tocar el impulso ni la cola
+      - otro efecto o parametro: el efecto viejo y el nuevo procesan el mismo
+        bloque y se hace crossfade (los filtros heredan el estado del viejo)
+    """
+    def __init__(self, block_size=PLAYER_BLOCK_SIZE, preview_rate=None):
+        self.block_size = block_size
+        # si esta puesta y el audio viene a mas, se escucha a esta frecuencia:
+        # la fuente se convierte una vez y la cadena corre mas barata
+        self.preview_rate = preview_rate
+        self._source_cache = None
+        self.stream = None
+        self.source = None
+        self.sample_rate = None
+        self.position = 0
+        self.volume = 0.8
+        self.specs = []
+        self._messages = deque()
+        # lo que sale por la placa, para el analizador de espectro
+        self.analyzer = SpectrumAnalyzer()
+        self.reset_stats()
+
+    # ---- lado de la ventana ----
+
+    def reset_stats(self):
+        self.callbacks = 0
+        self.xruns = 0
+        self.late_callbacks = 0
+        self.cpu_load = 0.0
+        self.max_cpu_load = 0.0
+
+    def stats(self):
+        """Contadores del callback: xruns que avisa PortAudio, callbacks que
+        tardaron mas que el bloque y carga (tiempo del callback / duracion del bloque)"""
+        return {'callbacks': self.callbacks, 'xruns': self.xruns,
+                'late_callbacks': self.late_callbacks, 'cpu_load': self.cpu_load,
+                'max_cpu_load': self.max_cpu_load,
+                'stream_cpu_load': self.stream.cpu_load if self.stream is not None else 0.0}
+
+    @property
+    def is_playing(self):
+        return self.stream is not None and self.stream.active
+
+    def _build(self, specs):
+        channels = self.source.shape[1]
+        return [create_stream_effect(effect_type, self.sample_rate, channels,
+                                     **self._fit_params(effect_type, params))
+                if get_effect(effect_type).streaming else _Bypass()
+                for effect_type, params in specs]
+
+    def _fit_params(self, effect_type, params):
+        """
+        En la vista previa las frecuencias por encima de la nueva Nyquist se
+        bajan hasta justo debajo (un pasa bajos a 20 kHz a 22050 Hz no cambia nada)
+        """
+        limit = 0.49 * self.sample_rate
+        hertz = {param.name for param in get_effect(effect_type).params if param.unit == 'Hz'}
+        return {key: min(value, limit) if key in hertz and value is not None else value
+                for key, value in params.items()}
+
+    def play(self, audio, sample_rate, effects=(), start=0):
+        """
+        Arranca a reproducir audio (frames, canales) desde el frame start.
+        effects: lista de (effect_type, params) como los de EffectChain.specs()
+        """
+        self.stop()
+        if self.preview_rate and self.preview_rate < sample_rate:
+            start = start * self.preview_rate // sample_rate
+            audio = self._playable(audio, sample_rate, self.preview_rate)
+            sample_rate = self.preview_rate
+        else:
+            audio = self._playable(audio, sample_rate, sample_rate)
+        self.source = audio
+        self.sample_rate = sample_rate
+        self.position = start
+        self.specs = [(effect_type, dict(params)) for effect_type, params in effects]
+        self.effects = self._build(self.specs)
+        self.gain = self.volume
+        self._messages.clear()
+        self.analyzer.reset()
+        self.reset_stats()
+
+        self.stream = sd.OutputStream(samplerate=sample_rate, channels=audio.shape[1],
+                                      dtype='float32', blocksize=self.block_size,
+                                      callback=self._callback)
+        self.stream.start()
+
+    def _playable(self, audio, sample_rate, rate):
+        """
+        La fuente como array en memoria a rate, se guarda la ultima para no
+        convertir en cada play. Una fuente de sesion (ChunkedAudio) se
+        descomprime aca entera: el callback no puede leer el archivo ni esperar
+        los locks de la sesion
+        """
+        if rate == sample_rate and isinstance(audio, np.ndarray):
+            return audio
+        cache = self._source_cache
+        if cache is None or cache[0] is not audio or cache[1] != rate:
+            cache = (audio, rate, resample(np.asarray(audio), sample_rate, rate))
+            self._source_cache = cache
+        return cache[2]
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self._messages.append(('volume', volume))
+
+    def set_chain(self, effects):
+        """
+        Cambia la cadena que se esta escuchando. Si solo cambio un efecto se
+        reemplaza ese nodo (o solo sus live_params si fue eso), si cambio la forma
+        de la cadena se hace crossfade entre la cadena vieja y la nueva.
+        Los efectos nuevos se crean aca (disenar filtros e impulsos no es para
+        el callback), al callback solo le llegan listos
+        """
+        specs = [(effect_type, dict(params)) for effect_type, params in effects]
+        if self.stream is None or specs == self.specs:
+            self.specs = specs
+            return
+
+        changed = [i for i, (old, new) in enumerate(zip(self.specs, specs)) if old != new]
+        if len(specs) == len(self.specs) and len(changed) == 1:
+            index = changed[0]
+            (old_type, old_params), (new_type, new_params) = self.specs[index], specs[index]
+            plugin = get_effect(new_type)
+            live = set(plugin.live_params) if plugin.streaming else set()
+            if old_type == new_type and live and (
+                    {k: v for k, v in old_params.items() if k not in live}
+                    == {k: v for k, v in new_params.items() if k not in live}):
+                resolved = plugin.resolve(new_params)
+                for name in sorted(live):
+                    self._messages.append(('param', index, name, resolved[name]))
+            else:
+                self._messages.append(('effect', index, self._build([specs[index]])[0]))
+        else:
+            self._messages.append(('chain', self._build(specs)))
+        self.specs = specs
+
+    # ---- lado del callback (hilo de audio) ----
+
+    def _apply_messages(self):
+        """
+        Aplica los mensajes pendientes. Devuelve el volumen con el que arranca
+        el bloque, los efectos viejos a mezclar por indice, los valores viejos
+        de los live_params que cambiaron ({indice: {nombre: valor}}) y la
+        cadena vieja si se cambio la cadena entera
+        """
+        start_gain = self.gain
+        swaps = {}
+        params = {}
+        old_chain = None
+        while self._messages:
+            message = self._messages.popleft()
+            if message[0] == 'volume':
+                self.gain = message[1]
+            elif message[0] == 'param':
+                _, index, name, value = message
+                effect = self.effects[index]
+                params.setdefault(index, {}).setdefault(name, getattr(effect, name))
+                setattr(effect, name, value)
+            elif message[0] == 'effect':
+                _, index, effect = message
+                old = self.effects[index]
+                if getattr(old, 'zi', None) is not None and hasattr(effect, 'zi'):
+                    if old.sos.shape == effect.sos.shape:
+                        # mismo orden y tipo: el estado del viejo sirve de arranque
+                        effect.zi = old.zi.copy()
+                swaps.setdefault(index, old)
+                self.effects[index] = effect
+            elif message[0] == 'chain':
+                if old_chain is None:
+                    old_chain = self.effects
+                self.effects = message[1]
+                swaps = {}
+                params = {}
+        return start_gain, swaps, params, old_chain
+
+    @staticmethod
+    def _run_chain(effects, block, ramp, swaps=None, params=None):
+        for index, effect in enumerate(effects):
+            if params and index in params:
+                # el parametro va como rampa dentro del bloque y despues queda fijo
+                targets = {name: getattr(effect, name) for name in params[index]}
+                for name, old in params[index].items():
+                    setattr(effect, name, old + (targets[name] - old) * ramp)
+                output = effect.process(block)
+                for name, target in targets.items():
+                    setattr(effect, name, target)
+            else:
+                output = effect.process(block)
+            if swaps and index in swaps:
+                old_output = swaps[index].process(block)
+                output = old_output + (output - old_output) * ramp
+            block = output
+        return block
+
+    def _callback(self, outdata, frames, time_info, status):
+        if not profiling.is_enabled():
+            self._fill(outdata, frames, status)
+            return
+        # record_realtime y no stage(): aca no se puede esperar un lock
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            self._fill(outdata, frames, status)
+        finally:
+            profiling.record_realtime('player.callback', started, cpu_started, frames,
+                                      self.sample_rate)
+
+    def _fill(self, outdata, frames, status):
+        started = time.perf_counter()
+        if status.output_underflow:
+            self.xruns += 1
+
+        block = self.source[self.position:self.position + frames]
+        count = len(block)
+        self.position += count
+        if count < frames:
+            block = np.concatenate([block, np.zeros((frames - count, block.shape[1]),
+                                                    dtype=block.dtype)])
+
+        ramp = _ramp(frames)
+        start_gain, swaps, params, old_chain = self._apply_messages()
+        output = self._run_chain(self.effects, block, ramp, swaps, params)
+        if old_chain is not None:
+            old_output = self._run_chain(old_chain, block, ramp)
+            output = old_output + (output - old_output) * ramp
+
+        if start_gain != self.gain:
+            output = output * (start_gain + (self.gain - start_gain) * ramp)
+        else:
+            output = output * self.gain
+        np.clip(output, -1.0, 1.0, out=outdata)
+        self.analyzer.push(outdata)
+
+        self.callbacks += 1
+        load = (time.perf_counter() - started) * self.sample_rate / frames
+        self.cpu_load = 0.9 * self.cpu_load + 0.1 * load
+        self.max_cpu_load = max(self.max_cpu_load, load)
+        if load > 1.0:
+            self.late_callbacks += 1
+
+        if count < frames:
+            # se termino el audio (la cola del reverb se corta aca)
+            raise sd.CallbackStop()
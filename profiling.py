@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from functools import wraps
+
+# medicion de las partes calientes (efectos, reverb, guardar, dibujar...).
+# cada parte va envuelta en stage("nombre") o @profiled("nombre"); apagado
+# stage() devuelve siempre el mismo objeto que no hace nada, asi que lo unico
+# que cuesta es mirar un booleano.
+#
+# prendido se guarda por cada llamada: tiempo de reloj, tiempo de CPU del
+# hilo, bytes reservados (solo con allocations=True, usa tracemalloc que hace
+# todo bastante mas lento) y cuantos segundos de audio paso (para el "x RT").
+# los eventos ya estan en el formato de chrome://tracing / Perfetto.
+#
+#     DAWSITO_PROFILE=trace.json python main.py      (se guarda al cerrar)
+#     python batch.py cadena.json "*.wav" -o out/ --profile trace.json
+
+# eventos guardados como mucho (una sesion larga no llena la memoria),
+# los totales por etapa siguen contando aunque se descarten eventos viejos
+MAX_EVENTS = 200000
+# eventos del hilo de audio que esperan a que alguien llame a stats()/events()
+# (~4 minutos de callbacks de 1024 frames a 44.1 kHz)
+MAX_REALTIME_EVENTS = 10000
+
+_enabled = False
+_allocations = False
+_lock = threading.Lock()
+_events = deque(maxlen=MAX_EVENTS)
+_totals = {}
+_local = threading.local()
+_thread_names = {}
+# el callback de audio no puede esperar _lock (la ventana lo toma en stats())
+# ni usar tracemalloc: sus eventos van a esta deque (append es atomico) y se
+# pasan a _events la proxima vez que se piden los eventos o los totales
+_realtime = deque(maxlen=MAX_REALTIME_EVENTS)
+
+class _NullStage:
+    """Lo que devuelve stage() apagado"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def _alloc_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+class _Stage:
+    def __init__(self, name, frames, sample_rate, args):
+        self.name = name
+        self.args = args
+        if frames is not None:
+            self.args['frames'] = int(frames)
+        if sample_rate is not None:
+            self.args['sample_rate'] = int(sample_rate)
+
+    def set(self, **args):
+        """Agrega datos al evento desde adentro (ej. frames cuando recien se saben)"""
+        self.args.update(args)
+
+    def __enter__(self):
+        self.tracking = _allocations and tracemalloc.is_tracing()
+        if self.tracking:
+            # el pico de tracemalloc es uno solo: cada etapa lo reinicia y le
+            # pasa a la de afuera el maximo que vio (ver __exit__)
+            current, peak = tracemalloc.get_traced_memory()
+            stack = _alloc_stack()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            self.memory = {'start': current, 'peak': current}
+            stack.append(self.memory)
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        args = self.args
+        args['cpu_ms'] = cpu * 1000
+        if self.tracking:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = _alloc_stack()
+            self.memory['peak'] = max(self.memory['peak'], peak)
+            stack.pop()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], self.memory['peak'])
+            tracemalloc.reset_peak()
+            args['alloc_bytes'] = self.memory['peak'] - self.memory['start']
+        if 'frames' in args and args.get('sample_rate') and wall > 0:
+            args['realtime'] = args['frames'] / args['sample_rate'] / wall
+        if exc[0] is not None:
+            args['error'] = exc[0].__name__
+
+        thread = threading.current_thread()
+        event = {'name': self.name, 'ph': 'X', 'ts': self.start * 1e6, 'dur': wall * 1e6,
+                 'pid': os.getpid(), 'tid': thread.ident, 'args': args}
+        with _lock:
+            _thread_names[(event['pid'], thread.ident)] = thread.name
+            _events.append(event)
+            _accumulate(_totals, event)
+        return False
+
+def record_realtime(name, start, cpu_start, frames=None, sample_rate=None):
+    """
+    Como stage() pero para hilos de tiempo real (el callback de audio): sin
+    locks ni tracemalloc. start y cpu_start: time.perf_counter() y
+    time.thread_time() del principio de la etapa
+    """
+    if not _enabled:
+        return
+    wall = time.perf_counter() - start
+    args = {'cpu_ms': (time.thread_time() - cpu_start) * 1000}
+    if frames is not None:
+        args['frames'] = int(frames)
+    if sample_rate:
+        args['sample_rate'] = int(sample_rate)
+        if frames is not None and wall > 0:
+            args['realtime'] = frames / sample_rate / wall
+    thread = threading.current_thread()
+    _realtime.append(({'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': wall * 1e6,
+                       'pid': os.getpid(), 'tid': thread.ident, 'args': args}, thread.name))
+
+def _drain_realtime():
+    """Pasa los eventos de record_realtime a los normales (con _lock tomado)"""
+    while _realtime:
+        event, thread_name = _realtime.popleft()
+        _thread_names[(event['pid'], event['tid'])] = thread_name
+        _events.append(event)
+        _accumulate(_totals, event)
+
+def enable(allocations=False):
+    """Empieza a medir. allocations: tambien bytes reservados (tracemalloc, mas lento)"""
+    global _enabled, _allocations
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not allocations and _allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _allocations = allocations
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+    if _allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """Borra los eventos y los totales"""
+    with _lock:
+        _realtime.clear()
+        _events.clear()
+        _totals.clear()
+
+def enable_from_env(variable='DAWSITO_PROFILE'):
+    """
+    Si la variable de entorno tiene una ruta, prende la medicion y devuelve la
+    ruta donde guardar el trace (DAWSITO_PROFILE_ALLOC=1 mide tambien memoria)
+    """
+    path = os.environ.get(variable)
+    if path:
+        enable(allocations=os.environ.get(variable + '_ALLOC') == '1')
+    return path
+
+def stage(name, frames=None, sample_rate=None, **args):
+    """
+    Context manager para medir un pedazo de codigo:
+
+        with profiling.stage('reverb.convolve', frames=len(audio), sample_rate=sr):
+            ...
+
+    frames y sample_rate son opcionales, con los dos se calcula el realtime
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, frames, sample_rate, args)
+
+def profiled(name=None):
+    """Decorador: cada llamada es una etapa (por defecto con el nombre de la funcion)"""
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(stage_name, None, None, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _accumulate(totals, event):
+    args = event['args']
+    entry = totals.get(event['name'])
+    if entry is None:
+        entry = totals[event['name']] = {'calls': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0,
+                                         'max_ms': 0.0, 'alloc_bytes': 0, 'peak_alloc_bytes': 0,
+                                         'audio_seconds': 0.0, 'audio_wall_ms': 0.0}
+    wall_ms = event['dur'] / 1000
+    entry['calls'] += 1
+    entry['wall_ms'] += wall_ms
+    entry['cpu_ms'] += args.get('cpu_ms', 0.0)
+    entry['max_ms'] = max(entry['max_ms'], wall_ms)
+    alloc = args.get('alloc_bytes', 0)
+    entry['alloc_bytes'] += alloc
+    entry['peak_alloc_bytes'] = max(entry['peak_alloc_bytes'], alloc)
+    if args.get('sample_rate') and 'frames' in args:
+        entry['audio_seconds'] += args['frames'] / args['sample_rate']
+        entry['audio_wall_ms'] += wall_ms
+
+def summarize(events):
+    """
+    Totales por etapa de una lista de eventos: llamadas, ms de reloj y de CPU,
+    la llamada mas lenta, bytes reservados y realtime (segundos de audio /
+    segundos que tardo, solo las llamadas que dijeron cuanto audio era)
+    """
+    totals = {}
+    for event in events:
+        if event.get('ph') == 'X':
+            _accumulate(totals, event)
+    return _finish(totals)
+
+def _finish(totals):
+    result = {}
+    for name, entry in totals.items():
+        entry = dict(entry)
+        audio_wall = entry.pop('audio_wall_ms')
+        entry['realtime'] = (entry['audio_seconds'] / (audio_wall / 1000)
+                             if audio_wall > 0 else None)
+        result[name] = entry
+    return result
+
+def stats():
+    """Los totales por etapa desde que se prendio (o desde reset)"""
+    with _lock:
+        _drain_realtime()
+        return _finish({name: dict(entry) for name, entry in _totals.items()})
+
+def events():
+    """Los eventos guardados (formato chrome trace, 'ph': 'X')"""
+    with _lock:
+        _drain_realtime()
+        return list(_events) + [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': name}}
+                                for (pid, tid), name in _thread_names.items()]
+
+def dump_chrome_trace(path, trace_events=None):
+    """Guarda los eventos para abrir en chrome://tracing o ui.perfetto.dev"""
+    trace_events = events() if trace_events is None else trace_events
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                   'otherData': {'stages': summarize(trace_events)}}, f)
+
+def dump_json(path, trace_events=None):
+    """Solo los totales por etapa, para comparar corridas"""
+    trace_events = events() if trace_events is None else trace_events
+    with open(path, 'w') as f:
+        json.dump(summarize(trace_events), f, indent=2)
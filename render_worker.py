@@ -0,0 +1,183 @@
+import threading
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from effect_chain import RenderCancelled
+from spectrum import Spectrogram
+from waveform import PeakPyramid
+
+# los renders van en un hilo aparte asi la ventana no se congela.
+# los cambios a la cadena se encolan y los aplica el hilo del render, y si
+# llega un pedido nuevo el render que esta corriendo se cancela.
+# los espectrogramas tambien se calculan aparte, en otro hilo
+
+class _RenderJob(QRunnable):
+    def __init__(self, renderer, cancel_event):
+        super().__init__()
+        self.renderer = renderer
+        self.cancel_event = cancel_event
+
+    def run(self):
+        self.renderer._run(self.cancel_event)
+
+class BackgroundRenderer(QObject):
+    """
+    Renderiza la cadena del AudioProcessor en un QThreadPool de un solo hilo.
+    Las señales se emiten desde el hilo del render, Qt las entrega en el hilo
+    de la ventana (conexion en cola)
+    """
+    progress = pyqtSignal(int)
+    # (audio, piramide de picos o None si el audio es el original)
+    rendered = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+    busy_changed = pyqtSignal(bool)
+
+    def __init__(self, processor, parent=None):
+        super().__init__(parent)
+        self.processor = processor
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._cancel_event = None
+        # la piramide del procesado que esta mostrando la ventana (la pone
+        # ella): la del proximo render sale de esta recalculando lo que cambio
+        self.pyramid = None
+
+    def submit(self, operation=None):
+        """
+        Encola un cambio (funcion que recibe el processor) y pide un render.
+        Si habia un render en curso se cancela, el nuevo sigue desde donde quedo
+        """
+        with self._lock:
+            if operation is not None:
+                self._pending.append(operation)
+            if self._cancel_event is not None:
+                self._cancel_event.set()
+            self._cancel_event = threading.Event()
+            cancel_event = self._cancel_event
+
+        self.busy_changed.emit(True)
+        self.pool.start(_RenderJob(self, cancel_event))
+
+    def cancel(self):
+        """Corta el render en curso (los cambios ya aplicados quedan en la cadena)"""
+        with self._lock:
+            if self._cancel_event is not None:
+                self._cancel_event.set()
+
+    def is_busy(self):
+        """Si hay un render en curso o en la cola"""
+        with self._lock:
+            return self._cancel_event is not None
+
+    def wait(self):
+        """Cancela y espera a que el hilo termine (antes de cargar otro audio)"""
+        self.cancel()
+        self.pool.waitForDone()
+        with self._lock:
+            self._pending = []
+        # puede ser de un buffer que se va a soltar (ej. la sesion que se cierra)
+        self.pyramid = None
+
+    def _peaks(self, audio):
+        """
+        La piramide de picos del buffer nuevo, aca y no en la ventana (en un
+        archivo largo es cerca de un segundo). Sale de la que se esta
+        mostrando, solo se recalculan los pedazos que cambiaron. None si es
+        el original (la ventana usa la suya)
+        """
+        if audio is self.processor.original_audio:
+            return None
+        base = self.pyramid
+        if base is None or len(base.audio) != len(audio):
+            return PeakPyramid(audio)
+        if base.audio is audio:
+            return base
+        return base.updated(audio)
+
+    def _run(self, cancel_event):
+        def callback(fraction):
+            if cancel_event.is_set():
+                raise RenderCancelled()
+            self.progress.emit(int(fraction * 100))
+
+        try:
+            if cancel_event.is_set():
+                # ya hay un job mas nuevo en la cola, ese aplica los cambios
+                return
+
+            with self._lock:
+                operations, self._pending = self._pending, []
+
+            for operation in operations:
+                operation(self.processor)
+            audio = self.processor.render(callback=callback)
+            pyramid = self._peaks(audio)
+            if not cancel_event.is_set():
+                self.rendered.emit(audio, pyramid)
+        except RenderCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(str(e))
+        finally:
+            with self._lock:
+                if self._cancel_event is cancel_event:
+                    self._cancel_event = None
+                    self.busy_changed.emit(False)
+
+class _SpectrogramJob(QRunnable):
+    def __init__(self, worker, key, generation, audio, sample_rate, previous):
+        super().__init__()
+        self.worker = worker
+        self.key = key
+        self.generation = generation
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self.previous = previous
+
+    def run(self):
+        self.worker._run(self)
+
+class SpectrogramWorker(QObject):
+    """
+    Calcula espectrogramas (spectrum.Spectrogram) en su propio hilo, uno por
+    clave ('original', 'procesado'). Si llega otro pedido para la misma clave
+    el anterior se abandona. previous: el espectrograma del buffer anterior,
+    solo se recalculan las columnas que cambiaron
+    """
+    computed = pyqtSignal(str, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self._lock = threading.Lock()
+        self._generations = {}
+
+    def submit(self, key, audio, sample_rate, previous=None):
+        with self._lock:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+        self.pool.start(_SpectrogramJob(self, key, generation, audio, sample_rate, previous))
+
+    def wait(self):
+        """Abandona lo pendiente y espera al hilo"""
+        with self._lock:
+            for key in self._generations:
+                self._generations[key] += 1
+        self.pool.waitForDone()
+
+    def _run(self, job):
+        def cancelled():
+            with self._lock:
+                return self._generations.get(job.key) != job.generation
+
+        if cancelled():
+            return
+        previous = job.previous
+        if previous is not None and previous.sample_rate == job.sample_rate:
+            spectrogram = previous.updated(job.audio, cancelled)
+        else:
+            spectrogram = Spectrogram(job.audio, job.sample_rate)
+            spectrogram.compute(cancelled)
+        if not cancelled():
+            self.computed.emit(job.key, spectrogram)
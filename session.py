@@ -0,0 +1,271 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+# archivo de sesion (.dawsito): la referencia a la fuente, la cadena de efectos
+# y el audio ya renderizado en float32 sin perder nada (save_audio recorta a
+# [-1, 1] y pasa a 16 bits). Al reabrir no hay que volver a renderizar.
+#
+# formato, todo seguido en un solo archivo:
+#   MAGIC
+#   pedazos de audio: CHUNK_FRAMES frames float32 (frames, canales), con los
+#   bytes de cada float separados en 4 planos (exponentes con exponentes,
+#   comprime mucho mejor) y comprimidos con zlib
+#   indice json: metadata + por cada stream (sample_rate, canales y
+#   (offset, bytes, frames) de cada pedazo)
+#   largo del indice (8 bytes little endian) + MAGIC
+# el indice va al final asi se puede escribir pedazo a pedazo sin saber el
+# largo de antemano; al abrir se lee solo el indice y los pedazos se
+# descomprimen cuando alguien pide ese rango (ChunkedAudio).
+#
+# FLAC no sirve aca: es de enteros (hasta 24 bits), el float32 no volveria igual
+
+SESSION_EXTENSION = '.dawsito'
+SESSION_VERSION = 1
+MAGIC = b'DAWSITO\x01'
+_FOOTER = struct.Struct('<Q')
+# 65536 frames son ~1.5 s a 44.1 kHz: un rango chico no descomprime de mas
+CHUNK_FRAMES = 65536
+# zlib 1: casi lo mismo que 6 comprimiendo audio y varias veces mas rapido
+DEFAULT_COMPRESSION = 1
+# pedazos ya descomprimidos que se guarda cada ChunkedAudio
+DECODED_CACHE = 16
+
+def _encode(block, level):
+    block = np.ascontiguousarray(block, dtype=np.float32)
+    planes = block.view(np.uint8).reshape(-1, 4).T
+    return zlib.compress(np.ascontiguousarray(planes).tobytes(), level)
+
+def _decode(data, frames, channels):
+    planes = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(4, -1)
+    return np.ascontiguousarray(planes.T).view(np.float32).reshape(frames, channels)
+
+class SessionWriter:
+    """
+    Escribe una sesion pedazo a pedazo (nunca arma una copia entera del audio).
+    Se escribe a un .part y se renombra en close(), asi una sesion a medias
+    nunca pisa a la anterior
+    """
+    def __init__(self, path, metadata=None, compression=DEFAULT_COMPRESSION):
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.compression = compression
+        self.streams = {}
+        self._partial_path = path + '.part'
+        self._file = open(self._partial_path, 'wb')
+        self._file.write(MAGIC)
+
+    def add_stream(self, name, audio, sample_rate, callback=None):
+        """
+        Agrega audio (frames, canales) o (frames,): un ndarray, un memmap o un
+        ChunkedAudio, se lee de a CHUNK_FRAMES. callback(fraccion) por pedazo
+        """
+        frames = len(audio)
+        channels = audio.shape[1] if len(audio.shape) > 1 else 1
+        chunks = []
+        for start in range(0, frames, CHUNK_FRAMES):
+            block = np.asarray(audio[start:start + CHUNK_FRAMES]).reshape(-1, channels)
+            data = _encode(block, self.compression)
+            chunks.append((self._file.tell(), len(data), len(block)))
+            self._file.write(data)
+            if callback is not None:
+                callback(min(start + CHUNK_FRAMES, frames) / frames)
+        self.streams[name] = {'frames': frames, 'channels': channels,
+                              'sample_rate': int(sample_rate), 'chunk_frames': CHUNK_FRAMES,
+                              'chunks': chunks}
+
+    def _finish(self):
+        """Escribe el indice y cierra el .part (sin moverlo)"""
+        index = json.dumps({'version': SESSION_VERSION, 'metadata': self.metadata,
+                            'streams': self.streams}).encode('utf-8')
+        self._file.write(index)
+        self._file.write(_FOOTER.pack(len(index)))
+        self._file.write(MAGIC)
+        self._file.close()
+
+    def close(self):
+        self._finish()
+        os.replace(self._partial_path, self.path)
+
+    def abort(self):
+        """Descarta lo escrito (si fallo algo a la mitad)"""
+        self._file.close()
+        if os.path.exists(self._partial_path):
+            os.remove(self._partial_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+class SessionFile:
+    """Una sesion abierta: metadata y los streams como ChunkedAudio (nada se lee hasta pedirlo)"""
+    def __init__(self, path):
+        self.path = path
+        # el reproductor lee desde el hilo de audio y la ventana desde el suyo
+        self._read_lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        """Abre el archivo y lee el indice (con _read_lock tomado o antes de compartirlo)"""
+        self._file = open(self.path, 'rb')
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            tail_size = _FOOTER.size + len(MAGIC)
+            if size < len(MAGIC) + tail_size or self._read(0, len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} no es una sesion de DAWsito")
+            tail = self._read(size - tail_size, tail_size)
+            if tail[_FOOTER.size:] != MAGIC:
+                raise ValueError(f"La sesion {self.path} esta incompleta")
+            index_size = _FOOTER.unpack(tail[:_FOOTER.size])[0]
+            index = json.loads(self._read(size - tail_size - index_size, index_size))
+            if index.get('version', 0) > SESSION_VERSION:
+                raise ValueError(f"La sesion {self.path} es de una version mas nueva "
+                                 f"({index['version']})")
+        except Exception:
+            self._file.close()
+            raise
+        self.metadata = index['metadata']
+        self._streams = index['streams']
+
+    def _read(self, offset, size):
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def read_bytes(self, offset, size):
+        with self._read_lock:
+            return self._read(offset, size)
+
+    def read_chunk(self, name, index):
+        """Los bytes comprimidos y los frames del pedazo index del stream name"""
+        with self._read_lock:
+            offset, size, frames = self._streams[name]['chunks'][index]
+            return self._read(offset, size), frames
+
+    def is_same_file(self, path):
+        return os.path.exists(path) and os.path.samefile(path, self.path)
+
+    def overwrite(self, writer):
+        """
+        Cierra writer encima de esta misma sesion (guardar sobre la que esta
+        abierta). En windows no se puede reemplazar un archivo abierto: se
+        suelta, se reemplaza y se vuelve a abrir, todo con _read_lock tomado,
+        asi los ChunkedAudio siguen leyendo su stream del archivo nuevo. Los
+        streams que escriba writer tienen que tener el mismo audio que los de
+        esta sesion con ese nombre (los que no escriba dejan de existir)
+        """
+        with self._read_lock:
+            writer._finish()
+            self._file.close()
+            try:
+                os.replace(writer._partial_path, self.path)
+            finally:
+                # si no se pudo reemplazar se vuelve a abrir el de antes
+                self._open()
+
+    @property
+    def streams(self):
+        return list(self._streams)
+
+    def audio(self, name):
+        """El stream como ChunkedAudio (o None si la sesion no lo tiene)"""
+        if name not in self._streams:
+            return None
+        return ChunkedAudio(self, name)
+
+    def read(self, name, start_seconds=0.0, end_seconds=None):
+        """Un rango de tiempo de un stream como float32 (frames, canales)"""
+        audio = self.audio(name)
+        start = int(start_seconds * audio.sample_rate)
+        end = len(audio) if end_seconds is None else int(end_seconds * audio.sample_rate)
+        return audio.read(start, end)
+
+    def close(self):
+        self._file.close()
+
+def open_session(path):
+    return SessionFile(path)
+
+class ChunkedAudio:
+    """
+    Un stream de la sesion que se comporta como un array (frames, canales)
+    float32 de solo lectura para lo que hace el resto del programa: len,
+    shape, audio[a:b] (descomprime solo esos pedazos) y np.asarray(audio)
+    (descomprime todo)
+    """
+    dtype = np.dtype(np.float32)
+    ndim = 2
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+        info = session._streams[name]
+        self.sample_rate = info['sample_rate']
+        self.chunk_frames = info['chunk_frames']
+        self.shape = (info['frames'], info['channels'])
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.shape[0] * self.shape[1] * 4
+
+    def _chunk(self, index):
+        with self._lock:
+            block = self._decoded.get(index)
+            if block is not None:
+                self._decoded.move_to_end(index)
+                return block
+        # por nombre y no por offset: si la sesion se pisa (overwrite) el pedazo cambia de lugar
+        data, frames = self.session.read_chunk(self.name, index)
+        block = _decode(data, frames, self.shape[1])
+        block.flags.writeable = False
+        with self._lock:
+            self._decoded[index] = block
+            while len(self._decoded) > DECODED_CACHE:
+                self._decoded.popitem(last=False)
+        return block
+
+    def read(self, start, end):
+        """Los frames [start, end) como un array nuevo"""
+        start, end = max(start, 0), min(end, len(self))
+        output = np.empty((max(end - start, 0), self.shape[1]), dtype=np.float32)
+        position = start
+        while position < end:
+            index = position // self.chunk_frames
+            block = self._chunk(index)
+            offset = position - index * self.chunk_frames
+            count = min(len(block) - offset, end - position)
+            output[position - start:position - start + count] = block[offset:offset + count]
+            position += count
+        return output
+
+    def __getitem__(self, key):
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        if not isinstance(key, slice):
+            index = key + len(self) if key < 0 else key
+            if not 0 <= index < len(self):
+                raise IndexError(f"frame {key} fuera de rango")
+            frame = self.read(index, index + 1)[0]
+            return frame[rest] if rest else frame
+        start, stop, step = key.indices(len(self))
+        block = self.read(start, stop) if step == 1 else self.read(0, len(self))[key]
+        return block[(slice(None),) + rest] if rest else block
+
+    def __array__(self, dtype=None, copy=None):
+        audio = self.read(0, len(self))
+        return audio if dtype is None else audio.astype(dtype, copy=False)
@@ -0,0 +1,186 @@
+import numpy as np
+import profiling
+
+# vistas en frecuencia: espectrograma (STFT) guardado como imagen chiquita en
+# dB y el analizador de espectro que se alimenta de lo que esta sonando
+
+# ventana y salto de la STFT
+STFT_SIZE = 2048
+STFT_HOP = 512
+# tamaño de la imagen guardada: columnas (tiempo) y filas (frecuencia) maximas
+MAX_COLUMNS = 2000
+MAX_ROWS = 256
+# cuantas columnas se calculan de una vez (para no armar todos los frames juntos)
+COLUMN_CHUNK = 64
+# piso en dB para la imagen y el analizador
+FLOOR_DB = -120.0
+
+def _mono(audio):
+    return audio if audio.ndim == 1 else audio.mean(axis=1)
+
+def _to_db(magnitude):
+    return (20 * np.log10(np.maximum(magnitude, 10 ** (FLOOR_DB / 20)))).astype(np.float32)
+
+class Spectrogram:
+    """
+    STFT de un buffer decimada a MAX_COLUMNS x MAX_ROWS: cada columna es el
+    maximo de los frames que le tocan y cada fila el maximo de sus bins, asi
+    un transitorio corto o un tono no desaparecen al achicar.
+    Se calcula por tramos de columnas, con compute_columns() se puede rehacer
+    solo un pedazo (ver changed_columns)
+    """
+    def __init__(self, audio, sample_rate, fft_size=STFT_SIZE, hop=STFT_HOP,
+                 max_columns=MAX_COLUMNS, max_rows=MAX_ROWS):
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.hop = hop
+        self.max_columns = max_columns
+        self.max_rows = max_rows
+        self.length = len(audio)
+
+        total_frames = max(-(-self.length // hop), 1)
+        self.frames_per_column = max(-(-total_frames // max_columns), 1)
+        # muestras que cubre cada columna
+        self.column_span = self.frames_per_column * hop
+        self.columns = max(-(-self.length // self.column_span), 1)
+
+        bins = fft_size // 2 + 1
+        self.bins_per_row = max(-(-bins // max_rows), 1)
+        self.rows = -(-bins // self.bins_per_row)
+        self.window = np.hanning(fft_size).astype(np.float32)
+        # que un seno a escala completa de 0 dB
+        self.scale = 2.0 / self.window.sum()
+
+        self.image = np.full((self.rows, self.columns), FLOOR_DB, dtype=np.float32)
+
+    @property
+    def extent(self):
+        """(izquierda, derecha, abajo, arriba) en segundos y Hz para imshow"""
+        return (0.0, self.columns * self.column_span / self.sample_rate,
+                0.0, self.sample_rate / 2)
+
+    def compute(self, cancelled=None):
+        """Calcula la imagen entera. cancelled(): si devuelve True se deja a medias"""
+        self.compute_columns(0, self.columns, cancelled)
+        return self.image
+
+    def compute_columns(self, first, last, cancelled=None):
+        """Recalcula las columnas [first, last) de a COLUMN_CHUNK"""
+        for chunk_first in range(first, last, COLUMN_CHUNK):
+            if cancelled is not None and cancelled():
+                return False
+            chunk_last = min(chunk_first + COLUMN_CHUNK, last)
+            with profiling.stage('spectrogram.columns',
+                                 frames=(chunk_last - chunk_first) * self.column_span,
+                                 sample_rate=self.sample_rate):
+                self.image[:, chunk_first:chunk_last] = self._columns(chunk_first, chunk_last)
+        return True
+
+    def _columns(self, first, last):
+        hop, size = self.hop, self.fft_size
+        frames = (last - first) * self.frames_per_column
+        # cada frame queda centrado en su salto, como en scipy con boundary
+        start = first * self.column_span - size // 2
+        end = start + (frames - 1) * hop + size
+
+        segment = np.zeros(end - start, dtype=np.float32)
+        source_start, source_end = max(start, 0), min(end, self.length)
+        if source_end > source_start:
+            segment[source_start - start:source_end - start] = _mono(
+                self.audio[source_start:source_end])
+
+        framed = np.lib.stride_tricks.sliding_window_view(segment, size)[::hop][:frames]
+        magnitude = np.abs(np.fft.rfft(framed * self.window, axis=1)) * self.scale
+
+        # (frames, bins) -> (filas, columnas) con maximos
+        columns = magnitude.reshape(last - first, self.frames_per_column, -1).max(axis=1)
+        padded_bins = self.rows * self.bins_per_row
+        if padded_bins > columns.shape[1]:
+            columns = np.pad(columns, ((0, 0), (0, padded_bins - columns.shape[1])))
+        rows = columns.reshape(last - first, self.rows, self.bins_per_row).max(axis=2)
+        return _to_db(rows.T)
+
+    def changed_columns(self, audio):
+        """
+        Columnas donde audio es distinto al buffer que ya esta calculado
+        (mas una de cada lado, la ventana pisa a las vecinas)
+        """
+        if len(audio) != self.length or audio.shape[1:] != self.audio.shape[1:]:
+            return np.ones(self.columns, dtype=bool)
+        changed = np.zeros(self.columns, dtype=bool)
+        span = self.column_span
+        for column in range(self.columns):
+            start, end = column * span, min((column + 1) * span, self.length)
+            changed[column] = not np.array_equal(self.audio[start:end], audio[start:end])
+        changed[1:] |= changed[:-1].copy()
+        changed[:-1] |= changed[1:].copy()
+        return changed
+
+    def updated(self, audio, cancelled=None):
+        """
+        Spectrogram para un buffer nuevo que reusa las columnas que no
+        cambiaron (despues de un efecto que toca solo un pedazo)
+        """
+        changed = self.changed_columns(audio)
+        result = Spectrogram(audio, self.sample_rate, self.fft_size, self.hop,
+                             self.max_columns, self.max_rows)
+        if result.image.shape != self.image.shape or changed.all():
+            result.compute(cancelled)
+            return result
+
+        result.image[:] = self.image
+        # tramos seguidos de columnas cambiadas
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], changed.view(np.int8), [0]])))
+        for first, last in zip(edges[::2], edges[1::2]):
+            if not result.compute_columns(first, last, cancelled):
+                break
+        return result
+
+class SpectrumAnalyzer:
+    """
+    Guarda lo ultimo que salio por el callback de audio en un buffer circular
+    (mono, ya reservado) y calcula el espectro cuando lo pide la ventana.
+    El callback solo copia, la fft corre en el hilo de la ventana
+    """
+    def __init__(self, fft_size=4096, history=1 << 15):
+        self.fft_size = fft_size
+        self.buffer = np.zeros(history, dtype=np.float32)
+        self.written = 0
+        self.window = np.hanning(fft_size).astype(np.float32)
+        self.scale = 2.0 / self.window.sum()
+        # suavizado entre cuadros para que no tiemble tanto
+        self.smoothed = None
+
+    def reset(self):
+        self.buffer[:] = 0.0
+        self.written = 0
+        self.smoothed = None
+
+    def push(self, block):
+        """Desde el callback de audio: block (frames, canales)"""
+        mono = block.mean(axis=1) if block.ndim > 1 else block
+        size = len(self.buffer)
+        mono = mono[-size:]
+        start = self.written % size
+        first = min(len(mono), size - start)
+        self.buffer[start:start + first] = mono[:first]
+        self.buffer[:len(mono) - first] = mono[first:]
+        self.written += len(mono)
+
+    def latest(self):
+        """Las ultimas fft_size muestras en orden (puede cruzarse con un push, solo es para ver)"""
+        size = len(self.buffer)
+        end = self.written % size
+        return np.roll(self.buffer, -end)[-self.fft_size:]
+
+    def spectrum(self, sample_rate, smoothing=0.6):
+        """(frecuencias, dB) de lo ultimo que sono"""
+        magnitude = np.abs(np.fft.rfft(self.latest() * self.window)) * self.scale
+        if self.smoothed is None or len(self.smoothed) != len(magnitude):
+            self.smoothed = magnitude
+        else:
+            # sube al toque y baja de a poco, como los analizadores de los DAW
+            self.smoothed = np.maximum(magnitude, self.smoothed * smoothing)
+        frequencies = np.fft.rfftfreq(self.fft_size, 1.0 / sample_rate)
+        return frequencies, _to_db(self.smoothed)
@@ -0,0 +1,200 @@
+import numpy as np
+import profiling
+
+# dibujar la forma de onda muestra por muestra con matplotlib es lentisimo,
+# asi que guardamos min/max por bloques a varias resoluciones (como los
+# archivos de picos que usan los DAW) y dibujamos un par min/max por pixel
+
+# de a cuantas muestras se arma el primer nivel y cuanto se achica cada nivel
+BASE_BLOCK = 256
+LEVEL_FACTOR = 4
+# pedazos para recorrer el audio sin hacer copias enteras
+BUILD_CHUNK = 1 << 20
+# bloques del primer nivel que se comparan juntos al buscar lo que cambio
+COMPARE_BLOCKS = 64
+
+def _envelope(audio):
+    """min y max por muestra juntando todos los canales"""
+    if audio.ndim == 1:
+        return audio, audio
+    # canal por canal: min(axis=1) con 2 u 8 columnas es unas 40 veces mas lento
+    low = np.array(audio[:, 0])
+    high = low.copy()
+    for channel in range(1, audio.shape[1]):
+        np.minimum(low, audio[:, channel], out=low)
+        np.maximum(high, audio[:, channel], out=high)
+    return low, high
+
+def _reduce(mins, maxs, factor):
+    """Junta de a factor bloques (el ultimo puede quedar incompleto)"""
+    starts = np.arange(0, len(mins), factor)
+    return np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)
+
+class PeakPyramid:
+    """
+    min/max por bloques de BASE_BLOCK, BASE_BLOCK * 4, BASE_BLOCK * 16...
+    Se arma una vez por buffer; si se edita un pedazo se actualiza con update()
+    """
+    def __init__(self, audio, base_block=BASE_BLOCK, factor=LEVEL_FACTOR):
+        self.audio = audio
+        self.base_block = base_block
+        self.factor = factor
+        self.length = len(audio)
+
+        blocks = -(-self.length // base_block)
+        mins = np.empty(blocks, dtype=np.float32)
+        maxs = np.empty(blocks, dtype=np.float32)
+        with profiling.stage('waveform.pyramid', frames=self.length):
+            self._fill_base(mins, maxs, 0, self.length)
+
+        # levels[i] = (tamaño de bloque, mins, maxs)
+        self.levels = [(base_block, mins, maxs)]
+        while len(mins) > 1:
+            mins, maxs = _reduce(mins, maxs, factor)
+            self.levels.append((self.levels[-1][0] * factor, mins, maxs))
+
+    def _fill_base(self, mins, maxs, start, end):
+        """Calcula los bloques del primer nivel entre las muestras start y end"""
+        block = self.base_block
+        chunk = BUILD_CHUNK - BUILD_CHUNK % block
+        for chunk_start in range(start, end, chunk):
+            chunk_end = min(chunk_start + chunk, end)
+            low, high = _envelope(self.audio[chunk_start:chunk_end])
+            offsets = np.arange(0, chunk_end - chunk_start, block)
+            first = chunk_start // block
+            mins[first:first + len(offsets)] = np.minimum.reduceat(low, offsets)
+            maxs[first:first + len(offsets)] = np.maximum.reduceat(high, offsets)
+
+    def update(self, start, end, audio=None):
+        """
+        Recalcula solo los bloques que tocan [start, end) y los niveles de arriba.
+        audio: el buffer nuevo si cambio de objeto (mismo largo)
+        """
+        if audio is not None:
+            self.audio = audio
+        block = self.base_block
+        start = (start // block) * block
+        end = min(-(-end // block) * block, self.length)
+        _, mins, maxs = self.levels[0]
+        self._fill_base(mins, maxs, start, end)
+
+        first, last = start // block, -(-end // block)
+        for level in range(1, len(self.levels)):
+            previous_mins, previous_maxs = self.levels[level - 1][1:]
+            first, last = first // self.factor, -(-last // self.factor)
+            low = previous_mins[first * self.factor:last * self.factor]
+            high = previous_maxs[first * self.factor:last * self.factor]
+            level_mins, level_maxs = _reduce(low, high, self.factor)
+            self.levels[level][1][first:first + len(level_mins)] = level_mins
+            self.levels[level][2][first:first + len(level_maxs)] = level_maxs
+
+    def updated(self, audio):
+        """
+        PeakPyramid para un buffer nuevo que reusa los bloques donde el audio
+        no cambio (ej. un compresor que solo toca los picos). Esta no se toca,
+        puede ser la de otra vista
+        """
+        if len(audio) != self.length or audio.shape[1:] != self.audio.shape[1:]:
+            return PeakPyramid(audio, self.base_block, self.factor)
+        result = PeakPyramid.__new__(PeakPyramid)
+        result.audio = audio
+        result.base_block = self.base_block
+        result.factor = self.factor
+        result.length = self.length
+        result.levels = [(block, mins.copy(), maxs.copy()) for block, mins, maxs in self.levels]
+
+        span = self.base_block * COMPARE_BLOCKS
+        with profiling.stage('waveform.pyramid_update', frames=self.length):
+            # tramos seguidos de pedazos distintos, cada uno con un solo update
+            run_start = None
+            for start in range(0, self.length, span):
+                end = min(start + span, self.length)
+                if np.array_equal(self.audio[start:end], audio[start:end]):
+                    if run_start is not None:
+                        result.update(run_start, start)
+                        run_start = None
+                elif run_start is None:
+                    run_start = start
+            if run_start is not None:
+                result.update(run_start, self.length)
+        return result
+
+    def peaks(self, start, end, columns):
+        """
+        Devuelve (x, mins, maxs) con mas o menos un par por columna entre las
+        muestras start y end. Con mucho zoom devuelve las muestras tal cual
+        """
+        start = max(int(start), 0)
+        end = min(int(np.ceil(end)), self.length)
+        if end <= start:
+            empty = np.zeros(0, dtype=np.float32)
+            return empty, empty, empty
+
+        samples_per_column = (end - start) / max(columns, 1)
+        if samples_per_column < self.base_block:
+            low, high = _envelope(self.audio[start:end])
+            if samples_per_column < 2:
+                return np.arange(start, end), low, high
+            # mas de una muestra por pixel: min/max por columna directo de las
+            # muestras (una linea con miles de segmentos encimados es lentisima en Agg)
+            group = int(samples_per_column)
+            low, high = _reduce(low, high, group)
+            return start + np.arange(len(low)) * group, low, high
+
+        # el nivel mas grueso que igual tenga un bloque por columna o menos
+        block, mins, maxs = self.levels[0]
+        for level_block, level_mins, level_maxs in self.levels:
+            if level_block > samples_per_column:
+                break
+            block, mins, maxs = level_block, level_mins, level_maxs
+
+        first, last = start // block, -(-end // block)
+        group = max(1, (last - first) // max(columns, 1))
+        low, high = _reduce(mins[first:last], maxs[first:last], group)
+        x = (first + np.arange(len(low)) * group) * block
+        return x, low, high
+
+def zigzag(x, mins, maxs):
+    """Intercala min y max para dibujar todo con una sola linea"""
+    return np.repeat(x, 2), np.column_stack([mins, maxs]).ravel()
+
+class WaveformView:
+    """
+    Una forma de onda en un eje de matplotlib usando PeakPyramid.
+    animated: la linea no se dibuja con el resto de la figura, se pinta con
+    blit, asi cambiarla no obliga a redibujar los otros ejes
+    """
+    def __init__(self, ax, color, title, animated=False):
+        self.ax = ax
+        self.title = title
+        self.pyramid = None
+        self.line, = ax.plot([], [], color=color, linewidth=0.5, animated=animated)
+        ax.set_title(title)
+
+    def set_audio(self, audio, pyramid=None):
+        """Nuevo buffer, si ya hay piramide para el (ej. el original) se reusa"""
+        if audio is None:
+            self.pyramid = None
+        elif pyramid is not None:
+            self.pyramid = pyramid
+        elif self.pyramid is None or self.pyramid.audio is not audio:
+            # la de un render ya viene hecha desde su hilo (ver BackgroundRenderer)
+            self.pyramid = PeakPyramid(audio)
+        self.refresh()
+
+    def peak(self):
+        """Valor absoluto maximo del buffer (sale del ultimo nivel, no recorre el audio)"""
+        if self.pyramid is None:
+            return 0.0
+        _, mins, maxs = self.pyramid.levels[-1]
+        return float(max(-mins.min(), maxs.max()))
+
+    @profiling.profiled('waveform.refresh')
+    def refresh(self):
+        """Recalcula lo que se ve segun el zoom y el ancho en pixeles del eje"""
+        if self.pyramid is None:
+            self.line.set_data([], [])
+            return
+        start, end = self.ax.get_xlim()
+        columns = int(self.ax.bbox.width) or 1000
+        self.line.set_data(*zigzag(*self.pyramid.peaks(start, end, columns)))